@@ -0,0 +1,70 @@
+"""drop tag_b64 from journals + chat_messages
+
+The GCM tag is the last 16 bytes of the ciphertext; nothing reads the separate copy.
+Rows that instances older than d4a7c2f9e160 wrote during the rollout are copied to
+the binary columns first.
+
+Kept out of alembic/versions on purpose: the release that adds the binary columns
+runs `alembic upgrade head` while older instances still write tag_b64, so the drop
+ships in a later release, once every instance runs code that no longer writes it.
+To ship it, move this file into alembic/versions and point down_revision at the
+head of that release.
+
+Revision ID: e8b3f1d6a259
+Revises: c8f2d5a1e937
+Create Date: 2026-10-17 18:52:47.190356
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8b3f1d6a259'
+down_revision: Union[str, None] = 'c8f2d5a1e937'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ["journals", "chat_messages"]
+BATCH_SIZE = 5000
+
+def _has_column(conn, table, column):
+    return conn.execute(
+        text("SELECT 1 FROM information_schema.columns WHERE table_name=:t AND column_name=:c"),
+        {"t": table, "c": column},
+    ).first() is not None
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    with op.get_context().autocommit_block():
+        for table in TABLES:
+            after = 0
+            while True:
+                ids = conn.execute(text(f"""
+                    UPDATE {table} SET ciphertext = decode(ciphertext_b64, 'base64'), iv = decode(iv_b64, 'base64')
+                    WHERE id IN (
+                        SELECT id FROM {table}
+                        WHERE id > :after AND ciphertext IS NULL AND ciphertext_b64 IS NOT NULL
+                        ORDER BY id LIMIT :n
+                    )
+                    RETURNING id
+                """), {"after": after, "n": BATCH_SIZE}).scalars().all()
+                if not ids:
+                    break
+                after = max(ids)
+    for table in TABLES:
+        if _has_column(conn, table, "tag_b64"):
+            op.drop_column(table, "tag_b64")
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    for table in reversed(TABLES):
+        op.add_column(table, sa.Column("tag_b64", sa.String(length=64), nullable=True))
+        conn.execute(text(f"""
+            UPDATE {table} SET tag_b64 = encode(substring(c FROM octet_length(c) - 15), 'base64')
+            FROM (SELECT id AS cid, coalesce(ciphertext, decode(ciphertext_b64, 'base64')) AS c FROM {table}) src
+            WHERE {table}.id = src.cid
+        """))
@@ -0,0 +1,47 @@
+"""lexical feature columns on journals + chat_messages
+
+Revision ID: 7c41d2e9a0b3
+Revises: 2ead8977ecc9
+Create Date: 2026-10-17 09:12:31.402118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = '7c41d2e9a0b3'
+down_revision: Union[str, None] = '2ead8977ecc9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = [
+    ("word_count", sa.Integer()),
+    ("lexicon_counts", sa.Text()),
+    ("suicidality_hits", sa.Integer()),
+    ("weapon_hits", sa.Integer()),
+    ("stalking_hits", sa.Integer()),
+    ("digital_surveillance_hits", sa.Integer()),
+]
+
+def _has_column(conn, table, column):
+    return conn.execute(
+        text("SELECT 1 FROM information_schema.columns WHERE table_name=:t AND column_name=:c"),
+        {"t": table, "c": column},
+    ).first() is not None
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    # Nullable: legacy rows are filled by scripts/backfill_lexical_features.py
+    for table in ["journals", "chat_messages"]:
+        for col, typ in COLUMNS:
+            if not _has_column(conn, table, col):
+                op.add_column(table, sa.Column(col, typ, nullable=True))
+
+
+def downgrade() -> None:
+    for table in ["chat_messages", "journals"]:
+        for col, _ in reversed(COLUMNS):
+            op.drop_column(table, col)
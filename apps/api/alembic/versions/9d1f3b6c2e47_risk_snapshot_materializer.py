@@ -0,0 +1,44 @@
+"""risk_snapshots materializer columns
+
+Revision ID: 9d1f3b6c2e47
+Revises: 7c41d2e9a0b3
+Create Date: 2026-10-17 11:40:05.218734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = '9d1f3b6c2e47'
+down_revision: Union[str, None] = '7c41d2e9a0b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = [
+    ("reasons", sa.Text()),
+    ("rules_version", sa.String(length=16)),
+    ("watermark", sa.String(length=128)),
+    ("evaluated_at", sa.DateTime(timezone=True)),
+]
+
+def _has_column(conn, table, column):
+    return conn.execute(
+        text("SELECT 1 FROM information_schema.columns WHERE table_name=:t AND column_name=:c"),
+        {"t": table, "c": column},
+    ).first() is not None
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    for col, typ in COLUMNS:
+        if not _has_column(conn, "risk_snapshots", col):
+            op.add_column("risk_snapshots", sa.Column(col, typ, nullable=True))
+    op.execute("CREATE INDEX IF NOT EXISTS ix_risk_snapshots_user_created ON risk_snapshots (user_id, created_at)")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_risk_snapshots_user_created")
+    for col, _ in reversed(COLUMNS):
+        op.drop_column("risk_snapshots", col)
@@ -0,0 +1,41 @@
+"""indexes on journals.key_id + chat_messages.key_id
+
+Used when pruning data keys after a rotation (data_keys.prune). Built CONCURRENTLY so
+writes continue while they build.
+
+Revision ID: a6d2e9c4f183
+Revises: f1c5a8d3b742
+Create Date: 2026-10-17 21:17:40.582936
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = 'a6d2e9c4f183'
+down_revision: Union[str, None] = 'f1c5a8d3b742'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ["journals", "chat_messages"]
+
+def _has_index(conn, name):
+    return conn.execute(
+        text("SELECT to_regclass(:i)"),
+        {"i": name},
+    ).scalar() is not None
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    with op.get_context().autocommit_block():
+        for table in TABLES:
+            name = f"ix_{table}_key_id"
+            if not _has_index(conn, name):
+                op.create_index(name, table, ["key_id"], postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    for table in reversed(TABLES):
+        op.drop_index(f"ix_{table}_key_id", table_name=table)
@@ -0,0 +1,50 @@
+"""user_daily_stats rollup table
+
+Revision ID: b52e8a1f7d30
+Revises: 9d1f3b6c2e47
+Create Date: 2026-10-17 14:05:47.630912
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = 'b52e8a1f7d30'
+down_revision: Union[str, None] = '9d1f3b6c2e47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COUNTERS = [
+    "j_rows", "j_valid", "j_words", "j_mood_n", "j_mood_sum", "j_neg_lang_sum", "j_chunks",
+    "j_pos_hits", "j_neg30_hits", "j_baseline_neg",
+    "self_harm_rows", "self_harm_sticky_rows", "weapon_rows", "stalking_rows", "surveillance_rows",
+    "c_rows", "c_words", "c_sent_n", "c_neg_sum", "c_pos_n", "c_pos_sum", "c_flag_rows", "c_safety",
+    "c_intent_legal", "c_intent_support", "c_intent_incident",
+    "e_rows", "e_sent_n", "e_neg_sum", "e_pos_n", "e_pos_sum", "e_flag_rows", "e_risk_points_n",
+    "e_risk_points_sum", "e_threats_to_kill", "e_strangulation", "e_weapon_involved",
+    "e_children_present", "e_stalking", "e_digital_surveillance",
+]
+
+def _has_table(conn, table):
+    return conn.execute(
+        text("SELECT to_regclass(:t)"),
+        {"t": table},
+    ).scalar() is not None
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    # Empty after upgrade; fill with scripts/backfill_user_daily_stats.py
+    if not _has_table(conn, "user_daily_stats"):
+        op.create_table(
+            "user_daily_stats",
+            sa.Column("user_id", sa.String(64), primary_key=True),
+            sa.Column("day", sa.Date, primary_key=True),
+            *[sa.Column(c, sa.BigInteger, nullable=False, server_default="0") for c in COUNTERS],
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("user_daily_stats")
@@ -0,0 +1,49 @@
+"""version on user_data_keys, unique per user
+
+Numbers each user's data keys 1, 2, ... in creation order so concurrent creation of a
+user's first (or next) key conflicts on (user_id, version) instead of leaving two
+current keys.
+
+Revision ID: b7e4c1a9d2f5
+Revises: a6d2e9c4f183
+Create Date: 2026-10-18 10:12:36.804115
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e4c1a9d2f5'
+down_revision: Union[str, None] = 'a6d2e9c4f183'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def _has_column(conn, table, column):
+    return conn.execute(
+        text("SELECT 1 FROM information_schema.columns WHERE table_name=:t AND column_name=:c"),
+        {"t": table, "c": column},
+    ).first() is not None
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    if _has_column(conn, "user_data_keys", "version"):
+        return
+    op.add_column("user_data_keys", sa.Column("version", sa.Integer(), nullable=True))
+    conn.execute(text("""
+        UPDATE user_data_keys SET version = v.n
+        FROM (
+            SELECT key_id, row_number() OVER (PARTITION BY user_id ORDER BY created_at, key_id) AS n
+            FROM user_data_keys
+        ) v
+        WHERE user_data_keys.key_id = v.key_id
+    """))
+    op.alter_column("user_data_keys", "version", nullable=False)
+    op.create_unique_constraint("uq_user_data_keys_user_version", "user_data_keys", ["user_id", "version"])
+
+
+def downgrade() -> None:
+    op.drop_constraint("uq_user_data_keys_user_version", "user_data_keys", type_="unique")
+    op.drop_column("user_data_keys", "version")
@@ -0,0 +1,38 @@
+"""analysis_version on chat_messages and chat_events
+
+Revision ID: c3e9f4a7b821
+Revises: b52e8a1f7d30
+Create Date: 2026-10-17 16:22:31.904412
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3e9f4a7b821'
+down_revision: Union[str, None] = 'b52e8a1f7d30'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ["chat_messages", "chat_events"]
+
+def _has_column(conn, table, column):
+    return conn.execute(
+        text("SELECT 1 FROM information_schema.columns WHERE table_name=:t AND column_name=:c"),
+        {"t": table, "c": column},
+    ).first() is not None
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    # NULL on existing rows: scripts/reanalyze_chat.py analyzes and stamps them
+    for table in TABLES:
+        if not _has_column(conn, table, "analysis_version"):
+            op.add_column(table, sa.Column("analysis_version", sa.String(length=16), nullable=True))
+
+
+def downgrade() -> None:
+    for table in reversed(TABLES):
+        op.drop_column(table, "analysis_version")
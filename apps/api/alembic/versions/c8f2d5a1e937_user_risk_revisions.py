@@ -0,0 +1,41 @@
+"""user_risk_revisions: per-user counter in the risk watermark
+
+Deleting rows or rewriting them in place leaves MAX(id) alone, so the watermark that
+keys cached results, snapshots and incremental engine state did not change. Those
+paths bump this counter instead.
+
+Revision ID: c8f2d5a1e937
+Revises: b7e4c1a9d2f5
+Create Date: 2026-10-18 14:03:51.227408
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8f2d5a1e937'
+down_revision: Union[str, None] = 'b7e4c1a9d2f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def _has_table(conn, table):
+    return conn.execute(
+        text("SELECT to_regclass(:t)"),
+        {"t": table},
+    ).scalar() is not None
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    if not _has_table(conn, "user_risk_revisions"):
+        op.create_table(
+            "user_risk_revisions",
+            sa.Column("user_id", sa.String(64), primary_key=True),
+            sa.Column("revision", sa.BigInteger(), nullable=False, server_default="0"),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("user_risk_revisions")
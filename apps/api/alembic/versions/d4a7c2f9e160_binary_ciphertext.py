@@ -0,0 +1,89 @@
+"""binary ciphertext columns on journals + chat_messages
+
+Adds bytea `ciphertext`/`iv` next to the base64 text columns, makes those nullable
+(new rows fill them only while CIPHERTEXT_WRITE_BASE64 is on) and copies existing rows
+over in batches, each its own short transaction, so no table stays locked for the run.
+Readers prefer the binary columns and fall back to base64 (crypto.stored_ciphertext).
+
+tag_b64 only becomes nullable here; older instances keep writing it during the rollout.
+Dropping it (alembic/deferred/e8b3f1d6a259, which also copies rows those instances
+wrote meanwhile) ships in a later release, after every instance runs this code.
+
+Revision ID: d4a7c2f9e160
+Revises: c3e9f4a7b821
+Create Date: 2026-10-17 18:40:12.553109
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4a7c2f9e160'
+down_revision: Union[str, None] = 'c3e9f4a7b821'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ["journals", "chat_messages"]
+LEGACY_COLUMNS = ["ciphertext_b64", "iv_b64", "tag_b64"]
+BATCH_SIZE = 5000
+
+def _has_column(conn, table, column):
+    return conn.execute(
+        text("SELECT 1 FROM information_schema.columns WHERE table_name=:t AND column_name=:c"),
+        {"t": table, "c": column},
+    ).first() is not None
+
+def _backfill(conn, table):
+    after, copied = 0, 0
+    while True:
+        ids = conn.execute(text(f"""
+            UPDATE {table} SET ciphertext = decode(ciphertext_b64, 'base64'), iv = decode(iv_b64, 'base64')
+            WHERE id IN (
+                SELECT id FROM {table}
+                WHERE id > :after AND ciphertext IS NULL AND ciphertext_b64 IS NOT NULL
+                ORDER BY id LIMIT :n
+            )
+            RETURNING id
+        """), {"after": after, "n": BATCH_SIZE}).scalars().all()
+        if not ids:
+            return copied
+        after = max(ids)
+        copied += len(ids)
+        print(f"{table}: {copied} rows copied to binary columns (through id {after})")
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    for table in TABLES:
+        for col in ("ciphertext", "iv"):
+            if not _has_column(conn, table, col):
+                op.add_column(table, sa.Column(col, sa.LargeBinary(), nullable=True))
+        for col in LEGACY_COLUMNS:
+            op.alter_column(table, col, nullable=True)
+    # Commit the DDL, then one transaction per batch
+    with op.get_context().autocommit_block():
+        for table in TABLES:
+            _backfill(conn, table)
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    for table in reversed(TABLES):
+        # Rows written with CIPHERTEXT_WRITE_BASE64 off only have the binary columns
+        conn.execute(text(f"""
+            UPDATE {table} SET ciphertext_b64 = translate(encode(ciphertext, 'base64'), E'\\n', ''),
+                               iv_b64 = encode(iv, 'base64')
+            WHERE ciphertext_b64 IS NULL
+        """))
+        if _has_column(conn, table, "tag_b64"):
+            conn.execute(text(
+                f"UPDATE {table} SET tag_b64 = encode(substring(ciphertext FROM octet_length(ciphertext) - 15), 'base64')"
+                " WHERE tag_b64 IS NULL"
+            ))
+        for col in reversed(LEGACY_COLUMNS):
+            if _has_column(conn, table, col):
+                op.alter_column(table, col, nullable=False)
+        op.drop_column(table, "iv")
+        op.drop_column(table, "ciphertext")
@@ -0,0 +1,57 @@
+"""user_data_keys table + key_id on journals and chat_messages
+
+Revision ID: f1c5a8d3b742
+Revises: d4a7c2f9e160
+Create Date: 2026-10-17 20:03:18.227641
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1c5a8d3b742'
+down_revision: Union[str, None] = 'd4a7c2f9e160'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ["journals", "chat_messages"]
+
+def _has_table(conn, table):
+    return conn.execute(
+        text("SELECT to_regclass(:t)"),
+        {"t": table},
+    ).scalar() is not None
+
+def _has_column(conn, table, column):
+    return conn.execute(
+        text("SELECT 1 FROM information_schema.columns WHERE table_name=:t AND column_name=:c"),
+        {"t": table, "c": column},
+    ).first() is not None
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    if not _has_table(conn, "user_data_keys"):
+        op.create_table(
+            "user_data_keys",
+            sa.Column("key_id", sa.String(32), primary_key=True),
+            sa.Column("user_id", sa.String(64), nullable=False),
+            sa.Column("master_key_id", sa.String(32), nullable=False),
+            sa.Column("wrapped_key", sa.LargeBinary, nullable=False),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_user_data_keys_user_id", "user_data_keys", ["user_id"])
+    # NULL on existing rows: they stay encrypted under APP_ENC_KEY
+    for table in TABLES:
+        if not _has_column(conn, table, "key_id"):
+            op.add_column(table, sa.Column("key_id", sa.String(length=32), nullable=True))
+
+
+def downgrade() -> None:
+    # Rows written under per-user keys are unreadable afterwards; re-encrypt them first
+    for table in reversed(TABLES):
+        op.drop_column(table, "key_id")
+    op.drop_index("ix_user_data_keys_user_id", table_name="user_data_keys")
+    op.drop_table("user_data_keys")
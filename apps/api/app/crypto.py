@@ -1,20 +1,177 @@
-import base64, os, hashlib
+import base64, os, hashlib, lzma, threading, zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from .config import settings
+from .data_keys import data_keys
 
-# derive a 32-byte key from APP_ENC_KEY (dev); replace with KMS in prod
+# Key of rows written before per-user data keys (key_id NULL), derived from APP_ENC_KEY
 _key = hashlib.sha256(settings.APP_ENC_KEY.encode()).digest()
+# AESGCM holds only the key; one instance serves every call and thread
+_aes = AESGCM(_key)
 
-def encrypt_text(plain: str) -> tuple[str, str, str]:
-    aes = AESGCM(_key)
+# Batches of at least this many rows are split across threads (AES-GCM runs without
+# the GIL); smaller ones, and single-core hosts, stay on the calling thread
+PARALLEL_MIN_ROWS = settings.CRYPTO_PARALLEL_MIN_ROWS
+_workers = settings.CRYPTO_WORKERS or min(4, os.cpu_count() or 1)
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+# Plaintext of at least CRYPTO_COMPRESS_MIN_BYTES is compressed before encryption when that
+# makes it smaller, and stored as 0xFF, codec id, compressed bytes. 0xFF never occurs in
+# UTF-8, so uncompressed plaintext (every row written before this) needs no flag.
+_COMPRESSED = 0xFF
+_CODECS = {1: zlib, 2: lzma}
+_CODEC_IDS = {"zlib": 1, "lzma": 2}
+_codec_id = _CODEC_IDS.get(settings.CRYPTO_COMPRESSION)
+COMPRESS_MIN_BYTES = settings.CRYPTO_COMPRESS_MIN_BYTES
+if settings.CRYPTO_COMPRESSION and _codec_id is None:
+    print(f"[Crypto] Unknown CRYPTO_COMPRESSION {settings.CRYPTO_COMPRESSION!r}; writing uncompressed")
+
+def _pack(plain: str) -> bytes:
+    data = plain.encode("utf-8")
+    if _codec_id is None or len(data) < COMPRESS_MIN_BYTES:
+        return data
+    packed = bytes((_COMPRESSED, _codec_id)) + _CODECS[_codec_id].compress(data)
+    return packed if len(packed) < len(data) else data
+
+def _unpack(data: bytes) -> str:
+    if data[:1] == b"\xff":
+        codec = _CODECS.get(data[1])
+        if codec is None:
+            raise ValueError(f"Unknown compression codec {data[1]}")
+        data = codec.decompress(data[2:])
+    return data.decode("utf-8")
+
+def _seal(cipher: AESGCM, plain: str) -> tuple[bytes, bytes]:
     iv = os.urandom(12)
-    ct = aes.encrypt(iv, plain.encode("utf-8"), None)
+    return cipher.encrypt(iv, _pack(plain), None), iv
+
+def _open(cipher: AESGCM, ciphertext: Union[bytes, str], iv: Union[bytes, str]) -> str:
+    if isinstance(ciphertext, str):  # legacy base64 columns
+        ciphertext, iv = base64.b64decode(ciphertext), base64.b64decode(iv)
+    return _unpack(cipher.decrypt(bytes(iv), bytes(ciphertext), None))
+
+def _cipher(key_id: Optional[str]) -> AESGCM:
+    return _aes if key_id is None else data_keys.get(key_id)
+
+def encrypt_bytes(plain: str, key_id: Optional[str] = None) -> tuple[bytes, bytes]:
+    """(ciphertext, iv); the ciphertext ends with the 16-byte GCM tag."""
+    return _seal(_cipher(key_id), plain)
+
+def decrypt_bytes(ciphertext: bytes, iv: bytes, key_id: Optional[str] = None) -> str:
+    return _open(_cipher(key_id), ciphertext, iv)
+
+def encrypt_text(plain: str) -> tuple[str, str, str]:
+    ct, iv = encrypt_bytes(plain)
     tag = ct[-16:]
     return base64.b64encode(ct).decode(), base64.b64encode(iv).decode(), base64.b64encode(tag).decode()
 
 def decrypt_text(ciphertext_b64: str, iv_b64: str) -> str:
-    aes = AESGCM(_key)
-    ct = base64.b64decode(ciphertext_b64)
-    iv = base64.b64decode(iv_b64)
-    pt = aes.decrypt(iv, ct, None)
-    return pt.decode("utf-8")
+    return _open(_aes, ciphertext_b64, iv_b64)
+
+# --- storage (journals, chat_messages) ---
+# Ciphertext lives in the binary `ciphertext`/`iv` columns, under the user's data key
+# (`key_id`, see data_keys; NULL = APP_ENC_KEY, also used while data keys are off). Rows written before the binary columns
+# only have the base64 `ciphertext_b64`/`iv_b64` ones, which are still filled on write
+# while CIPHERTEXT_WRITE_BASE64 is on.
+StoredCiphertext = Tuple[Union[bytes, str], Union[bytes, str], Optional[str]]
+
+def encrypted_columns(plain: str, user_id: str) -> Dict[str, Any]:
+    """Column values to store `plain` encrypted on a Journal or ChatMessage.
+
+    Under the user's data key when DATA_KEYS_ENABLED is on, else under APP_ENC_KEY (key_id NULL).
+    """
+    if not data_keys.enabled:
+        return _columns(None, _aes, plain)
+    return _columns(*data_keys.for_user(user_id), plain)
+
+def _columns(key_id: Optional[str], cipher: AESGCM, plain: str) -> Dict[str, Any]:
+    ct, iv = _seal(cipher, plain)
+    cols: Dict[str, Any] = {"ciphertext": ct, "iv": iv, "key_id": key_id}
+    if settings.CIPHERTEXT_WRITE_BASE64:
+        cols["ciphertext_b64"] = base64.b64encode(ct).decode()
+        cols["iv_b64"] = base64.b64encode(iv).decode()
+    return cols
+
+def stored_ciphertext(row: Any) -> StoredCiphertext:
+    """A row's (ciphertext, iv, key_id): the binary columns, or the base64 ones on legacy rows."""
+    if row.ciphertext is not None:
+        return row.ciphertext, row.iv, row.key_id
+    return row.ciphertext_b64, row.iv_b64, row.key_id
+
+def decrypt_stored(ciphertext: Union[bytes, str], iv: Union[bytes, str], key_id: Optional[str] = None) -> str:
+    """Decrypt a stored_ciphertext triple (binary or legacy base64 columns)."""
+    return _open(_cipher(key_id), ciphertext, iv)
+
+def _map_chunks(fn: Callable[[Sequence], list], items: Sequence) -> list:
+    """fn over items, in order; large batches are split into one chunk per worker thread."""
+    global _pool
+    if len(items) < PARALLEL_MIN_ROWS or _workers <= 1:
+        return fn(items)
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=_workers, thread_name_prefix="crypto")
+    size = -(-len(items) // _workers)
+    out: list = []
+    for part in _pool.map(fn, [items[i:i + size] for i in range(0, len(items), size)]):
+        out.extend(part)
+    return out
+
+def encrypt_many(texts: Sequence[str]) -> List[tuple[str, str, str]]:
+    """encrypt_text over many texts, in input order."""
+    return _map_chunks(lambda chunk: [encrypt_text(t) for t in chunk], texts)
+
+def decrypt_many(
+    rows: Sequence[StoredCiphertext], on_error: Optional[Callable[[int, Exception], None]] = None
+) -> List[Optional[str]]:
+    """decrypt_stored over stored_ciphertext triples, in input order.
+
+    Each distinct key is looked up once per call. A row that fails to decrypt (including
+    one whose key was destroyed) comes back as None, and `on_error(index, exc)` is called
+    for it; the rest of the batch is unaffected.
+    """
+    ciphers: Dict[Optional[str], Any] = {None: _aes}
+    for _, _, key_id in rows:
+        if key_id not in ciphers:
+            try:
+                ciphers[key_id] = data_keys.get(key_id)
+            except Exception as e:
+                ciphers[key_id] = e
+
+    def chunk(part: Sequence[StoredCiphertext]) -> List[object]:
+        out: List[object] = []
+        for ct, iv, key_id in part:
+            cipher = ciphers[key_id]
+            if isinstance(cipher, Exception):
+                out.append(cipher)
+                continue
+            try:
+                out.append(_open(cipher, ct, iv))
+            except Exception as e:
+                out.append(e)
+        return out
+
+    results = _map_chunks(chunk, rows)
+    for i, r in enumerate(results):
+        if isinstance(r, Exception):
+            if on_error is not None:
+                on_error(i, r)
+            results[i] = None
+    return results
+
+def reencrypt_many(
+    rows: Sequence[StoredCiphertext], user_ids: Sequence[str],
+    on_error: Optional[Callable[[int, Exception], None]] = None,
+) -> List[Optional[Dict[str, Any]]]:
+    """encrypted_columns for each stored row under its user's current key, in input order.
+
+    Rows that fail to decrypt come back as None (see decrypt_many).
+    """
+    texts = decrypt_many(rows, on_error)
+    keys = {uid: data_keys.for_user(uid) for uid in set(user_ids)}
+
+    def chunk(part: Sequence[Tuple[Optional[str], str]]) -> List[Optional[Dict[str, Any]]]:
+        return [None if text is None else _columns(*keys[uid], text) for text, uid in part]
+
+    return _map_chunks(chunk, list(zip(texts, user_ids)))
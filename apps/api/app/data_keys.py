@@ -0,0 +1,261 @@
+"""Per-user data keys for envelope encryption of journals and chat messages.
+
+Each user's rows are encrypted under a random AES-256 data key of their own, recorded
+in the row's key_id. The key is stored only wrapped by a KMS master key
+(user_data_keys.wrapped_key); unwrapped keys are held as ready AESGCM objects in a
+bounded, TTL-expiring cache, so a warm lookup is one dict access and per-row crypto
+costs what it did with the single APP_ENC_KEY. Rows with key_id NULL predate this and
+stay under APP_ENC_KEY.
+
+A user's keys are numbered 1, 2, ... (version) and the highest is current. Two
+processes creating the same version race on the (user_id, version) unique constraint;
+the loser uses the winner's key, so no rows go out under a key that lost. Rows always
+name the key they were written with, so after `rotate_user` old and new rows both stay readable until
+key_rotation.ReencryptionJob moves the old ones over and `prune` drops unused keys.
+Master key rotation needs no row rewrites: `rewrap` re-wraps the data keys.
+
+Per-user keys are off unless DATA_KEYS_ENABLED is set; new rows then stay under
+APP_ENC_KEY, and existing key_id rows still need the master keys to be read. Enabling
+them without a configured master key source (see kms) stops the app at startup.
+
+Destroying a user's key rows (crypto-shredding) leaves their journals and messages
+unreadable without touching them; a process that cached the key keeps it for at most
+DATA_KEY_CACHE_TTL_SECONDS. chat_events.journal_entry holds plaintext and is not covered.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from sqlalchemy import text as sql_text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import settings
+from .db import SessionLocal
+from .kms import KMSNotConfigured, LocalKMS, kms
+
+
+class KeyCache:
+    """Bounded LRU of values that expire `ttl_seconds` after they are put."""
+
+    def __init__(self, max_entries: int = 10_000, ttl_seconds: float = 600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class DataKeyStore:
+    def __init__(self, kms: LocalKMS, enabled: bool = False, max_entries: int = 10_000, ttl_seconds: float = 600):
+        self.kms = kms
+        self.enabled = enabled
+        self._ciphers = KeyCache(max_entries, ttl_seconds)  # key_id -> AESGCM
+        self._current = KeyCache(max_entries, ttl_seconds)  # user_id -> key_id
+        self.unwraps = 0
+        self.created = 0
+
+    def check(self) -> None:
+        """Raise unless per-user keys are off or their master keys load (run at startup)."""
+        if not self.enabled:
+            return
+        if not self.kms.configured:
+            raise KMSNotConfigured(
+                "DATA_KEYS_ENABLED is set but no master keys are configured; set KMS_MASTER_KEYS "
+                "(or KMS_KEY_FILE on persistent storage), or turn DATA_KEYS_ENABLED off"
+            )
+        print(f"[DataKeys] Per-user data keys on; master key {self.kms.current_key_id} from {self.kms.source}")
+
+    def for_user(self, user_id: str) -> Tuple[str, AESGCM]:
+        """(key_id, cipher) new rows of the user are encrypted with; creates the key if needed."""
+        if not self.enabled:
+            raise KMSNotConfigured("Per-user data keys are off (DATA_KEYS_ENABLED)")
+        key_id = self._current.get(user_id)
+        if key_id is not None:
+            cipher = self._ciphers.get(key_id)
+            if cipher is not None:
+                return key_id, cipher
+        db = SessionLocal()
+        try:
+            row = self._newest(db, user_id)
+            if row is None:
+                created = self._create(db, user_id, 1)
+                if created is not None:
+                    return created
+                row = self._newest(db, user_id)  # another process created it first
+            cipher = self._unwrap(row)
+            key_id = row.key_id
+        finally:
+            db.close()
+        self._ciphers.put(key_id, cipher)
+        self._current.put(user_id, key_id)
+        return key_id, cipher
+
+    def _newest(self, db: Session, user_id: str) -> Optional[models.UserDataKey]:
+        return db.query(models.UserDataKey).filter(
+            models.UserDataKey.user_id == user_id
+        ).order_by(models.UserDataKey.version.desc()).first()
+
+    def _create(self, db: Session, user_id: str, version: int) -> Optional[Tuple[str, AESGCM]]:
+        """Insert version `version` of the user's key; None if another process inserted it first."""
+        data_key = AESGCM.generate_key(256)
+        master_key_id, wrapped = self.kms.wrap(data_key)
+        key_id = uuid.uuid4().hex
+        db.add(models.UserDataKey(
+            key_id=key_id, user_id=user_id, version=version, master_key_id=master_key_id, wrapped_key=wrapped,
+        ))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return None
+        self.created += 1
+        cipher = AESGCM(data_key)
+        self._ciphers.put(key_id, cipher)
+        self._current.put(user_id, key_id)
+        return key_id, cipher
+
+    def rotate_user(self, user_id: str) -> str:
+        """Give the user a new current data key; returns its id. Existing rows keep theirs.
+
+        Other processes pick it up once their cached current key expires.
+        """
+        if not self.enabled:
+            raise KMSNotConfigured("Per-user data keys are off (DATA_KEYS_ENABLED)")
+        db = SessionLocal()
+        try:
+            while True:
+                newest = self._newest(db, user_id)
+                created = self._create(db, user_id, newest.version + 1 if newest else 1)
+                if created is not None:
+                    return created[0]
+        finally:
+            db.close()
+
+    def get(self, key_id: str) -> AESGCM:
+        """The cipher for a row's key_id; KeyError if the key was destroyed."""
+        cipher = self._ciphers.get(key_id)
+        if cipher is not None:
+            return cipher
+        db = SessionLocal()
+        try:
+            row = db.get(models.UserDataKey, key_id)
+            if row is None:
+                raise KeyError(f"Data key {key_id} not found (destroyed?)")
+            cipher = self._unwrap(row)
+        finally:
+            db.close()
+        self._ciphers.put(key_id, cipher)
+        return cipher
+
+    def _unwrap(self, row: models.UserDataKey) -> AESGCM:
+        self.unwraps += 1
+        return AESGCM(self.kms.unwrap(row.master_key_id, row.wrapped_key))
+
+    def rewrap(self, db: Session, batch_size: int = 500) -> int:
+        """Re-wrap data keys held under older master keys with the current one; returns how many."""
+        current = self.kms.current_key_id
+        done = 0
+        while True:
+            rows = db.query(models.UserDataKey).filter(
+                models.UserDataKey.master_key_id != current
+            ).order_by(models.UserDataKey.key_id).limit(batch_size).all()
+            if not rows:
+                return done
+            for row in rows:
+                row.master_key_id, row.wrapped_key = self.kms.wrap(self.kms.unwrap(row.master_key_id, row.wrapped_key))
+            db.commit()
+            done += len(rows)
+
+    def prune(self, db: Session) -> int:
+        """Delete keys that are neither a user's current key nor used by any row; returns how many."""
+        deleted = db.execute(sql_text(
+            """
+            DELETE FROM user_data_keys
+            WHERE key_id <> (
+                SELECT k.key_id FROM user_data_keys k WHERE k.user_id = user_data_keys.user_id
+                ORDER BY k.version DESC LIMIT 1
+            )
+            AND NOT EXISTS (SELECT 1 FROM journals j WHERE j.key_id = user_data_keys.key_id)
+            AND NOT EXISTS (SELECT 1 FROM chat_messages c WHERE c.key_id = user_data_keys.key_id)
+            """
+        )).rowcount
+        db.commit()
+        return deleted
+
+    def destroy_user(self, db: Session, user_id: str) -> int:
+        """Delete all of a user's data keys (crypto-shredding); returns how many."""
+        key_ids = [k for (k,) in db.query(models.UserDataKey.key_id).filter(models.UserDataKey.user_id == user_id)]
+        db.query(models.UserDataKey).filter(models.UserDataKey.user_id == user_id).delete(synchronize_session=False)
+        db.commit()
+        for key_id in key_ids:
+            self._ciphers.pop(key_id)
+        self._current.pop(user_id)
+        return len(key_ids)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ciphers": self._ciphers.stats(),
+            "current_keys": self._current.stats(),
+            "unwraps": self.unwraps,
+            "created": self.created,
+        }
+
+
+data_keys = DataKeyStore(
+    kms, settings.DATA_KEYS_ENABLED, settings.DATA_KEY_CACHE_MAX_ENTRIES, settings.DATA_KEY_CACHE_TTL_SECONDS
+)
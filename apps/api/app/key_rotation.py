@@ -0,0 +1,197 @@
+"""Re-encrypt journals and chat messages under each user's current data key.
+
+Key versions and what rotating each one takes (scripts/rotate_keys.py):
+- master key: kms.rotate() then data_keys.rewrap(); data keys are re-wrapped, rows untouched
+- data key: data_keys.rotate_user() gives a user a new current key; this job moves the
+  user's rows onto it
+- APP_ENC_KEY: rows with key_id NULL are moved onto per-user keys by this job too; once
+  none are left, APP_ENC_KEY decrypts nothing and can be changed
+
+Every row names its key (key_id), and reads use that key, so old and new rows stay
+readable throughout and the job runs online. It walks each table in primary-key chunks,
+selecting only rows not under their user's current key, decrypts and re-encrypts them on
+the crypto thread pool (crypto.reencrypt_many) and writes each chunk in its own short
+transaction. The last id is checkpointed to a JSON file after every chunk; the key filter
+makes re-running safe regardless.
+
+Control while running:
+- SIGINT/SIGTERM (or `request_stop`): finish the current chunk, checkpoint, exit
+- `<checkpoint>.pause` file present, or `pause()`/`resume()`: stay paused in place
+- `max_rows_per_sec` (or `set_rate` while running): hold the average rate under the limit
+- `progress()`: per-table last id, max id, re-encrypted and failed counts, rate
+"""
+
+import json
+import signal
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text as sql_text
+
+from .crypto import reencrypt_many
+from .db import SessionLocal
+
+TABLES = ("journals", "chat_messages")
+
+# Rows whose key is not their user's current (newest) key; key_id NULL = APP_ENC_KEY.
+# Users whose keys were all destroyed have no current key and their rows are left alone.
+_SELECT = """
+    SELECT t.id, t.user_id, t.ciphertext, t.iv, t.ciphertext_b64, t.iv_b64, t.key_id FROM {table} t
+    WHERE t.id > :after AND (t.key_id IS NULL OR t.key_id <> (
+        SELECT k.key_id FROM user_data_keys k WHERE k.user_id = t.user_id
+        ORDER BY k.version DESC LIMIT 1
+    ))
+    ORDER BY t.id LIMIT :limit
+"""
+# Old base64 copies are replaced too (or cleared), or they would keep the old key's ciphertext.
+# The key_id check skips rows another run re-encrypted meanwhile.
+_UPDATE = """
+    UPDATE {table} SET ciphertext = :ciphertext, iv = :iv, key_id = :key_id,
+        ciphertext_b64 = :ciphertext_b64, iv_b64 = :iv_b64
+    WHERE id = :_id AND (key_id = :_old OR (key_id IS NULL AND :_old IS NULL))
+"""
+
+
+class ReencryptionJob:
+    def __init__(
+        self, checkpoint_path: Path, chunk_size: int = 500, max_rows_per_sec: Optional[float] = None,
+        tables: Tuple[str, ...] = TABLES,
+    ):
+        self.checkpoint_path = checkpoint_path
+        self.pause_path = checkpoint_path.with_name(checkpoint_path.name + ".pause")
+        self.chunk_size = chunk_size
+        self.max_rows_per_sec = max_rows_per_sec
+        self.tables = tables
+        self.stopping = False
+        self._paused = threading.Event()
+        self._lock = threading.Lock()
+        self._rate = 0.0
+        self.checkpoint = self._load_checkpoint()
+
+    # --- checkpoint ---
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        if self.checkpoint_path.exists():
+            return json.loads(self.checkpoint_path.read_text(encoding="utf-8"))
+        return {"started_at": datetime.utcnow().isoformat(), "tables": {}}
+
+    def _save_checkpoint(self) -> None:
+        self.checkpoint["updated_at"] = datetime.utcnow().isoformat()
+        tmp = self.checkpoint_path.with_name(self.checkpoint_path.name + ".tmp")
+        tmp.write_text(json.dumps(self.checkpoint, indent=2), encoding="utf-8")
+        tmp.replace(self.checkpoint_path)
+
+    def _progress(self, table: str) -> Dict[str, Any]:
+        return self.checkpoint["tables"].setdefault(
+            table, {"last_id": 0, "max_id": None, "reencrypted": 0, "failed": 0, "done": False}
+        )
+
+    # --- control ---
+    def request_stop(self, *_):
+        if not self.stopping:
+            print("Stopping after the current chunk (re-run to resume)")
+        self.stopping = True
+
+    def pause(self) -> None:
+        self._paused.set()
+
+    def resume(self) -> None:
+        self._paused.clear()
+
+    def set_rate(self, max_rows_per_sec: Optional[float]) -> None:
+        self.max_rows_per_sec = max_rows_per_sec
+
+    def progress(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "tables": {t: dict(self._progress(t)) for t in self.tables},
+                "paused": self._paused.is_set() or self.pause_path.exists(),
+                "rows_per_sec": round(self._rate, 1),
+                "max_rows_per_sec": self.max_rows_per_sec,
+            }
+
+    def _wait_while_paused(self) -> None:
+        announced = False
+        while (self._paused.is_set() or self.pause_path.exists()) and not self.stopping:
+            if not announced:
+                print("Paused")
+                announced = True
+            time.sleep(1.0)
+        if announced:
+            print("Resumed")
+
+    def _throttle(self, rows_done: int, started: float) -> None:
+        if self.max_rows_per_sec:
+            ahead = rows_done / self.max_rows_per_sec - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    # --- pipeline ---
+    def _reencrypt(self, rows: List[Any]) -> Tuple[List[Dict[str, Any]], int]:
+        stored = [
+            (r.ciphertext, r.iv, r.key_id) if r.ciphertext is not None else (r.ciphertext_b64, r.iv_b64, r.key_id)
+            for r in rows
+        ]
+        failed: List[int] = []
+        columns = reencrypt_many(stored, [r.user_id for r in rows], on_error=lambda i, e: failed.append(rows[i].id))
+        if failed:
+            print(f"Could not decrypt ids {failed}; left as they are")
+        params = [
+            {"ciphertext_b64": None, "iv_b64": None, **cols, "_id": r.id, "_old": r.key_id}
+            for r, cols in zip(rows, columns) if cols is not None
+        ]
+        return params, len(failed)
+
+    def run_table(self, table: str) -> None:
+        progress = self._progress(table)
+        if progress["done"]:
+            return
+        started = time.monotonic()
+        rows_done = 0
+        db = SessionLocal()
+        try:
+            progress["max_id"] = db.execute(sql_text(f"SELECT MAX(id) FROM {table}")).scalar()
+            while not self.stopping:
+                self._wait_while_paused()
+                rows = db.execute(
+                    sql_text(_SELECT.format(table=table)), {"after": progress["last_id"], "limit": self.chunk_size}
+                ).fetchall()
+                db.commit()  # keys for users on APP_ENC_KEY are created on another connection
+                if not rows:
+                    progress["done"] = True
+                    break
+                params, failed = self._reencrypt(rows)
+                if params:
+                    db.execute(sql_text(_UPDATE.format(table=table)), params)
+                db.commit()
+                with self._lock:
+                    progress["last_id"] = rows[-1].id
+                    progress["reencrypted"] += len(params)
+                    progress["failed"] += failed
+                    rows_done += len(rows)
+                    self._rate = rows_done / max(1e-9, time.monotonic() - started)
+                self._save_checkpoint()
+                print(
+                    f"{table}: through id {progress['last_id']}/{progress['max_id']}, "
+                    f"{progress['reencrypted']} re-encrypted, {progress['failed']} failed ({self._rate:.0f} rows/s)"
+                )
+                self._throttle(rows_done, started)
+            self._save_checkpoint()
+        finally:
+            db.close()
+
+    def run(self) -> bool:
+        """Process every table; True when all are done, False if stopped early."""
+        in_main = threading.current_thread() is threading.main_thread()
+        previous = {sig: signal.signal(sig, self.request_stop) for sig in (signal.SIGINT, signal.SIGTERM)} if in_main else {}
+        try:
+            for table in self.tables:
+                if self.stopping:
+                    break
+                self.run_table(table)
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+        return all(self._progress(t)["done"] for t in self.tables)
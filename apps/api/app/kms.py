@@ -0,0 +1,131 @@
+"""Local stand-in for a key management service.
+
+Master keys are a JSON document, {"current": "<id>", "keys": {"<id>": "<base64 key>"}},
+taken from KMS_MASTER_KEYS (e.g. a deploy secret) or, failing that, the KMS_KEY_FILE
+file, which must be on storage that outlives the machine. Nothing here creates them:
+every row under a per-user data key depends on these keys, so a key generated on an
+ephemeral disk would make those rows unreadable on the next machine. Generate them once
+with `scripts/rotate_keys.py master-keys`.
+
+The service only wraps and unwraps data keys, so master keys never leave it; a real KMS
+client can replace LocalKMS by offering the same `wrap`/`unwrap`/`rotate`. Keys are
+versioned: `rotate` adds a key and makes it current, and a wrapped key is always
+unwrapped with the version it names.
+"""
+
+import base64
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from .config import settings
+
+ROOT = Path(__file__).resolve().parents[1]
+# Binds wrapped blobs to their purpose; a data-key blob is not valid ciphertext elsewhere
+_AAD = b"data-key"
+
+
+class KMSNotConfigured(RuntimeError):
+    pass
+
+
+class LocalKMS:
+    def __init__(self, keys_json: str = "", path: Optional[Path] = None):
+        self.keys_json = keys_json
+        self.path = path
+        self._keys: Optional[Dict[str, AESGCM]] = None
+        self._current: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.keys_json) or self.path is not None
+
+    @property
+    def source(self) -> str:
+        return "KMS_MASTER_KEYS" if self.keys_json else f"KMS_KEY_FILE {self.path}"
+
+    def document(self) -> Dict[str, Any]:
+        """The master key document from the configured source; KMSNotConfigured if there is none."""
+        if self.keys_json:
+            data = json.loads(self.keys_json)
+        elif self.path is not None:
+            if not self.path.exists():
+                raise KMSNotConfigured(f"KMS key file {self.path} not found")
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        else:
+            raise KMSNotConfigured("No master keys configured; set KMS_MASTER_KEYS or KMS_KEY_FILE")
+        if data.get("current") not in data.get("keys", {}):
+            raise KMSNotConfigured(f"{self.source}: current master key {data.get('current')!r} is not in keys")
+        return data
+
+    def _load(self) -> Dict[str, AESGCM]:
+        with self._lock:
+            if self._keys is None:
+                data = self.document()
+                self._keys = {k: AESGCM(base64.b64decode(v)) for k, v in data["keys"].items()}
+                self._current = data["current"]
+            return self._keys
+
+    @property
+    def current_key_id(self) -> str:
+        self._load()
+        return self._current
+
+    def wrap(self, data_key: bytes) -> Tuple[str, bytes]:
+        """(master key id, wrapped key) for a data key, under the current master key."""
+        keys = self._load()
+        iv = os.urandom(12)
+        return self._current, iv + keys[self._current].encrypt(iv, data_key, _AAD)
+
+    def unwrap(self, master_key_id: str, wrapped: bytes) -> bytes:
+        keys = self._load()
+        if master_key_id not in keys:
+            # Possibly rotated by another process since this one loaded the file
+            with self._lock:
+                self._keys = None
+            keys = self._load()
+            if master_key_id not in keys:
+                raise KeyError(f"Unknown master key {master_key_id!r}")
+        wrapped = bytes(wrapped)
+        return keys[master_key_id].decrypt(wrapped[:12], wrapped[12:], _AAD)
+
+    def rotate(self) -> str:
+        """Add a master key to KMS_KEY_FILE and make it current; older versions stay for unwrapping.
+
+        Returns its id. Keys from KMS_MASTER_KEYS cannot be changed from here: set the
+        secret to `with_new_key()` and restart instead.
+        """
+        if self.keys_json or self.path is None:
+            raise KMSNotConfigured("Master keys come from KMS_MASTER_KEYS; update that secret instead")
+        with self._lock:
+            data = with_new_key(self.document())
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(json.dumps(data))
+            tmp.replace(self.path)
+            self._keys = None
+        return data["current"]
+
+
+def with_new_key(data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """A master key document with a fresh key added and made current (a new document if None)."""
+    keys = dict((data or {}).get("keys", {}))
+    key_id = str(max((int(k) for k in keys), default=0) + 1)
+    keys[key_id] = base64.b64encode(AESGCM.generate_key(256)).decode()
+    return {"current": key_id, "keys": keys}
+
+
+def _path(value: str) -> Optional[Path]:
+    if not value:
+        return None
+    path = Path(value)
+    return path if path.is_absolute() else ROOT / path
+
+
+kms = LocalKMS(settings.KMS_MASTER_KEYS, _path(settings.KMS_KEY_FILE))
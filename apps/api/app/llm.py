@@ -0,0 +1,107 @@
+"""The app's one OpenAI client, shared by every chat turn.
+
+Built at startup (main.py) over a single httpx connection pool and closed at shutdown,
+so chat turns reuse open keep-alive connections instead of paying for a new pool, TCP
+connect and TLS handshake before their first token. A streamed reply holds its
+connection until it ends, so OPENAI_MAX_CONNECTIONS bounds concurrent chat turns;
+turns beyond it wait for a free connection.
+
+With OPENAI_WARMUP on, startup also sends one cheap request (model lookup) in the
+background to open the first connection; its failure is only logged. Without an API
+key there is no client and /chat/stream uses its fallback replies.
+"""
+
+import asyncio
+from typing import Any, Dict, Optional
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from .config import settings
+
+
+class LLMClient:
+    def __init__(
+        self, api_key: str, model: str, max_connections: int = 200, max_keepalive_connections: int = 50,
+        keepalive_expiry: float = 60.0, connect_timeout: float = 5.0, read_timeout: float = 60.0,
+        max_retries: int = 2, warmup: bool = True,
+    ):
+        self.api_key = api_key
+        self.model = model
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        # Waiting for a pooled connection counts against the read timeout, not the connect one
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout, pool=read_timeout)
+        self.max_retries = max_retries
+        self.warmup = warmup
+        self._client: Optional[AsyncOpenAI] = None
+        self._warmup_task: Optional[asyncio.Task] = None
+        self.warmed = False
+
+    @property
+    def client(self) -> Optional[AsyncOpenAI]:
+        """The shared client; built on first use if startup did not run (e.g. scripts, tests)."""
+        if self._client is None and self.api_key:
+            self._build()
+        return self._client
+
+    def _build(self) -> None:
+        self._client = AsyncOpenAI(
+            api_key=self.api_key,
+            max_retries=self.max_retries,
+            timeout=self.timeout,
+            http_client=DefaultAsyncHttpxClient(limits=self.limits, timeout=self.timeout),
+        )
+
+    async def start(self) -> None:
+        if self._client is not None:
+            return
+        if not self.api_key:
+            print("[LLM] No OpenAI API key configured; chat uses fallback replies")
+            return
+        self._build()
+        print(f"[LLM] OpenAI client ready (model {self.model}, max {self.limits.max_connections} connections)")
+        if self.warmup:
+            # In the background: startup does not wait on the network
+            self._warmup_task = asyncio.create_task(self._warm())
+
+    async def _warm(self) -> None:
+        try:
+            await self._client.models.retrieve(self.model)
+            self.warmed = True
+            print("[LLM] Warm-up request done; connection open")
+        except Exception as e:
+            print(f"[LLM] Warm-up request failed (chat will connect on first use): {e}")
+
+    async def shutdown(self) -> None:
+        if self._warmup_task is not None:
+            self._warmup_task.cancel()
+            self._warmup_task = None
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "configured": bool(self.api_key),
+            "open": self._client is not None,
+            "warmed": self.warmed,
+            "model": self.model,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+        }
+
+
+llm = LLMClient(
+    settings.OPENAI_API_KEY, settings.OPENAI_MODEL,
+    max_connections=settings.OPENAI_MAX_CONNECTIONS,
+    max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+    connect_timeout=settings.OPENAI_CONNECT_TIMEOUT_SECONDS,
+    read_timeout=settings.OPENAI_READ_TIMEOUT_SECONDS,
+    max_retries=settings.OPENAI_MAX_RETRIES,
+    warmup=settings.OPENAI_WARMUP,
+)
@@ -6,6 +6,9 @@ from .config import settings
 from .db import engine, Base
 from . import models  # noqa: F401
 from .salesforce import data_cloud_client
+from .nlp_deep import deep_analysis
+from .llm import llm
+from .data_keys import data_keys
 
 app = FastAPI(title="DV Support API", version="0.1.0")
 
@@ -36,6 +39,11 @@ app.include_router(chat.router, prefix="/chat", tags=["chat"])
 app.include_router(datacloud.router, prefix="/datacloud", tags=["datacloud"])
 app.include_router(seed.router, prefix="/seed", tags=["seed"])
 
+@app.on_event("startup")
+def _startup_data_keys():
+    # Refuses to start rather than encrypt under master keys that are missing or would not persist
+    data_keys.check()
+
 @app.on_event("startup")
 def _startup_auth_datacloud():
     try:
@@ -47,3 +55,19 @@ def _startup_auth_datacloud():
                 print(f"[DataCloud] Authenticated. Endpoint: {data_cloud_client.streaming_endpoint}")
     except Exception as e:
         print(f"[DataCloud] Startup auth exception: {e}")
+
+@app.on_event("startup")
+def _startup_deep_nlp():
+    deep_analysis.start()
+
+@app.on_event("shutdown")
+def _shutdown_deep_nlp():
+    deep_analysis.shutdown()
+
+@app.on_event("startup")
+async def _startup_llm():
+    await llm.start()
+
+@app.on_event("shutdown")
+async def _shutdown_llm():
+    await llm.shutdown()
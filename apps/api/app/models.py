@@ -1,5 +1,6 @@
+from datetime import date
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import String, Text, Integer, DateTime, func
+from sqlalchemy import String, Text, Integer, BigInteger, Date, DateTime, Index, LargeBinary, UniqueConstraint, func
 from .db import Base
 
 class User(Base):
@@ -26,10 +27,21 @@ class Journal(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     user_id: Mapped[str] = mapped_column(String(64), index=True)
     created_at: Mapped[str] = mapped_column(DateTime(timezone=True), server_default=func.now())
-    # store ciphertext as base64 string for simplicity
-    ciphertext_b64: Mapped[str] = mapped_column(Text, nullable=False)
-    iv_b64: Mapped[str] = mapped_column(String(64), nullable=False)
-    tag_b64: Mapped[str] = mapped_column(String(64), nullable=False)
+    # AES-GCM ciphertext (GCM tag as its last 16 bytes) and IV; see crypto.encrypted_columns
+    ciphertext: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    iv: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    # UserDataKey the row is encrypted with; NULL = APP_ENC_KEY (rows older than per-user keys)
+    key_id: Mapped[str | None] = mapped_column(String(32), nullable=True, index=True)
+    # Legacy base64 copies; the only ciphertext on rows older than the binary columns
+    ciphertext_b64: Mapped[str | None] = mapped_column(Text, nullable=True)
+    iv_b64: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    # Lexical features computed at write time (nlp_utils.lexical_features); NULL on legacy rows
+    word_count: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    lexicon_counts: Mapped[str | None] = mapped_column(Text, nullable=True)  # JSON {category: hits}
+    suicidality_hits: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    weapon_hits: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    stalking_hits: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    digital_surveillance_hits: Mapped[int | None] = mapped_column(Integer, nullable=True)
 
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
@@ -46,10 +58,12 @@ class ChatMessage(Base):
     user_id: Mapped[str] = mapped_column(String(64), index=True)
     role: Mapped[str] = mapped_column(String(20), nullable=False)  # 'user' or 'assistant'
     created_at: Mapped[str] = mapped_column(DateTime(timezone=True), server_default=func.now())
-    # Encrypted message content
-    ciphertext_b64: Mapped[str] = mapped_column(Text, nullable=False)
-    iv_b64: Mapped[str] = mapped_column(String(64), nullable=False)
-    tag_b64: Mapped[str] = mapped_column(String(64), nullable=False)
+    # Encrypted message content (as on Journal)
+    ciphertext: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    iv: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    key_id: Mapped[str | None] = mapped_column(String(32), nullable=True, index=True)
+    ciphertext_b64: Mapped[str | None] = mapped_column(Text, nullable=True)
+    iv_b64: Mapped[str | None] = mapped_column(String(64), nullable=True)
     # NLP analysis results (encrypted)
     intent: Mapped[str | None] = mapped_column(String(50), nullable=True)
     abuse_type: Mapped[str | None] = mapped_column(String(100), nullable=True)
@@ -66,9 +80,38 @@ class ChatMessage(Base):
     digital_surveillance: Mapped[bool | None] = mapped_column(nullable=True)
     # Context metadata (JSON stored as text for simplicity)
     meta_json: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # Lexical features computed at write time (nlp_utils.lexical_features); NULL on legacy rows
+    word_count: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    lexicon_counts: Mapped[str | None] = mapped_column(Text, nullable=True)  # JSON {category: hits}
+    suicidality_hits: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    weapon_hits: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    stalking_hits: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    digital_surveillance_hits: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    # nlp_utils.ANALYSIS_VERSION the analysis columns were computed with; NULL = unknown
+    analysis_version: Mapped[str | None] = mapped_column(String(16), nullable=True)
+
+class UserDataKey(Base):
+    """A user's data key, wrapped by a KMS master key (app.data_keys); deleting it shreds their rows."""
+    __tablename__ = "user_data_keys"
+    # Two processes creating the same version of a user's key: the second insert fails
+    __table_args__ = (UniqueConstraint("user_id", "version", name="uq_user_data_keys_user_version"),)
+    key_id: Mapped[str] = mapped_column(String(32), primary_key=True)  # uuid4 hex
+    user_id: Mapped[str] = mapped_column(String(64), index=True)
+    version: Mapped[int] = mapped_column(Integer, nullable=False)  # 1, 2, ... per user; the highest is current
+    master_key_id: Mapped[str] = mapped_column(String(32), nullable=False)
+    wrapped_key: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    created_at: Mapped[str] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+class UserRiskRevision(Base):
+    """Counts a user's deletes and in-place updates; part of the risk watermark (risk_engine.bump_risk_revision)."""
+    __tablename__ = "user_risk_revisions"
+    user_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    revision: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
 
 class RiskSnapshot(Base):
     __tablename__ = "risk_snapshots"
+    # Latest-snapshot lookups and /insights/risk/trend range scans
+    __table_args__ = (Index("ix_risk_snapshots_user_created", "user_id", "created_at"),)
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     user_id: Mapped[str] = mapped_column(String(64), index=True)
     created_at: Mapped[str] = mapped_column(DateTime(timezone=True), server_default=func.now())
@@ -83,3 +126,61 @@ class RiskSnapshot(Base):
     children_present: Mapped[bool] = mapped_column(nullable=False, default=False)
     stalking: Mapped[bool] = mapped_column(nullable=False, default=False)
     digital_surveillance: Mapped[bool] = mapped_column(nullable=False, default=False)
+    # Materializer bookkeeping (risk_engine.materialize_snapshot); NULL on seeded/legacy rows
+    reasons: Mapped[str | None] = mapped_column(Text, nullable=True)  # JSON list
+    rules_version: Mapped[str | None] = mapped_column(String(16), nullable=True)
+    watermark: Mapped[str | None] = mapped_column(String(128), nullable=True)  # JSON [journal_id, chat_id, event_id, revision]
+    evaluated_at: Mapped[str | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+class UserDailyStats(Base):
+    """Per-user, per-UTC-day rollup of journals, user chat messages and chat_events.
+
+    Maintained on write by app.rollup and rebuilt by scripts/backfill_user_daily_stats.py.
+    """
+    __tablename__ = "user_daily_stats"
+    user_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    # Journal counters (risk_engine.journal_contrib); *_sum columns are fixed point (SCALE)
+    j_rows: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    j_valid: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    j_words: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    j_mood_n: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    j_mood_sum: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    j_neg_lang_sum: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    j_chunks: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    j_pos_hits: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    j_neg30_hits: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    j_baseline_neg: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    # Rows (journals + user chat) matching each risk lexicon
+    self_harm_rows: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    self_harm_sticky_rows: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    weapon_rows: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    stalking_rows: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    surveillance_rows: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    # User chat messages (risk_engine.chat_contrib) and their intents
+    c_rows: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    c_words: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    c_sent_n: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    c_neg_sum: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    c_pos_n: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    c_pos_sum: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    c_flag_rows: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    c_safety: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    c_intent_legal: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    c_intent_support: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    c_intent_incident: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    # chat_events (risk_engine.event_contrib), risk points and per-flag counts
+    e_rows: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    e_sent_n: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    e_neg_sum: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    e_pos_n: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    e_pos_sum: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    e_flag_rows: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    e_risk_points_n: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    e_risk_points_sum: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    e_threats_to_kill: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    e_strangulation: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    e_weapon_involved: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    e_children_present: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    e_stalking: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
+    e_digital_surveillance: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default="0")
@@ -0,0 +1,269 @@
+"""Second-tier ("deep") message analysis, kept off the chat request path.
+
+/chat/stream analyzes inline with the fast nlp_utils rules, and those alone decide
+the emergency warning. When NLP_DEEP_ANALYZER is set, the stored message is also
+queued here: a dispatcher thread hands jobs to a process pool running the deep
+analyzer, and an applier thread writes its results over the fast ones on the
+ChatMessage and its chat_events row, adjusts user_daily_stats and recomputes the
+user's risk. A full queue drops the job (counted); the row keeps its fast analysis
+and stays eligible for scripts/reanalyze_chat.py.
+
+Analyzers are CPU-only objects with a `version` string and `analyze(text)` returning
+the analyze_message dict. NLP_DEEP_ANALYZER selects one:
+- "lexicon:<yaml>": the base lexicons extended with the YAML's phrases (LexiconAnalyzer)
+- "<module>:<attr>": `attr()` from an importable module (a class or factory)
+"""
+
+import hashlib
+import importlib
+import json
+import multiprocessing
+import queue
+import signal
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import yaml
+from sqlalchemy import text as sql_text
+
+from . import models, rollup
+from .config import settings
+from .crypto import decrypt_bytes
+from .db import SessionLocal
+from .nlp_utils import ANALYSIS_VERSION, LEXICONS, PhraseMatcher, _analyze
+
+ROOT = Path(__file__).resolve().parents[1]
+MESSAGE_FIELDS = ("intent", "abuse_type", "sentiment_score", "risk_points", "severity_score", "escalation_index")
+EVENT_FIELDS = ("sentiment_score", "risk_points", "severity_score", "escalation_index")
+EVENT_FLAGS = ("threats_to_kill", "strangulation", "weapon_involved", "stalking", "digital_surveillance")
+
+
+class LexiconAnalyzer:
+    """The fast rules over a larger lexicon: LEXICONS plus the phrases in a YAML file."""
+
+    def __init__(self, path: Path):
+        extra = yaml.safe_load(path.read_text(encoding="utf-8")) or {}
+        lexicons = {c: list(p) for c, p in LEXICONS.items()}
+        for category, phrases in extra.items():
+            if category in lexicons:
+                lexicons[category].extend(str(p) for p in phrases or ())
+        self.matcher = PhraseMatcher(lexicons)
+        self.version = hashlib.sha256(json.dumps(lexicons, sort_keys=True).encode()).hexdigest()[:8]
+
+    def analyze(self, text: str) -> Dict[str, Any]:
+        return _analyze(text, self.matcher.scan(text))
+
+
+def load_analyzer(spec: str) -> Optional[Any]:
+    """The analyzer NLP_DEEP_ANALYZER names (see module doc), or None if unset."""
+    if not spec:
+        return None
+    kind, _, target = spec.partition(":")
+    if kind == "lexicon":
+        path = Path(target)
+        return LexiconAnalyzer(path if path.is_absolute() else ROOT / path)
+    if not target:
+        raise ValueError(f"NLP_DEEP_ANALYZER must be 'lexicon:<yaml>' or '<module>:<attr>', got {spec!r}")
+    return getattr(importlib.import_module(kind), target)()
+
+
+def deep_version(analyzer: Any) -> str:
+    """analysis_version stamped on deep-analyzed rows; changes with the base lexicons too."""
+    return "d" + hashlib.sha256(f"{ANALYSIS_VERSION}:{analyzer.version}".encode()).hexdigest()[:11]
+
+
+# --- worker processes ---
+_worker_analyzer: Any = None
+
+
+def _init_worker(spec: str) -> None:
+    global _worker_analyzer
+    # Ctrl-C reaches the whole process group; the server decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_analyzer = load_analyzer(spec)
+
+
+def _analyze_job(ciphertext: bytes, iv: bytes, key_id: Optional[str]) -> Dict[str, Any]:
+    return _worker_analyzer.analyze(decrypt_bytes(ciphertext, iv, key_id))
+
+
+# --- queue ---
+@dataclass
+class DeepJob:
+    user_id: str
+    message_id: int
+    ciphertext: bytes
+    iv: bytes
+    key_id: Optional[str] = None
+    event_id: Optional[str] = None
+    # Flags the user stated explicitly; they win over the analysis on chat_events
+    declared: Dict[str, bool] = field(default_factory=dict)
+
+
+class DeepAnalysisQueue:
+    def __init__(self, spec: str, workers: int = 1, max_queued: int = 1000):
+        self.spec = spec
+        self.workers = max(1, workers)
+        self.version: Optional[str] = None
+        self._jobs: "queue.Queue[Optional[DeepJob]]" = queue.Queue(maxsize=max_queued)
+        self._results: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        # Bounds jobs inside the pool so the backlog waits in the (bounded) job queue
+        self._slots = threading.Semaphore(2 * self.workers)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._threads: list = []
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0
+        self.applied = 0
+        self.failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._pool is not None
+
+    def start(self) -> None:
+        if self._pool is not None or not self.spec:
+            return
+        try:
+            # Fail here rather than in every worker
+            self.version = deep_version(load_analyzer(self.spec))
+        except Exception as e:
+            print(f"[DeepNLP] Analyzer {self.spec!r} failed to load; deep analysis disabled: {e}")
+            return
+        # The server process runs threads; fork could copy a lock some thread holds
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker, initargs=(self.spec,),
+        )
+        self._threads = [
+            threading.Thread(target=self._dispatch, name="deep-nlp-dispatch", daemon=True),
+            threading.Thread(target=self._apply_loop, name="deep-nlp-apply", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+        print(f"[DeepNLP] {self.workers} worker(s), analyzer {self.spec} (version {self.version})")
+
+    def shutdown(self) -> None:
+        if self._pool is None:
+            return
+        self._jobs.put(None)
+        self._threads[0].join()
+        self._pool.shutdown(wait=True)
+        self._results.put(None)
+        self._threads[1].join()
+        self._pool = None
+
+    def submit(self, job: DeepJob) -> bool:
+        """Queue a job without blocking; False if deep analysis is off or the queue is full."""
+        if self._pool is None:
+            return False
+        try:
+            self._jobs.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def _dispatch(self) -> None:
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            self._slots.acquire()
+            try:
+                fut = self._pool.submit(_analyze_job, job.ciphertext, job.iv, job.key_id)
+            except Exception as e:
+                self._slots.release()
+                self._results.put((job, e))
+                continue
+            fut.add_done_callback(lambda f, job=job: self._done(job, f))
+
+    def _done(self, job: DeepJob, fut: Future) -> None:
+        self._slots.release()
+        self._results.put((job, fut))
+
+    def _apply_loop(self) -> None:
+        while True:
+            item = self._results.get()
+            if item is None:
+                return
+            job, outcome = item
+            try:
+                if isinstance(outcome, Exception):
+                    raise outcome
+                self.apply(job, outcome.result())
+                with self._lock:
+                    self.applied += 1
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                print(f"[DeepNLP] Message {job.message_id} of user {job.user_id} not updated: {e}")
+
+    def apply(self, job: DeepJob, analysis: Dict[str, Any]) -> None:
+        """Write a deep result over the fast one, then refresh the user's rollup and risk."""
+        # Not at module level: spawned workers import this module and need no risk evaluator
+        from .risk_service import recompute_risk
+
+        db = SessionLocal()
+        try:
+            msg = db.get(models.ChatMessage, job.message_id)
+            if msg is None:
+                return  # deleted meanwhile
+            before = rollup.chat_delta(msg)
+            for k in MESSAGE_FIELDS:
+                setattr(msg, k, analysis[k])
+            for k, v in analysis["risk_flags"].items():
+                setattr(msg, k, v)
+            msg.analysis_version = self.version
+            db.commit()
+            rollup.record_change(db, msg.user_id, msg.created_at, before, rollup.chat_delta(msg))
+            if job.event_id:
+                self._apply_event(db, job, analysis)
+            recompute_risk(db, job.user_id)
+        finally:
+            db.close()
+
+    def _apply_event(self, db, job: DeepJob, analysis: Dict[str, Any]) -> None:
+        row = db.execute(
+            sql_text("SELECT * FROM chat_events WHERE event_id = :e"), {"e": job.event_id}
+        ).mappings().first()
+        if row is None:
+            return
+        flags = {k: bool(analysis["risk_flags"].get(k)) for k in EVENT_FLAGS}
+        flags.update({k: bool(v) for k, v in job.declared.items() if k in flags})
+        updates = {
+            **{k: analysis[k] for k in EVENT_FIELDS},
+            "event_type": analysis["intent"],
+            "type_of_abuse": analysis["abuse_type"],
+            **flags,
+            "analysis_version": self.version,
+        }
+        db.execute(
+            sql_text(f"UPDATE chat_events SET {', '.join(f'{k} = :{k}' for k in updates)} WHERE event_id = :_e"),
+            {**updates, "_e": job.event_id},
+        )
+        db.commit()
+        rollup.record_change(db, job.user_id, row["created_at"], rollup.event_delta(dict(row)), rollup.event_delta({**row, **updates}))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "analyzer": self.spec or None,
+                "version": self.version,
+                "workers": self.workers if self.enabled else 0,
+                "queued": self._jobs.qsize(),
+                "enqueued": self.enqueued,
+                "dropped": self.dropped,
+                "applied": self.applied,
+                "failed": self.failed,
+            }
+
+
+deep_analysis = DeepAnalysisQueue(settings.NLP_DEEP_ANALYZER, settings.NLP_DEEP_WORKERS, settings.NLP_DEEP_QUEUE_SIZE)
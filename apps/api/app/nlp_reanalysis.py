@@ -0,0 +1,295 @@
+"""Re-run message analysis over stored chat history after the lexicons change.
+
+Rows whose analysis_version differs from the current one (nlp_utils.ANALYSIS_VERSION,
+or the nlp_deep version when a deep analyzer is configured) are streamed in
+id order through a server-side cursor, analyzed in a process pool (chat_messages are
+decrypted there; chat_events carry their text in journal_entry), and written back with
+one executemany UPDATE per chunk. After every chunk the last id is checkpointed to a
+JSON file, so a stopped job resumes where it left off; the version filter makes
+re-running safe regardless.
+
+Control while running:
+- SIGINT/SIGTERM: finish the chunks in flight, checkpoint, exit (resume by re-running)
+- `<checkpoint>.pause` file present: stay paused until it is removed
+- `max_rows_per_sec`: sleep between chunks to hold the average rate under the limit
+
+Each chunk bumps the risk revision (risk_engine.bump_risk_revision) of its users in
+the same transaction as its UPDATE, so servers drop cached risk results, snapshots and
+engine state for them on the next read. Users whose rows changed are kept in the
+checkpoint and their user_daily_stats rebuilt when a table finishes or the job stops.
+"""
+
+import json
+import signal
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import text as sql_text
+
+from . import rollup
+from .crypto import decrypt_many
+from .db import SessionLocal, engine
+from .config import settings
+from .nlp_deep import deep_version, load_analyzer
+from .nlp_utils import ANALYSIS_VERSION, RISK_POINTS, analyze_message, lexical_features, scan_and_analyze
+from .risk_engine import bump_risk_revision
+
+MESSAGE_COLUMNS = (
+    "intent", "abuse_type", "sentiment_score", "risk_points", "severity_score", "escalation_index",
+    *RISK_POINTS, "word_count", "lexicon_counts", "suicidality_hits", "weapon_hits", "stalking_hits",
+    "digital_surveillance_hits",
+)
+# chat_events keep their event_type/type_of_abuse (set from request context, not only NLP)
+EVENT_COLUMNS = (
+    "sentiment_score", "risk_points", "severity_score", "escalation_index",
+    "threats_to_kill", "strangulation", "weapon_involved", "stalking", "digital_surveillance",
+)
+# Flags a user can state explicitly; the stated value survives re-analysis
+_DECLARED_FLAGS = ("threats_to_kill", "weapon_involved")
+
+TABLES = {
+    "chat_messages": (
+        "SELECT id, user_id, ciphertext, iv, ciphertext_b64, iv_b64, key_id FROM chat_messages"
+        " WHERE id > :after AND role = 'user' AND (analysis_version IS NULL OR analysis_version <> :v)"
+        " ORDER BY id",
+        MESSAGE_COLUMNS,
+    ),
+    "chat_events": (
+        "SELECT id, user_id, journal_entry, extra_json FROM chat_events"
+        " WHERE id > :after AND (analysis_version IS NULL OR analysis_version <> :v)"
+        " ORDER BY id",
+        EVENT_COLUMNS,
+    ),
+}
+
+
+# Deep analyzer of this worker process, if the job runs one
+_deep: Any = None
+
+
+def analyze_message_rows(rows: List[Tuple]) -> Tuple[List[Dict[str, Any]], int]:
+    """Worker: (id, user_id, ciphertext, iv, ciphertext_b64, iv_b64, key_id) rows -> UPDATE params; also returns the failure count."""
+    out, failed = [], 0
+    # Legacy rows have only the base64 columns (see crypto.stored_ciphertext)
+    texts = decrypt_many([
+        (ct, iv, key_id) if ct is not None else (ct_b64, iv_b64, key_id)
+        for _, _, ct, iv, ct_b64, iv_b64, key_id in rows
+    ])
+    for row_id, text in zip((r[0] for r in rows), texts):
+        if text is None:
+            failed += 1  # left unstamped; retried by the next run
+            continue
+        # Lexical feature columns always come from the base lexicons (RiskEvaluator reads them)
+        hits, a = scan_and_analyze(text)
+        if _deep is not None:
+            a = _deep.analyze(text)
+        out.append({
+            "_id": row_id,
+            **{k: a[k] for k in ("intent", "abuse_type", "sentiment_score", "risk_points", "severity_score", "escalation_index")},
+            **a["risk_flags"],
+            **lexical_features(text, hits),
+        })
+    return out, failed
+
+
+def analyze_event_rows(rows: List[Tuple]) -> Tuple[List[Dict[str, Any]], int]:
+    """Worker: (id, user_id, journal_entry, extra_json) rows -> UPDATE params."""
+    out = []
+    for row_id, _, text, extra_json in rows:
+        a = _deep.analyze(text or "") if _deep is not None else analyze_message(text or "")
+        flags = dict(a["risk_flags"])
+        try:
+            declared = json.loads(extra_json) if extra_json else {}
+        except ValueError:
+            declared = {}
+        for flag in _DECLARED_FLAGS:
+            if isinstance(declared, dict) and declared.get(flag) is not None:
+                flags[flag] = bool(declared[flag])
+        out.append({
+            "_id": row_id,
+            **{k: a[k] for k in ("sentiment_score", "risk_points", "severity_score", "escalation_index")},
+            **{k: flags[k] for k in EVENT_COLUMNS if k in flags},
+        })
+    return out, 0
+
+
+_WORKERS = {"chat_messages": analyze_message_rows, "chat_events": analyze_event_rows}
+
+
+def _picklable(row) -> Tuple:
+    # Raw-SQL bytea values come back as memoryviews on Postgres, which do not pickle
+    return tuple(bytes(v) if isinstance(v, memoryview) else v for v in row)
+
+
+def _init_worker(analyzer_spec: str) -> None:
+    global _deep
+    # Connections inherited through fork must not be shared with the parent
+    engine.dispose(close=False)
+    # Ctrl-C reaches the whole process group; the parent decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _deep = load_analyzer(analyzer_spec)
+
+
+class ReanalysisJob:
+    def __init__(
+        self, checkpoint_path: Path, workers: int = 2, chunk_size: int = 500,
+        max_rows_per_sec: Optional[float] = None, tables: Tuple[str, ...] = tuple(TABLES),
+        analyzer_spec: str = settings.NLP_DEEP_ANALYZER,
+    ):
+        self.analyzer_spec = analyzer_spec
+        analyzer = load_analyzer(analyzer_spec)
+        self.version = deep_version(analyzer) if analyzer is not None else ANALYSIS_VERSION
+        self.checkpoint_path = checkpoint_path
+        self.pause_path = checkpoint_path.with_name(checkpoint_path.name + ".pause")
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        self.max_rows_per_sec = max_rows_per_sec
+        self.tables = tables
+        self.stopping = False
+        self.checkpoint = self._load_checkpoint()
+
+    # --- checkpoint ---
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        fresh = {"analysis_version": self.version, "started_at": datetime.utcnow().isoformat(), "tables": {}}
+        if not self.checkpoint_path.exists():
+            return fresh
+        data = json.loads(self.checkpoint_path.read_text(encoding="utf-8"))
+        if data.get("analysis_version") != self.version:
+            print(f"Checkpoint is for analysis version {data.get('analysis_version')}; starting over")
+            return fresh
+        return data
+
+    def _save_checkpoint(self) -> None:
+        self.checkpoint["updated_at"] = datetime.utcnow().isoformat()
+        tmp = self.checkpoint_path.with_name(self.checkpoint_path.name + ".tmp")
+        tmp.write_text(json.dumps(self.checkpoint, indent=2), encoding="utf-8")
+        tmp.replace(self.checkpoint_path)
+
+    def _progress(self, table: str) -> Dict[str, Any]:
+        return self.checkpoint["tables"].setdefault(table, {"last_id": 0, "updated": 0, "failed": 0, "done": False})
+
+    # --- control ---
+    def request_stop(self, *_):
+        if not self.stopping:
+            print("Stopping after the chunks in flight (re-run to resume)")
+        self.stopping = True
+
+    def _wait_while_paused(self) -> None:
+        announced = False
+        while self.pause_path.exists() and not self.stopping:
+            if not announced:
+                print(f"Paused ({self.pause_path} exists)")
+                announced = True
+            time.sleep(1.0)
+        if announced:
+            print("Resumed")
+
+    def _throttle(self, rows_done: int, started: float) -> None:
+        if self.max_rows_per_sec:
+            ahead = rows_done / self.max_rows_per_sec - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    # --- pipeline ---
+    def _chunks(self, conn, table: str, after: int) -> Iterator[List[Tuple]]:
+        sql, _ = TABLES[table]
+        if conn.dialect.supports_server_side_cursors:
+            result = conn.execution_options(stream_results=True, yield_per=self.chunk_size).execute(
+                sql_text(sql), {"after": after, "v": self.version}
+            )
+            for part in result.partitions(self.chunk_size):
+                yield [_picklable(r) for r in part]
+            return
+        # No server-side cursors (SQLite): an open read would block the writer, so page by id
+        while True:
+            rows = conn.execute(
+                sql_text(f"{sql} LIMIT :limit"), {"after": after, "v": self.version, "limit": self.chunk_size}
+            ).fetchall()
+            conn.commit()
+            if not rows:
+                return
+            after = rows[-1][0]
+            yield [_picklable(r) for r in rows]
+
+    def _write(self, db, table: str, params: List[Dict[str, Any]], user_ids: set) -> None:
+        if not params:
+            return
+        _, columns = TABLES[table]
+        for p in params:
+            p["_v"] = self.version
+        assignments = ", ".join(f"{c} = :{c}" for c in columns)
+        db.execute(sql_text(f"UPDATE {table} SET {assignments}, analysis_version = :_v WHERE id = :_id"), params)
+        for user_id in sorted(user_ids):
+            bump_risk_revision(db, user_id)
+        db.commit()
+
+    def _rebuild_rollups(self, db) -> None:
+        pending = self.checkpoint.get("pending_rollups", [])
+        if pending:
+            print(f"Rebuilding user_daily_stats for {len(pending)} users")
+        while pending:
+            rollup.rebuild_user(db, pending[-1])
+            pending.pop()
+            self._save_checkpoint()
+
+    def run_table(self, pool: ProcessPoolExecutor, table: str) -> None:
+        progress = self._progress(table)
+        if progress["done"]:
+            return
+        worker = _WORKERS[table]
+        started = time.monotonic()
+        rows_done = 0
+        in_flight: deque = deque()
+        db = SessionLocal()
+        try:
+            with engine.connect() as reader:
+                chunks = self._chunks(reader, table, progress["last_id"])
+                exhausted = False
+                while True:
+                    # Keep up to two chunks per worker queued; results are applied in id order
+                    while not exhausted and not self.stopping and len(in_flight) < 2 * self.workers:
+                        self._wait_while_paused()
+                        chunk = next(chunks, None)
+                        if chunk is None:
+                            exhausted = True
+                            break
+                        in_flight.append((chunk[-1][0], {str(r[1]) for r in chunk}, pool.submit(worker, chunk)))
+                    if not in_flight:
+                        break
+                    last_id, user_ids, fut = in_flight.popleft()
+                    params, failed = fut.result()
+                    self._write(db, table, params, user_ids)
+                    pending = self.checkpoint.setdefault("pending_rollups", [])
+                    pending.extend(sorted(user_ids.difference(pending)))
+                    progress["last_id"] = last_id
+                    progress["updated"] += len(params)
+                    progress["failed"] += failed
+                    self._save_checkpoint()
+                    rows_done += len(params) + failed
+                    rate = rows_done / max(1e-9, time.monotonic() - started)
+                    print(f"{table}: through id {last_id}, {progress['updated']} updated, {progress['failed']} failed ({rate:.0f} rows/s)")
+                    self._throttle(rows_done, started)
+                progress["done"] = exhausted and not self.stopping
+                self._save_checkpoint()
+            # Once per run rather than per chunk: a rebuild re-reads the user's whole history
+            self._rebuild_rollups(db)
+        finally:
+            db.close()
+
+    def run(self) -> bool:
+        """Process every table; True when all are done, False if stopped early."""
+        previous = {sig: signal.signal(sig, self.request_stop) for sig in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self.analyzer_spec,)) as pool:
+                for table in self.tables:
+                    if self.stopping:
+                        break
+                    self.run_table(pool, table)
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+        return all(self._progress(t)["done"] for t in self.tables)
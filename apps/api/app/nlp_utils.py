@@ -1,8 +1,18 @@
 # NLP utilities ported from chatdemoapp.py for DV support analysis
 
-from typing import Dict, List, Tuple
+from bisect import bisect_right
+from collections import OrderedDict
+import hashlib
+import hmac
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
 import json
 
+import numpy as np
+
+from .config import settings
+
 # Risk point weights for DV-specific indicators
 RISK_POINTS = {
     "threats_to_kill": 5,
@@ -13,54 +23,190 @@ RISK_POINTS = {
     "digital_surveillance": 2
 }
 
-def classify_intent(text: str) -> str:
+# Keyword lexicons, keyed by category. Everything that looks for phrases in user text
+# (analyze_message and the RiskEvaluator features) reads from here so one scan per text
+# answers every consumer.
+LEXICONS: Dict[str, List[str]] = {
+    # classify_intent
+    "intent_legal": ["lawyer", "restraining order", "file a case", "court"],
+    "intent_safety_planning": ["safety plan", "safe place", "shelter"],
+    "intent_emotional_support": ["help", "support", "feel", "anxious", "scared", "afraid"],
+    # classify_abuse
+    "abuse_physical": ["hit", "slap", "choke", "punch", "strangle"],
+    "abuse_emotional": ["insult", "gaslight", "control", "isolate"],
+    "abuse_financial": ["took my money", "paycheck", "bank", "card"],
+    "abuse_digital_surveillance": ["tracker", "spy app", "keylogger", "icloud", "gps"],
+    "abuse_stalking": ["followed me", "waiting outside", "shows up", "tailing"],
+    "abuse_sexual": ["forced", "sexual", "assault", "rape"],
+    # extract_risk_flags
+    "flag_threats_to_kill": ["kill you", "end your life", "die"],
+    "flag_strangulation": ["strangle", "choke"],
+    "flag_weapon_involved": ["gun", "knife", "weapon"],
+    "flag_children_present": ["our kid", "my son", "my daughter", "children", "baby"],
+    "flag_stalking": ["followed", "waiting outside", "stalk", "tailing"],
+    "flag_digital_surveillance": ["tracker", "spy", "keylogger", "icloud", "gps", "find my"],
+    # simple_sentiment
+    "sentiment_negative": ["scared", "afraid", "anxious", "cry", "hurt", "threat", "panic", "unsafe", "fear"],
+    "sentiment_positive": ["relief", "safe now", "thank you", "helpful", "calm"],
+    # RiskEvaluator features
+    "mood_negative": ['sad', 'angry', 'depressed', 'anxious', 'worried', 'scared', 'hurt', 'pain', 'hate', 'terrible', 'awful', 'horrible', 'miserable', 'lonely', 'hopeless', 'worthless', 'guilty', 'ashamed', 'fear', 'panic', 'stress', 'tension', 'frustrated', 'annoyed', 'irritated', 'upset', 'disappointed', 'heartbroken', 'devastated', 'crushed', 'defeated'],
+    "mood_positive": ['happy', 'joy', 'excited', 'good', 'great', 'wonderful', 'peaceful', 'calm', 'love', 'amazing', 'fantastic', 'beautiful', 'blessed', 'grateful', 'thankful', 'content', 'satisfied', 'fulfilled', 'accomplished', 'proud', 'confident', 'optimistic', 'hopeful', 'inspired', 'motivated', 'energetic', 'vibrant', 'alive', 'thriving', 'prosperous', 'successful'],
+    "positive_affect": ['grateful','thankful','calm','safe','relief','supported','hopeful','optimistic','better','improving','progress','peaceful','encouraged','proud'],
+    "self_harm": [
+        'kill myself','end my life','i want to die','want to die','suicide',
+        'take my life','i am going to kill myself','end it all','no reason to live',
+        'i want to end it','i can\'t go on','i don\'t want to live','die by suicide',
+        'end myself','going to end myself','end myself tonight'
+    ],
+    "self_harm_sticky": ['kill myself','end my life','i want to die','suicide','take my life','end it all','no reason to live'],
+    "weapon": ["gun","knife","weapon","armed","pistol","rifle","shotgun","revolver","gun in the house","has a gun"],
+    "stalking": ["stalking","follows me","shows up","waiting outside","keeps appearing"],
+    "digital_surveillance": ["spyware","installed app","tracking app","location sharing","screen mirroring","phone monitored","passwords demanded"],
+    "negative_words": ['hate', 'kill', 'die', 'suicide', 'end', 'stop', 'can\'t', 'won\'t', 'never', 'hopeless', 'worthless', 'useless', 'pointless', 'meaningless', 'empty', 'void', 'dark', 'black', 'death', 'dead', 'burden', 'tired', 'exhausted', 'drained', 'numb', 'numbness', 'pain', 'suffering', 'agony', 'torment', 'hell', 'nightmare'],
+    "concerning_phrases": ['want to die', 'end it all', 'give up', 'no point', 'better off dead', 'kill myself', 'end my life', 'take my life', 'no reason to live', 'life is meaningless', 'i hate myself', 'i\'m worthless', 'i\'m useless', 'i can\'t take it anymore', 'i can\'t go on', 'i\'m done', 'i give up', 'i quit', 'i surrender', 'i\'m broken', 'i\'m damaged', 'i\'m ruined', 'i\'m destroyed'],
+    "journal_negative": ['sad','angry','depressed','anxious','scared','hopeless','worthless','pain','panic','fear','abuse','hurt'],
+    "baseline_negative": ['hurt','afraid','unsafe','kill','die','panic','threat'],
+}
+
+class PhraseHits:
+    """Result of one PhraseMatcher scan: the phrases present and per-category counts.
+
+    A category count is the number of distinct phrases of that category found in the
+    text, which is what the `sum(1 for w in words if w in text)` loops used to compute.
+    """
+    __slots__ = ("phrases", "counts")
+
+    def __init__(self, phrases: frozenset, counts: Dict[str, int]):
+        self.phrases = phrases
+        self.counts = counts
+
+    def any(self, category: str) -> bool:
+        return self.counts.get(category, 0) > 0
+
+    def count(self, category: str) -> int:
+        return self.counts.get(category, 0)
+
+class PhraseMatcher:
+    """Multi-lexicon substring matcher compiled once at import.
+
+    All lexicons are merged into one deduplicated phrase table (shortest first) with a
+    phrase -> categories index, and the text is lowercased once per scan. Each phrase
+    records the shorter lexicon phrases it contains; if one of those is absent the
+    longer phrase cannot occur and is skipped without searching. Matching stays on
+    str.__contains__: on CPython a single alternation regex over these lexicons was an
+    order of magnitude slower than C substring search on journal-sized texts.
+    """
+
+    def __init__(self, lexicons: Dict[str, List[str]]):
+        categories: Dict[str, List[str]] = {}
+        for category, phrases in lexicons.items():
+            for phrase in phrases:
+                cats = categories.setdefault(phrase.lower(), [])
+                if category not in cats:
+                    cats.append(category)
+        ordered = sorted(categories, key=lambda p: (len(p), p))
+        self.categories = {p: tuple(c) for p, c in categories.items()}
+        self._table: List[Tuple[str, frozenset]] = []
+        for i, phrase in enumerate(ordered):
+            required = frozenset(q for q in ordered[:i] if q in phrase)
+            self._table.append((phrase, required))
+        self._mask_tables: Dict[Tuple[str, ...], List[Tuple[str, int]]] = {}
+
+    def scan(self, text: str) -> PhraseHits:
+        t = text.lower()
+        found: set = set()
+        issuperset = found.issuperset
+        for phrase, required in self._table:
+            if issuperset(required) and phrase in t:
+                found.add(phrase)
+        counts: Dict[str, int] = {}
+        for phrase in found:
+            for category in self.categories[phrase]:
+                counts[category] = counts.get(category, 0) + 1
+        return PhraseHits(frozenset(found), counts)
+
+    def category_masks(self, texts: Sequence[str], categories: Tuple[str, ...]) -> np.ndarray:
+        """Per text, a bitmask of which `categories` have any phrase present (bit i = categories[i]).
+
+        The batch is lowercased as one NUL-joined buffer and each relevant phrase is
+        searched across it with str.find; after a hit the search resumes at the next
+        text, so the Python-level work is one step per (phrase, matching text).
+        """
+        table = self._mask_tables.get(categories)
+        if table is None:
+            bit = {c: 1 << i for i, c in enumerate(categories)}
+            table = []
+            for phrase, cats in self.categories.items():
+                bits = 0
+                for c in cats:
+                    bits |= bit.get(c, 0)
+                if bits:
+                    table.append((phrase, bits))
+            self._mask_tables[categories] = table
+        n = len(texts)
+        if not n:
+            return np.zeros(0, dtype=np.uint32)
+        parts = "\x00".join(texts).lower().split("\x00")
+        if len(parts) != n:  # a text contained NUL
+            parts = [t.replace("\x00", " ").lower() for t in texts]
+        buf = "\x00".join(parts)
+        starts = [0] * n
+        pos = 0
+        for i, part in enumerate(parts):
+            starts[i] = pos
+            pos += len(part) + 1
+        masks = [0] * n
+        find = buf.find
+        for phrase, bits in table:
+            at = find(phrase)
+            while at != -1:
+                i = bisect_right(starts, at) - 1
+                masks[i] |= bits
+                at = find(phrase, starts[i + 1]) if i + 1 < n else -1
+        return np.array(masks, dtype=np.uint32)
+
+MATCHER = PhraseMatcher(LEXICONS)
+
+# Content hash of everything the analysis depends on. Analyzed rows are stamped with it
+# (analysis_version) so scripts/reanalyze_chat.py can find rows from older lexicons.
+ANALYSIS_VERSION = hashlib.sha256(
+    json.dumps({"lexicons": LEXICONS, "risk_points": RISK_POINTS}, sort_keys=True).encode()
+).hexdigest()[:12]
+
+def scan_text(text: str) -> PhraseHits:
+    """Scan text against every lexicon in one pass."""
+    return MATCHER.scan(text)
+
+def classify_intent(text: str, hits: Optional[PhraseHits] = None) -> str:
     """Classify user intent from message text"""
-    t = text.lower()
-    if any(k in t for k in ["lawyer", "restraining order", "file a case", "court"]):
+    hits = hits if hits is not None else scan_text(text)
+    if hits.any("intent_legal"):
         return "seek_legal_info"
-    if any(k in t for k in ["safety plan", "safe place", "shelter"]):
+    if hits.any("intent_safety_planning"):
         return "safety_planning"
-    if any(k in t for k in ["help", "support", "feel", "anxious", "scared", "afraid"]):
+    if hits.any("intent_emotional_support"):
         return "seek_emotional_support"
     return "report_incident"
 
-def classify_abuse(text: str) -> str:
+def classify_abuse(text: str, hits: Optional[PhraseHits] = None) -> str:
     """Classify type of abuse mentioned in text"""
-    labels, t = [], text.lower()
-    if any(k in t for k in ["hit", "slap", "choke", "punch", "strangle"]):
-        labels.append("physical")
-    if any(k in t for k in ["insult", "gaslight", "control", "isolate"]):
-        labels.append("emotional")
-    if any(k in t for k in ["took my money", "paycheck", "bank", "card"]):
-        labels.append("financial")
-    if any(k in t for k in ["tracker", "spy app", "keylogger", "icloud", "gps"]):
-        labels.append("digital_surveillance")
-    if any(k in t for k in ["followed me", "waiting outside", "shows up", "tailing"]):
-        labels.append("stalking")
-    if any(k in t for k in ["forced", "sexual", "assault", "rape"]):
-        labels.append("sexual")
+    hits = hits if hits is not None else scan_text(text)
+    labels = [
+        label for label in ["physical", "emotional", "financial", "digital_surveillance", "stalking", "sexual"]
+        if hits.any(f"abuse_{label}")
+    ]
     return ",".join(sorted(set(labels))) or "unknown"
 
-def extract_risk_flags(text: str) -> Dict[str, bool]:
+def extract_risk_flags(text: str, hits: Optional[PhraseHits] = None) -> Dict[str, bool]:
     """Extract DV-specific risk flags from text"""
-    t = text.lower()
-    return {
-        "threats_to_kill": any(k in t for k in ["kill you", "end your life", "die"]),
-        "strangulation": any(k in t for k in ["strangle", "choke"]),
-        "weapon_involved": any(k in t for k in ["gun", "knife", "weapon"]),
-        "children_present": any(k in t for k in ["our kid", "my son", "my daughter", "children", "baby"]),
-        "stalking": any(k in t for k in ["followed", "waiting outside", "stalk", "tailing"]),
-        "digital_surveillance": any(k in t for k in ["tracker", "spy", "keylogger", "icloud", "gps", "find my"]),
-    }
+    hits = hits if hits is not None else scan_text(text)
+    return {flag: hits.any(f"flag_{flag}") for flag in RISK_POINTS}
 
-def simple_sentiment(text: str) -> float:
+def simple_sentiment(text: str, hits: Optional[PhraseHits] = None) -> float:
     """Simple sentiment analysis for DV context"""
-    neg = any(k in text.lower() for k in [
-        "scared", "afraid", "anxious", "cry", "hurt", "threat", "panic", "unsafe", "fear"
-    ])
-    pos = any(k in text.lower() for k in [
-        "relief", "safe now", "thank you", "helpful", "calm"
-    ])
+    hits = hits if hits is not None else scan_text(text)
+    neg = hits.any("sentiment_negative")
+    pos = hits.any("sentiment_positive")
     if neg and not pos:
         return -0.6
     if pos and not neg:
@@ -76,12 +222,33 @@ def calculate_risk_scores(flags: Dict[str, bool]) -> Dict[str, float]:
         "escalation_index": min(1.0, pts / 10.0)
     }
 
-def analyze_message(text: str) -> Dict:
-    """Complete NLP analysis of a message"""
-    intent = classify_intent(text)
-    abuse_type = classify_abuse(text)
-    flags = extract_risk_flags(text)
-    sentiment = simple_sentiment(text)
+def lexical_features(text: str, hits: Optional[PhraseHits] = None) -> Dict:
+    """Compact lexical feature record persisted on Journal/ChatMessage at write time.
+
+    RiskEvaluator scores from these columns, so history never has to be decrypted
+    just to count phrase hits. The keys match the model column names.
+    """
+    hits = hits if hits is not None else scan_text(text)
+    return {
+        "word_count": len(text.split()),
+        "lexicon_counts": json.dumps(hits.counts, sort_keys=True),
+        "suicidality_hits": hits.count("self_harm"),
+        "weapon_hits": hits.count("weapon"),
+        "stalking_hits": hits.count("stalking"),
+        "digital_surveillance_hits": hits.count("digital_surveillance"),
+    }
+
+def analyze_message(text: str, hits: Optional[PhraseHits] = None) -> Dict:
+    """Complete NLP analysis of a message (memoized unless the caller already scanned)"""
+    if hits is None:
+        return scan_and_analyze(text)[1]
+    return _analyze(text, hits)
+
+def _analyze(text: str, hits: PhraseHits) -> Dict:
+    intent = classify_intent(text, hits)
+    abuse_type = classify_abuse(text, hits)
+    flags = extract_risk_flags(text, hits)
+    sentiment = simple_sentiment(text, hits)
     risk_scores = calculate_risk_scores(flags)
     
     return {
@@ -94,6 +261,152 @@ def analyze_message(text: str) -> Dict:
         "escalation_index": risk_scores["escalation_index"]
     }
 
+# --- memoized analysis ---
+class AnalysisCache:
+    """Bounded LRU of (PhraseHits, analyze_message result) for repeated texts.
+
+    Keys are an HMAC-SHA256, under a random per-process key, of ANALYSIS_VERSION and the
+    normalized text, so no plaintext is held as a key and entries from older lexicons
+    can never match again (they age out of the LRU). Matching is case-insensitive and
+    substring-based, so stripping and lowercasing does not change a result. Texts longer
+    than `max_text_chars` (journal-sized) are analyzed without caching.
+    """
+
+    def __init__(self, max_entries: int = 20_000, max_text_chars: int = 2_000):
+        self.max_entries = max_entries
+        self.max_text_chars = max_text_chars
+        self._secret = os.urandom(32)
+        self._entries: "OrderedDict[bytes, Tuple[PhraseHits, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypassed = 0
+
+    def key(self, text: str) -> bytes:
+        msg = f"{ANALYSIS_VERSION}\x00{text.strip().lower()}".encode("utf-8", "surrogatepass")
+        return hmac.new(self._secret, msg, hashlib.sha256).digest()
+
+    def analyze(self, text: str) -> Tuple[PhraseHits, Dict]:
+        if self.max_entries <= 0 or len(text) > self.max_text_chars:
+            with self._lock:
+                self.bypassed += 1
+            hits = scan_text(text)
+            return hits, _analyze(text, hits)
+        key = self.key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is None:
+            hits = scan_text(text)
+            entry = (hits, _analyze(text, hits))
+            with self._lock:
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        hits, result = entry
+        # Callers get their own dicts; the cached ones stay untouched
+        return hits, {**result, "risk_flags": dict(result["risk_flags"])}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "max_text_chars": self.max_text_chars,
+                "analysis_version": ANALYSIS_VERSION,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "bypassed": self.bypassed,
+            }
+
+ANALYSIS_CACHE = AnalysisCache(settings.NLP_CACHE_MAX_ENTRIES, settings.NLP_CACHE_MAX_TEXT_CHARS)
+
+def scan_and_analyze(text: str) -> Tuple[PhraseHits, Dict]:
+    """scan_text and analyze_message together, memoized in ANALYSIS_CACHE."""
+    return ANALYSIS_CACHE.analyze(text)
+
+# --- batch analysis ---
+# Column encodings of analyze_messages. Abuse labels are in sorted order, so decoding a
+# mask lowest bit first yields classify_abuse's sorted, comma-joined string.
+INTENTS = ("report_incident", "seek_legal_info", "safety_planning", "seek_emotional_support")
+ABUSE_LABELS = ("digital_surveillance", "emotional", "financial", "physical", "sexual", "stalking")
+FLAG_NAMES = tuple(RISK_POINTS)
+
+_BATCH_CATEGORIES = (
+    "intent_legal", "intent_safety_planning", "intent_emotional_support",
+    *(f"abuse_{label}" for label in ABUSE_LABELS),
+    *(f"flag_{flag}" for flag in FLAG_NAMES),
+    "sentiment_negative", "sentiment_positive",
+)
+_ABUSE_SHIFT = 3
+_FLAG_SHIFT = _ABUSE_SHIFT + len(ABUSE_LABELS)
+_SENTIMENT_SHIFT = _FLAG_SHIFT + len(FLAG_NAMES)
+# risk_points for every flag bitmask
+_POINTS_BY_FLAGS = np.array(
+    [sum(RISK_POINTS[f] for b, f in enumerate(FLAG_NAMES) if m >> b & 1) for m in range(1 << len(FLAG_NAMES))],
+    dtype=np.int16,
+)
+
+def abuse_type(mask: int) -> str:
+    """Decode an abuse bitmask to classify_abuse's string."""
+    return ",".join(label for b, label in enumerate(ABUSE_LABELS) if mask >> b & 1) or "unknown"
+
+def risk_flags(mask: int) -> Dict[str, bool]:
+    """Decode a flag bitmask to extract_risk_flags' dict."""
+    return {flag: bool(mask >> b & 1) for b, flag in enumerate(FLAG_NAMES)}
+
+class MessageAnalysis:
+    """analyze_message results for a batch, one NumPy array per field.
+
+    `intent` holds indices into INTENTS, `abuse` and `flags` bitmasks over ABUSE_LABELS
+    and FLAG_NAMES. `row(i)` rebuilds the analyze_message dict for one text.
+    """
+    __slots__ = ("intent", "abuse", "flags", "sentiment", "risk_points", "severity_score", "escalation_index")
+
+    def __init__(self, masks: np.ndarray):
+        legal, safety, support = (masks >> b & 1 for b in range(3))
+        self.intent = np.select([legal == 1, safety == 1, support == 1], [1, 2, 3], 0).astype(np.uint8)
+        self.abuse = (masks >> _ABUSE_SHIFT & ((1 << len(ABUSE_LABELS)) - 1)).astype(np.uint8)
+        self.flags = (masks >> _FLAG_SHIFT & ((1 << len(FLAG_NAMES)) - 1)).astype(np.uint8)
+        neg = (masks >> _SENTIMENT_SHIFT & 1) == 1
+        pos = (masks >> (_SENTIMENT_SHIFT + 1) & 1) == 1
+        self.sentiment = np.select([neg & ~pos, pos & ~neg, neg], [-0.6, 0.4, -0.1], 0.1)
+        self.risk_points = _POINTS_BY_FLAGS[self.flags]
+        self.severity_score = np.minimum(100, self.risk_points * 10).astype(np.int16)
+        self.escalation_index = np.minimum(1.0, self.risk_points / 10.0)
+
+    def __len__(self) -> int:
+        return len(self.intent)
+
+    def row(self, i: int) -> Dict:
+        pts = int(self.risk_points[i])
+        return {
+            "intent": INTENTS[self.intent[i]],
+            "abuse_type": abuse_type(int(self.abuse[i])),
+            "sentiment_score": float(self.sentiment[i]),
+            "risk_flags": risk_flags(int(self.flags[i])),
+            "risk_points": pts,
+            "severity_score": int(self.severity_score[i]),
+            "escalation_index": float(self.escalation_index[i]),
+        }
+
+def analyze_messages(texts: Sequence[str]) -> MessageAnalysis:
+    """analyze_message over many texts at once, as columns (see MessageAnalysis)."""
+    return MessageAnalysis(MATCHER.category_masks(texts, _BATCH_CATEGORIES))
+
 def is_high_risk(flags: Dict[str, bool]) -> bool:
     """Check if message contains high-risk indicators"""
     high_risk_flags = ["threats_to_kill", "strangulation", "weapon_involved"]
@@ -0,0 +1,400 @@
+"""Cohort-wide risk scoring: every user in a chunk scored with NumPy column operations.
+
+Rows are loaded for a whole chunk of users with one query per table (ciphertext
+deferred, as in EvaluationContext), reduced to the same per-row counters as the
+per-user path (risk_engine.*_contrib), and summed per user and window with
+`np.bincount`. Each feature is then a vectorized mirror of its RiskEvaluator method,
+and the weights are applied to all users at once. Scores match
+RiskEvaluator.evaluate_user_risk for the same `now`; scripts/score_all_users_risk.py
+checks that with --verify.
+
+Loaded rows are kept as a time-sorted `RowMatrix`, so one load can be scored at many
+points in time (risk_replay).
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import bindparam, func, select, text as sql_text
+from sqlalchemy.orm import Session, defer
+
+from . import models
+from .risk_engine import (
+    CHAT,
+    JOURNAL,
+    SCALE,
+    SNAPSHOT_FLAGS,
+    EvaluationContext,
+    EventRow,
+    FLAGS_SELECT,
+    TextRow,
+    prefetch_text,
+    snapshot_fields,
+    snapshot_unchanged,
+)
+
+
+class _WindowColumns:
+    """Per-user counter sums for one window: `cols["j_rows"]` is an int64 array over users."""
+
+    def __init__(self, sums: Dict[str, np.ndarray], n_users: int):
+        self._sums = sums
+        self._zeros = np.zeros(n_users, dtype=np.int64)
+
+    def __getitem__(self, counter: str) -> np.ndarray:
+        return self._sums.get(counter, self._zeros)
+
+
+class RowMatrix:
+    """Per-row counters of a chunk of users, sorted by created_at.
+
+    `windows(now)` returns days -> _WindowColumns for rows with
+    now - days <= created_at <= now (EvaluationContext semantics at that `now`); each
+    window is a contiguous slice of the matrix.
+    """
+
+    def __init__(self, rows: List[tuple], user_ids: List[str]):
+        self.n_users = len(user_ids)
+        index = {uid: i for i, uid in enumerate(user_ids)}
+        rows = sorted(rows, key=lambda r: r[1].created_at)
+        self.counters: Dict[str, int] = {}
+        contribs = [r.contrib for _, r in rows]
+        for c in contribs:
+            for k in c:
+                self.counters.setdefault(k, len(self.counters))
+        self.matrix = np.zeros((len(rows), len(self.counters)), dtype=np.int64)
+        for i, c in enumerate(contribs):
+            for k, v in c.items():
+                self.matrix[i, self.counters[k]] = v
+        self.owner = np.fromiter((index[uid] for uid, _ in rows), dtype=np.int64, count=len(rows))
+        self.created = np.array([r.created_at for _, r in rows], dtype="datetime64[us]")
+
+    def windows(self, now: datetime) -> Callable[[int], _WindowColumns]:
+        hi = int(np.searchsorted(self.created, np.datetime64(now, "us"), side="right"))
+        cache: Dict[int, _WindowColumns] = {}
+
+        def window(days: int) -> _WindowColumns:
+            if days not in cache:
+                lo = int(np.searchsorted(self.created, np.datetime64(now - timedelta(days=days), "us"), side="left"))
+                who = self.owner[lo:hi]
+                block = self.matrix[lo:hi]
+                sums = {
+                    k: np.bincount(who, weights=block[:, j], minlength=self.n_users).astype(np.int64)
+                    for k, j in self.counters.items()
+                }
+                cache[days] = _WindowColumns(sums, self.n_users)
+            return cache[days]
+
+        return window
+
+
+def _tiers(conds: Sequence[np.ndarray], scores: Sequence[float], reasons: Sequence[str]):
+    """First matching tier per user (np.select), as the if/elif ladders in RiskEvaluator."""
+    idx = np.select(list(conds), np.arange(1, len(conds) + 1), 0)
+    return np.array([0.0, *scores])[idx], np.array([None, *reasons], dtype=object)[idx]
+
+
+def _div(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """a / b where b != 0, else 0 (callers mask those users out)."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(b != 0, a / np.where(b != 0, b, 1), 0.0)
+
+
+class CohortRiskScorer:
+    def __init__(self, evaluator: Any):
+        self.evaluator = evaluator
+        # Vectorized mirrors of RiskEvaluator._evaluate_*; each returns (scores, reasons) arrays
+        self.vector_features: Dict[str, Callable] = {
+            "mood_drop_7d": self._mood_drop,
+            "safety_low": self._none,
+            "negative_language": self._negative_language,
+            "positive_affect_7d": self._positive_affect_7d,
+            "missed_checkins": self._none,
+            "game_telemetry_stress": self._none,
+            "chat_negative_language": self._chat_negative_language,
+            "chat_positive_affect": self._chat_positive_affect,
+            "suicidality": lambda w: self._count_indicator(w(30)["self_harm_rows"], 0.8, "explicit self-harm language detected"),
+            "safety_planning_intent": self._safety_planning_intent,
+            "journal_neg_30d": self._journal_neg_30d,
+            "chat_neg_30d": self._chat_neg_30d,
+            "worsening_vs_baseline": self._worsening_vs_baseline,
+            "suicidality_sticky": self._suicidality_sticky,
+            "weapon_indicator": lambda w: self._count_indicator(w(30)["weapon_rows"], 0.6, "weapon indicators mentioned"),
+            "stalking_indicator": lambda w: self._count_indicator(w(30)["stalking_rows"], 0.4, "stalking indicators"),
+            "digital_surveillance_indicator": lambda w: self._count_indicator(w(30)["surveillance_rows"], 0.4, "digital surveillance indicators"),
+        }
+
+    # --- loading ---
+    def load(self, db: Session, user_ids: List[str], since: datetime, until: datetime) -> RowMatrix:
+        """RowMatrix of the chunk's rows created between `since` and `until`."""
+        return RowMatrix(self._load_rows(db, user_ids, since, until), user_ids)
+
+    def _load_rows(self, db: Session, user_ids: List[str], since: datetime, until: datetime) -> List[tuple]:
+        """(user_id, row) for every journal, user chat message and chat_event of the chunk."""
+        rows: List[tuple] = []
+        for r in db.query(models.Journal).options(
+            defer(models.Journal.ciphertext), defer(models.Journal.iv),
+            defer(models.Journal.ciphertext_b64), defer(models.Journal.iv_b64)
+        ).filter(models.Journal.user_id.in_(user_ids), models.Journal.created_at >= since, models.Journal.created_at <= until):
+            rows.append((r.user_id, TextRow(JOURNAL, r)))
+        for r in db.query(models.ChatMessage).options(
+            defer(models.ChatMessage.ciphertext), defer(models.ChatMessage.iv),
+            defer(models.ChatMessage.ciphertext_b64), defer(models.ChatMessage.iv_b64)
+        ).filter(
+            models.ChatMessage.user_id.in_(user_ids),
+            models.ChatMessage.created_at >= since,
+            models.ChatMessage.created_at <= until,
+            models.ChatMessage.role == "user",
+        ):
+            rows.append((r.user_id, TextRow(CHAT, r)))
+        events = db.execute(sql_text(
+            """
+            SELECT user_id, event_id, created_at, sentiment_score, threats_to_kill, strangulation, weapon_involved
+            FROM chat_events
+            WHERE user_id IN :uids AND created_at >= :since AND created_at <= :until
+            """
+        ).bindparams(bindparam("uids", expanding=True)), {"uids": user_ids, "since": since, "until": until}).fetchall()
+        prefetch_text(db, (r for _, r in rows))
+        rows.extend((r.user_id, EventRow(r)) for r in events)
+        return rows
+
+    # --- features (keep in step with RiskEvaluator._evaluate_*) ---
+    @staticmethod
+    def _none(w):
+        n = len(w(7)["j_rows"])
+        return np.zeros(n), np.full(n, None, dtype=object)
+
+    @staticmethod
+    def _count_indicator(hits: np.ndarray, base: float, label: str):
+        scores = np.where(hits > 0, np.minimum(1.0, base + 0.1 * (hits - 1)), 0.0)
+        return scores, np.where(hits > 0, label, None).astype(object)
+
+    @staticmethod
+    def _mood_drop(w):
+        s = w(7)
+        ok = (s["j_rows"] >= 2) & (s["j_mood_n"] > 0)
+        avg = _div(s["j_mood_sum"] / SCALE, s["j_mood_n"])
+        return _tiers(
+            [ok & (avg < -0.05), ok & (avg < 0)],
+            [0.8, 0.4],
+            ["Mood appears low based on recent journal entries", "Slightly negative mood in recent entries"],
+        )
+
+    @staticmethod
+    def _positive_affect_7d(w):
+        s = w(7)
+        ok = s["j_rows"] > 0
+        ratio = s["j_pos_hits"] / np.maximum(1, s["j_chunks"])
+        return _tiers(
+            [ok & (ratio >= 0.15), ok & (ratio >= 0.05)],
+            [0.8, 0.5],
+            ["positive affect present in journals", "some positive affect in journals"],
+        )
+
+    @staticmethod
+    def _negative_language(w):
+        s = w(7)
+        ok = (s["j_rows"] > 0) & (s["j_valid"] > 0)
+        avg = _div(s["j_neg_lang_sum"] / SCALE, s["j_valid"])
+        return _tiers(
+            [ok & (avg > 0.3), ok & (avg > 0.1)],
+            [0.9, 0.6],
+            ["Concerning language detected in recent journals", "Some negative language in recent journals"],
+        )
+
+    @staticmethod
+    def _chat_columns(s: _WindowColumns, name: str) -> np.ndarray:
+        # Prefer chat_events and fall back to chat_messages, per user
+        return np.where(s["e_rows"] > 0, s[f"e_{name}"], s[f"c_{name}"])
+
+    def _chat_negative_language(self, w):
+        s = w(7)
+        rows, neg_n, flags, neg_sum = (self._chat_columns(s, k) for k in ("rows", "sent_n", "flag_rows", "neg_sum"))
+        ok = (rows > 0) & ~((neg_n == 0) & (flags == 0))
+        avg_neg = neg_sum / SCALE / np.maximum(1, neg_n)
+        flag_ratio = flags / np.maximum(1, rows)
+        scores = np.where(ok, np.minimum(1.0, (flag_ratio * 0.9) + (avg_neg * 0.6)), 0.0)
+        reasons = np.full(len(rows), None, dtype=object)
+        for i in np.flatnonzero(ok):
+            parts = []
+            if flags[i]:
+                parts.append(f"{flags[i]} high-risk indicators in chat")
+            if avg_neg[i] > 0.15:
+                parts.append("negative chat sentiment")
+            reasons[i] = ", ".join(parts) if parts else None
+        return scores, reasons
+
+    def _chat_positive_affect(self, w):
+        s = w(7)
+        pos_n = self._chat_columns(s, "pos_n")
+        score = np.minimum(1.0, np.maximum(0.0, _div(self._chat_columns(s, "pos_sum") / SCALE, pos_n)))
+        ok = (pos_n > 0) & (score >= 0.1)
+        return np.where(ok, score, 0.0), np.where(ok, "positive affect in chat", None).astype(object)
+
+    @staticmethod
+    def _safety_planning_intent(w):
+        s = w(30)
+        ok = s["c_rows"] > 0
+        ratio = s["c_safety"] / np.maximum(1, s["c_rows"])
+        return _tiers(
+            [ok & (ratio >= 0.5), ok & (ratio >= 0.25), ok & (ratio >= 0.1)],
+            [0.9, 0.6, 0.3],
+            ["engaging in safety planning", "safety planning signals present", "some safety planning intent"],
+        )
+
+    @staticmethod
+    def _journal_neg_30d(w):
+        s = w(30)
+        ok = s["j_rows"] > 0
+        ratio = s["j_neg30_hits"] / np.maximum(1, s["j_chunks"])
+        return _tiers(
+            [ok & (ratio >= 0.1), ok & (ratio >= 0.05)],
+            [0.7, 0.4],
+            ["sustained negative language in journals (30d)", "some negative language in journals (30d)"],
+        )
+
+    @staticmethod
+    def _chat_neg_30d(w):
+        s = w(30)
+        ok = (s["c_rows"] > 0) & (s["c_sent_n"] > 0)
+        avg = _div(s["c_neg_sum"] / SCALE, s["c_sent_n"])
+        return _tiers(
+            [ok & (avg >= 0.3), ok & (avg >= 0.15)],
+            [0.6, 0.3],
+            ["sustained negative chat sentiment (30d)", "negative chat sentiment (30d)"],
+        )
+
+    @staticmethod
+    def _worsening_vs_baseline(w):
+        def neg_avg(days: int) -> np.ndarray:
+            s = w(days)
+            return (s["j_baseline_neg"] * SCALE + s["c_neg_sum"]) / SCALE / np.maximum(1, s["j_valid"] + s["c_sent_n"])
+
+        delta = neg_avg(7) - neg_avg(90)
+        return _tiers([delta >= 0.2, delta >= 0.1], [0.8, 0.5], ["worsening vs 90d baseline", "slightly worse vs 90d baseline"])
+
+    @staticmethod
+    def _suicidality_sticky(w):
+        hits = w(14)["self_harm_sticky_rows"]
+        return np.where(hits > 0, 0.9, 0.0), np.where(hits > 0, "recent suicidality (sticky)", None).astype(object)
+
+    # --- scoring ---
+    def score_users(self, db: Session, user_ids: List[str], now: Optional[datetime] = None) -> Dict[str, Dict[str, Any]]:
+        """Risk results (RiskEvaluator.combine shape) for every user in `user_ids`."""
+        ev = self.evaluator
+        now = now or datetime.utcnow()
+        rows = self.load(db, user_ids, now - timedelta(days=EvaluationContext.HORIZON_DAYS), now)
+        final, feature_scores, feature_reasons = self.score_window(rows.windows(now), len(user_ids))
+
+        results = {}
+        for i, uid in enumerate(user_ids):
+            score = round(float(final[i]), 3)
+            results[uid] = {
+                "score": score,
+                "level": ev._determine_risk_level(float(final[i])),
+                "reasons": [r[i] for r in feature_reasons.values() if r[i]],
+                "feature_scores": {name: float(s[i]) for name, s in feature_scores.items()},
+                "weights": ev.weights,
+                "thresholds": ev.thresholds,
+            }
+        return results
+
+    def score_chunk(self, db: Session, user_ids: List[str]) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, tuple], datetime]:
+        """(results, watermarks, now) for a chunk about to be written with `write_snapshots`.
+
+        The watermarks are read before `now` is taken and the rows loaded, as in
+        risk_service._evaluate_and_persist: a row written meanwhile moves the user's
+        watermark past the snapshot's, so the snapshot is not served as fresh.
+        """
+        watermarks = self._watermarks(db, user_ids)
+        now = datetime.utcnow()
+        return self.score_users(db, user_ids, now), watermarks, now
+
+    def score_window(self, window: Callable[[int], _WindowColumns], n: int):
+        """(final scores, feature scores, feature reasons) arrays over the `n` users of `window`."""
+        ev = self.evaluator
+        feature_scores: Dict[str, np.ndarray] = {}
+        feature_reasons: Dict[str, np.ndarray] = {}
+        for name in ev.features:
+            fn = self.vector_features.get(name)
+            if fn is None:
+                feature_scores[name] = np.zeros(n)
+                feature_reasons[name] = np.full(n, f"Unknown feature: {name}", dtype=object)
+            else:
+                feature_scores[name], feature_reasons[name] = fn(window)
+
+        # Weighted sum over active (score > 0) features, added in feature order like combine()
+        risk_sum = np.zeros(n)
+        weight_sum = np.zeros(n)
+        for name, scores in feature_scores.items():
+            weight = float(ev.weights.get(name, 0.0))
+            active = scores > 0
+            risk_sum = risk_sum + np.where(active, scores * weight, 0.0)
+            weight_sum = weight_sum + np.where(active, abs(weight), 0.0)
+        return np.clip(_div(risk_sum, weight_sum), 0.0, 1.0), feature_scores, feature_reasons
+
+    def levels(self, final: np.ndarray) -> np.ndarray:
+        """RiskEvaluator._determine_risk_level over an array of final scores."""
+        t = self.evaluator.thresholds
+        return np.select(
+            [final >= t.get("high", 0.65), final >= t.get("warn", 0.45)], ["high", "warn"], "low"
+        ).astype(object)
+
+    # --- persistence ---
+    @staticmethod
+    def _grouped(db: Session, sql: str, user_ids: List[str], **params) -> Dict[str, tuple]:
+        rows = db.execute(
+            sql_text(sql).bindparams(bindparam("uids", expanding=True)), {"uids": user_ids, **params}
+        ).fetchall()
+        return {r[0]: tuple(r[1:]) for r in rows}
+
+    def _watermarks(self, db: Session, user_ids: List[str]) -> Dict[str, tuple]:
+        """risk_engine.risk_watermark for every user of the chunk, one GROUP BY per table."""
+        parts = [
+            self._grouped(db, f"SELECT user_id, MAX(id) FROM {table} WHERE user_id IN :uids GROUP BY user_id", user_ids)
+            for table in ("journals", "chat_messages", "chat_events")
+        ]
+        parts.append(self._grouped(db, "SELECT user_id, revision FROM user_risk_revisions WHERE user_id IN :uids", user_ids))
+        return {uid: tuple(p.get(uid, (None,))[0] for p in parts) for uid in user_ids}
+
+    def _latest_snapshots(self, db: Session, user_ids: List[str]) -> Dict[str, models.RiskSnapshot]:
+        S = models.RiskSnapshot
+        ranked = select(
+            S.id,
+            func.row_number().over(partition_by=S.user_id, order_by=(S.created_at.desc(), S.id.desc())).label("rn"),
+        ).where(S.user_id.in_(user_ids)).subquery()
+        rows = db.query(S).join(ranked, ranked.c.id == S.id).filter(ranked.c.rn == 1).all()
+        return {r.user_id: r for r in rows}
+
+    def write_snapshots(
+        self, db: Session, results: Dict[str, Dict[str, Any]], watermarks: Dict[str, tuple], now: datetime
+    ) -> tuple[int, int]:
+        """Bulk-persist `score_chunk` output with materialize_snapshot semantics; returns (inserted, refreshed)."""
+        evaluated_at = now.replace(tzinfo=timezone.utc)
+        user_ids = list(results)
+        flags = {
+            uid: dict(zip(SNAPSHOT_FLAGS, vals))
+            for uid, vals in self._grouped(
+                db,
+                f"SELECT user_id, {FLAGS_SELECT} FROM chat_events WHERE user_id IN :uids AND created_at >= :since GROUP BY user_id",
+                user_ids,
+                since=now - timedelta(days=EvaluationContext.HORIZON_DAYS),
+            ).items()
+        }
+        latest = self._latest_snapshots(db, user_ids)
+        inserts = []
+        refreshed = 0
+        for uid, result in results.items():
+            fields = snapshot_fields(result, flags.get(uid, {}), self.evaluator.rules_version, watermarks[uid], evaluated_at)
+            prev = latest.get(uid)
+            if snapshot_unchanged(prev, fields):
+                prev.watermark = fields["watermark"]
+                prev.evaluated_at = evaluated_at
+                refreshed += 1
+            else:
+                inserts.append({"user_id": uid, **fields})
+        if inserts:
+            db.execute(models.RiskSnapshot.__table__.insert(), inserts)
+        db.commit()
+        return len(inserts), refreshed
@@ -0,0 +1,386 @@
+"""Compiler for the risk_rules.yaml feature DSL into one SQL aggregate query.
+
+Feature rules such as ``delta(mood, 7d) < -1.5`` or ``avg(chat.negative, 30d) >= 0.05``
+are parsed into a small AST. The data sources they reference (``mood``,
+``chat.negative``, ``self_harm_phrases``...) are bound to the per-row counters
+RiskEvaluator scores from (see risk_engine.*_contrib), and their windows (``7d``) are
+added to the windows the evaluator reads. Every (counter, window) pair then becomes
+one conditional aggregate, ``SUM(...) FILTER (WHERE created_at >= :since_7)``, in a
+single statement over journals, chat_messages and chat_events. The thresholds in
+the rule text are documentation; the scoring ladders stay in RiskEvaluator.
+
+Plans are compiled once per (rules version, SQL dialect). AggregateContext runs a
+plan for one user and exposes the same `stats(days)` as EvaluationContext, so a new
+feature costs extra aggregate columns rather than another scan.
+"""
+
+import re
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text as sql_text
+from sqlalchemy.orm import Session
+
+from .risk_engine import SCALE, Stats
+from .risk_profile import count
+
+
+class RuleSyntaxError(ValueError):
+    pass
+
+
+# --- parsing ---
+
+_TOKEN = re.compile(
+    r"\s*(?:(?P<dur>\d+d)\b|(?P<num>-?\d+(?:\.\d+)?)|(?P<op><=|>=|==|!=|<|>)"
+    r"|(?P<ident>[A-Za-z_][\w.]*)|(?P<punct>[(),]))"
+)
+_KEYWORDS = {"and", "or", "not"}
+
+
+def _tokenize(src: str) -> List[Tuple[str, str]]:
+    tokens, pos = [], 0
+    src = src.strip()
+    while pos < len(src):
+        m = _TOKEN.match(src, pos)
+        if not m or m.end() == pos:
+            raise RuleSyntaxError(f"unexpected character at {pos}: {src[pos:pos + 10]!r}")
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == "ident" and value in _KEYWORDS or kind == "punct":
+            kind = value
+        tokens.append((kind, value))
+        pos = m.end()
+    return tokens
+
+
+class _Parser:
+    """expr := and ('or' and)* ; and := cmp ('and' cmp)* ; cmp := unary (op unary)?
+    unary := 'not' unary | atom ; atom := num | dur | ident ['(' args ')'] | '(' expr ')'"""
+
+    def __init__(self, src: str):
+        self.tokens = _tokenize(src)
+        self.i = 0
+
+    def _peek(self) -> Optional[str]:
+        return self.tokens[self.i][0] if self.i < len(self.tokens) else None
+
+    def _take(self, kind: str) -> str:
+        if self._peek() != kind:
+            got = self.tokens[self.i][1] if self.i < len(self.tokens) else "end of rule"
+            raise RuleSyntaxError(f"expected {kind}, got {got!r}")
+        self.i += 1
+        return self.tokens[self.i - 1][1]
+
+    def parse(self) -> tuple:
+        node = self._or()
+        if self.i != len(self.tokens):
+            raise RuleSyntaxError(f"unexpected {self.tokens[self.i][1]!r}")
+        return node
+
+    def _or(self) -> tuple:
+        parts = [self._and()]
+        while self._peek() == "or":
+            self.i += 1
+            parts.append(self._and())
+        return parts[0] if len(parts) == 1 else ("or", parts)
+
+    def _and(self) -> tuple:
+        parts = [self._cmp()]
+        while self._peek() == "and":
+            self.i += 1
+            parts.append(self._cmp())
+        return parts[0] if len(parts) == 1 else ("and", parts)
+
+    def _cmp(self) -> tuple:
+        left = self._unary()
+        if self._peek() == "op":
+            op = self._take("op")
+            return ("cmp", op, left, self._unary())
+        return left
+
+    def _unary(self) -> tuple:
+        if self._peek() == "not":
+            self.i += 1
+            return ("not", self._unary())
+        return self._atom()
+
+    def _atom(self) -> tuple:
+        kind = self._peek()
+        if kind == "num":
+            return ("num", float(self._take("num")))
+        if kind == "dur":
+            return ("dur", int(self._take("dur")[:-1]))
+        if kind == "ident":
+            name = self._take("ident")
+            if self._peek() != "(":
+                return ("ref", name)
+            self.i += 1
+            args = []
+            if self._peek() != ")":
+                args.append(self._or())
+                while self._peek() == ",":
+                    self.i += 1
+                    args.append(self._or())
+            self._take(")")
+            return ("call", name, args)
+        if kind == "(":
+            self.i += 1
+            node = self._or()
+            self._take(")")
+            return node
+        raise RuleSyntaxError(f"unexpected {self.tokens[self.i][1] if kind else 'end of rule'!r}")
+
+
+def parse_rule(src: str) -> tuple:
+    return _Parser(src).parse()
+
+
+# --- binding ---
+
+FUNCTIONS = {"avg", "sum", "count", "min", "max", "any", "delta", "miss_rate", "suicidality_within"}
+
+_CHAT_NEG = ("c_rows", "c_sent_n", "c_flag_rows", "c_neg_sum", "e_rows", "e_sent_n", "e_flag_rows", "e_neg_sum")
+_JOURNAL_LANG = ("j_rows", "j_valid", "j_neg_lang_sum")
+
+# DSL data source -> counters it reads. Sources with no counters have no stored data yet.
+SOURCES: Dict[str, Tuple[str, ...]] = {
+    "mood": ("j_rows", "j_mood_n", "j_mood_sum"),
+    "safety": (),
+    "miss_rate": (),
+    "breath_irregularity": (),
+    "nlp.sentiment": _JOURNAL_LANG,
+    "nlp.anger": _JOURNAL_LANG,
+    "chat.nlp.negative": _CHAT_NEG,
+    "self_harm_phrases": ("self_harm_rows",),
+    "weapon_phrases": ("weapon_rows",),
+    "stalking_phrases": ("stalking_rows",),
+    "surveillance_phrases": ("surveillance_rows",),
+    "journal.positive": ("j_rows", "j_pos_hits", "j_chunks"),
+    "chat.positive": ("c_pos_n", "c_pos_sum", "e_rows", "e_pos_n", "e_pos_sum"),
+    "intent.safety_planning": ("c_rows", "c_safety"),
+    "journal.negative": ("j_rows", "j_neg30_hits", "j_chunks"),
+    "chat.negative": ("c_rows", "c_sent_n", "c_neg_sum"),
+    "current_7d_vs_90d": ("j_baseline_neg", "j_valid", "c_neg_sum", "c_sent_n"),
+    "suicidality_within": ("self_harm_sticky_rows",),
+}
+
+
+def _bind(node: tuple, counters: set, windows: set) -> None:
+    kind = node[0]
+    if kind == "dur":
+        windows.add(node[1])
+    elif kind == "ref":
+        name = node[1]
+        if name not in SOURCES:
+            raise RuleSyntaxError(f"unknown data source {name!r}")
+        counters.update(SOURCES[name])
+        # Windows spelled into a source name, e.g. current_7d_vs_90d
+        windows.update(int(d) for d in re.findall(r"(\d+)d", name))
+    elif kind == "call":
+        name, args = node[1], node[2]
+        if name not in FUNCTIONS:
+            raise RuleSyntaxError(f"unknown function {name!r}")
+        if name in SOURCES:
+            counters.update(SOURCES[name])
+        for a in args:
+            _bind(a, counters, windows)
+    elif kind == "cmp":
+        _bind(node[2], counters, windows)
+        _bind(node[3], counters, windows)
+    elif kind == "not":
+        _bind(node[1], counters, windows)
+    elif kind in ("and", "or"):
+        for part in node[1]:
+            _bind(part, counters, windows)
+
+
+# --- SQL generation ---
+
+_TABLES = {
+    "j": ("journals", ""),
+    "c": ("chat_messages", " AND role = 'user'"),
+    "e": ("chat_events", ""),
+}
+_FLAGS = "(threats_to_kill OR strangulation OR weapon_involved)"
+
+
+def _fixed_sql(expr: str) -> str:
+    # risk_engine._fixed, per row
+    return f"ROUND(({expr}) * {SCALE})"
+
+
+def _counter_sql(json_count) -> Dict[str, List[Tuple[str, str, Optional[str]]]]:
+    """counter -> [(table alias, 'count' | SQL value to sum, extra condition)]."""
+    def sentiment(p: str) -> Dict[str, list]:
+        return {
+            f"{p}_rows": [(p, "count", None)],
+            f"{p}_sent_n": [(p, "count", "sentiment_score IS NOT NULL")],
+            f"{p}_neg_sum": [(p, _fixed_sql("-sentiment_score"), "sentiment_score < 0")],
+            f"{p}_pos_n": [(p, "count", "sentiment_score > 0")],
+            f"{p}_pos_sum": [(p, _fixed_sql("sentiment_score"), "sentiment_score > 0")],
+            f"{p}_flag_rows": [(p, "count", _FLAGS)],
+        }
+
+    def text_rows(cond: str) -> list:
+        return [("j", "count", cond), ("c", "count", cond)]
+
+    return {
+        "j_rows": [("j", "count", None)],
+        "j_valid": [("j", "count", None)],
+        "j_mood_n": [("j", "count", "word_count > 0")],
+        "j_mood_sum": [("j", _fixed_sql(
+            f"CAST({json_count('mood_positive')} - {json_count('mood_negative')} AS DOUBLE PRECISION) / word_count"
+        ), "word_count > 0")],
+        "j_neg_lang_sum": [("j", _fixed_sql(
+            f"CAST({json_count('negative_words')} AS DOUBLE PRECISION) * 0.1"
+            f" + CAST({json_count('concerning_phrases')} AS DOUBLE PRECISION) * 0.5"
+        ), None)],
+        "j_chunks": [("j", "CASE WHEN word_count / 50 > 1 THEN word_count / 50 ELSE 1 END", None)],
+        "j_pos_hits": [("j", json_count("positive_affect"), None)],
+        "j_neg30_hits": [("j", json_count("journal_negative"), None)],
+        "j_baseline_neg": [("j", "count", f"{json_count('baseline_negative')} > 0")],
+        "self_harm_rows": text_rows("suicidality_hits > 0"),
+        "self_harm_sticky_rows": text_rows(f"{json_count('self_harm_sticky')} > 0"),
+        "weapon_rows": text_rows("weapon_hits > 0"),
+        "stalking_rows": text_rows("stalking_hits > 0"),
+        "surveillance_rows": text_rows("digital_surveillance_hits > 0"),
+        **sentiment("c"),
+        "c_safety": [("c", "count", "intent = 'safety_planning'")],
+        **sentiment("e"),
+    }
+
+
+def _json_count_fn(dialect: str):
+    if dialect == "sqlite":
+        return lambda key: f"COALESCE(json_extract(lexicon_counts, '$.{key}'), 0)"
+    return lambda key: f"COALESCE(CAST(CAST(lexicon_counts AS json) ->> '{key}' AS INTEGER), 0)"
+
+
+class QueryPlan:
+    """Compiled aggregate query for a rules version: one column per (table, counter, window)."""
+
+    def __init__(self, rules_version: str, features: Dict[str, str], feature_inputs: Dict[str, tuple], dialect: str):
+        self.rules_version = rules_version
+        self.dialect = dialect
+        self.errors: Dict[str, str] = {}
+        self.columns_by_feature: Dict[str, List[str]] = {}
+        needed: Dict[int, set] = {}
+        for name, rule in features.items():
+            counters, windows = set(), set()
+            try:
+                _bind(parse_rule(str(rule)), counters, windows)
+            except RuleSyntaxError as e:
+                self.errors[name] = str(e)
+                continue
+            # The scoring code's windows always apply, whether or not the rule spells them out
+            windows.update(feature_inputs.get(name, (set(), ()))[1])
+            self.columns_by_feature[name] = sorted(f"{c}@{d}d" for c in counters for d in windows)
+            if counters:
+                for d in windows:
+                    needed.setdefault(d, set()).update(counters)
+        self.windows = sorted(needed)
+        self.sql = self._build_sql(needed) if needed else None
+
+    @property
+    def usable(self) -> bool:
+        return not self.errors and self.sql is not None
+
+    def _build_sql(self, needed: Dict[int, set]) -> str:
+        spec = _counter_sql(_json_count_fn(self.dialect))
+        columns: Dict[str, List[str]] = {alias: [] for alias in _TABLES}
+        self.column_map: List[Tuple[str, int, str]] = []  # (result column, window, counter)
+        for days in sorted(needed):
+            for counter in sorted(needed[days]):
+                for alias, value, cond in spec[counter]:
+                    where = f"created_at >= :since_{days}" + (f" AND {cond}" if cond else "")
+                    if value == "count":
+                        agg = f"COUNT(*) FILTER (WHERE {where})"
+                    else:
+                        agg = f"COALESCE(SUM({value}) FILTER (WHERE {where}), 0)"
+                    col = f"{alias}__{counter}__{days}"
+                    columns[alias].append(f"{agg} AS {col}")
+                    self.column_map.append((col, days, counter))
+        horizon = max(needed)
+        parts = []
+        for alias, (table, extra) in _TABLES.items():
+            cols = columns[alias]
+            if not cols:
+                continue
+            if alias in ("j", "c"):
+                # Legacy rows without write-time lexical columns can only be scored in Python
+                cols.append(f"COUNT(*) FILTER (WHERE lexicon_counts IS NULL) AS {alias}__legacy")
+            parts.append(
+                f"(SELECT {', '.join(cols)} FROM {table}"
+                f" WHERE user_id = :uid AND created_at >= :since_{horizon} AND created_at <= :until{extra}) AS {alias}"
+            )
+        return "SELECT * FROM " + " CROSS JOIN ".join(parts)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "rules_version": self.rules_version,
+            "usable": self.usable,
+            "windows": self.windows,
+            "columns": len(getattr(self, "column_map", [])),
+            "features": self.columns_by_feature,
+            "errors": self.errors,
+        }
+
+
+_plans: Dict[tuple, QueryPlan] = {}
+_plans_lock = threading.Lock()
+
+
+def compiled_plan(evaluator: Any, dialect: str, feature: Optional[str] = None) -> QueryPlan:
+    """The evaluator's QueryPlan, compiled once per (rules version, dialect).
+
+    With `feature`, a plan holding only that feature's columns (for running features
+    as independent queries).
+    """
+    key = (evaluator.rules_version, dialect, feature)
+    plan = _plans.get(key)
+    if plan is None:
+        with _plans_lock:
+            plan = _plans.get(key)
+            if plan is None:
+                features = evaluator.features if feature is None else {feature: evaluator.features[feature]}
+                plan = QueryPlan(evaluator.rules_version, features, evaluator.FEATURE_INPUTS, dialect)
+                if plan.errors:
+                    print(f"Risk rules {evaluator.rules_version} not compiled to SQL: {plan.errors}")
+                _plans[key] = plan
+    return plan
+
+
+class AggregateContext:
+    """`stats(days)` for one user from a single run of a QueryPlan."""
+
+    def __init__(self, stats: Dict[int, Stats]):
+        self._stats = stats
+
+    @classmethod
+    def load(cls, db: Session, user_id: str, plan: QueryPlan, now: Optional[datetime] = None) -> Optional["AggregateContext"]:
+        """Run the plan; None if the plan or the user's rows cannot be aggregated in SQL."""
+        if plan.errors:
+            return None
+        if plan.sql is None:
+            return cls({})  # only placeholder features: nothing to aggregate
+        now = now or datetime.utcnow()
+        params: Dict[str, Any] = {"uid": user_id, "until": now}
+        params.update({f"since_{d}": now - timedelta(days=d) for d in plan.windows})
+        try:
+            row = db.execute(sql_text(plan.sql), params).mappings().first()
+            count("rows", 1 if row is not None else 0)
+        except Exception as e:
+            db.rollback()
+            print(f"Aggregate risk query failed, falling back: {e}")
+            return None
+        if row is None or row.get("j__legacy") or row.get("c__legacy"):
+            return None
+        stats: Dict[int, Stats] = {d: Stats() for d in plan.windows}
+        for col, days, counter in plan.column_map:
+            stats[days][counter] += int(row[col] or 0)
+        return cls(stats)
+
+    def stats(self, days: int) -> Stats:
+        return self._stats[days]
@@ -0,0 +1,710 @@
+"""Windowed aggregates behind RiskEvaluator, plus an incremental per-user engine.
+
+Every journal, user chat message and chat_event contributes a small record of integer
+counters (see *_contrib below). A feature reads the summed counters of its window, so
+the same scoring code runs over a freshly loaded EvaluationContext or over the rolling
+totals IncrementalRiskEngine keeps in memory. Fractional values are stored in
+fixed point (SCALE) so running sums can be aged out by subtraction without drift.
+"""
+
+import bisect
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import and_, text as sql_text
+from sqlalchemy.orm import Session, defer
+
+from . import models
+from .crypto import decrypt_many, decrypt_stored, stored_ciphertext
+from .nlp_utils import PhraseHits, scan_text
+from .risk_profile import count, phase
+
+SCALE = 1_000_000
+
+# Event kinds as seen by the write paths and the dependency map
+JOURNAL = "journal"
+CHAT = "chat"
+CHAT_EVENT = "chat_event"
+
+
+def naive_utc(ts: datetime) -> datetime:
+    """Normalize DB timestamps (aware on Postgres, naive or raw strings on SQLite) to naive UTC."""
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    if ts is not None and ts.tzinfo is not None:
+        return ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def _fixed(x: float) -> int:
+    return int(round(x * SCALE))
+
+
+class Stats(dict):
+    """Counter dict: missing counters read as 0."""
+
+    def __missing__(self, key: str) -> int:
+        return 0
+
+    def add(self, other: Dict[str, int]) -> None:
+        for k, v in other.items():
+            self[k] = self.get(k, 0) + v
+
+    def sub(self, other: Dict[str, int]) -> None:
+        for k, v in other.items():
+            self[k] = self.get(k, 0) - v
+
+
+def _text_contrib(out: Stats, hits: PhraseHits) -> None:
+    for field, category in [
+        ("self_harm_rows", "self_harm"),
+        ("self_harm_sticky_rows", "self_harm_sticky"),
+        ("weapon_rows", "weapon"),
+        ("stalking_rows", "stalking"),
+        ("surveillance_rows", "digital_surveillance"),
+    ]:
+        if hits.any(category):
+            out[field] = 1
+
+
+def journal_contrib(hits: Optional[PhraseHits], word_count: int) -> Stats:
+    """Counters for one journal; `hits` is None when the row could not be decrypted."""
+    out = Stats(j_rows=1)
+    if hits is None:
+        return out
+    out["j_valid"] = 1
+    if word_count > 0:
+        out["j_mood_n"] = 1
+        out["j_mood_sum"] = _fixed((hits.count("mood_positive") - hits.count("mood_negative")) / word_count)
+    out["j_neg_lang_sum"] = _fixed(hits.count("negative_words") * 0.1 + hits.count("concerning_phrases") * 0.5)
+    out["j_chunks"] = max(1, word_count // 50)
+    out["j_pos_hits"] = hits.count("positive_affect")
+    out["j_neg30_hits"] = hits.count("journal_negative")
+    if hits.any("baseline_negative"):
+        out["j_baseline_neg"] = 1
+    _text_contrib(out, hits)
+    return out
+
+
+def _sentiment_contrib(out: Stats, prefix: str, sentiment_score: Optional[float], flags: Iterable[Any]) -> None:
+    if sentiment_score is not None:
+        s = float(sentiment_score)
+        out[f"{prefix}_sent_n"] = 1
+        out[f"{prefix}_neg_sum"] = _fixed(max(0.0, -s))
+        if s > 0:
+            out[f"{prefix}_pos_n"] = 1
+            out[f"{prefix}_pos_sum"] = _fixed(s)
+    if any(bool(f) for f in flags):
+        out[f"{prefix}_flag_rows"] = 1
+
+
+def chat_contrib(hits: Optional[PhraseHits], row: Any) -> Stats:
+    """Counters for one user chat message (ChatMessage row or anything with its columns)."""
+    out = Stats(c_rows=1)
+    if hits is not None:
+        _text_contrib(out, hits)
+    _sentiment_contrib(out, "c", row.sentiment_score, [row.threats_to_kill, row.strangulation, row.weapon_involved])
+    if (row.intent or "") == "safety_planning":
+        out["c_safety"] = 1
+    return out
+
+
+def event_contrib(row: Any) -> Stats:
+    """Counters for one chat_events row (result row or the insert payload dict)."""
+    get = row.get if isinstance(row, dict) else (lambda k: getattr(row, k))
+    out = Stats(e_rows=1)
+    _sentiment_contrib(out, "e", get("sentiment_score"), [get("threats_to_kill"), get("strangulation"), get("weapon_involved")])
+    return out
+
+
+class TextRow:
+    """A journal or chat row scored from its write-time lexical features.
+
+    Rows written before those columns existed fall back to decrypting, lowercasing and
+    scanning the plaintext, at most once per row.
+    """
+    __slots__ = ("kind", "row", "created_at", "_text", "_loaded", "_hits", "_word_count", "_contrib")
+
+    def __init__(self, kind: str, row):
+        self.kind = kind
+        self.row = row
+        self.created_at = naive_utc(row.created_at)
+        self._text: Optional[str] = None
+        self._loaded = False
+        self._hits: Optional[PhraseHits] = None
+        self._word_count: Optional[int] = None
+        self._contrib: Optional[Stats] = None
+        if row.lexicon_counts is not None:
+            self._hits = PhraseHits(frozenset(), json.loads(row.lexicon_counts))
+            self._word_count = row.word_count or 0
+
+    @property
+    def key(self) -> tuple:
+        return (self.kind, self.row.id)
+
+    @property
+    def text(self) -> Optional[str]:
+        """Lowercased plaintext, or None if the row could not be decrypted."""
+        if not self._loaded:
+            self._loaded = True
+            count("decrypts")
+            try:
+                self._text = decrypt_stored(*stored_ciphertext(self.row)).lower()
+            except Exception as e:
+                print(f"Error decrypting {self.row.__tablename__} {self.row.id}: {e}")
+        return self._text
+
+    @property
+    def hits(self) -> Optional[PhraseHits]:
+        """Lexicon hits for the plaintext (see nlp_utils.LEXICONS), or None if undecryptable."""
+        if self._hits is None and self.text is not None:
+            self._hits = scan_text(self.text)
+        return self._hits
+
+    @property
+    def word_count(self) -> int:
+        if self._word_count is None:
+            self._word_count = len(self.text.split()) if self.text is not None else 0
+        return self._word_count
+
+    @property
+    def contrib(self) -> Stats:
+        if self._contrib is None:
+            if self.kind == JOURNAL:
+                self._contrib = journal_contrib(self.hits, self.word_count)
+            else:
+                self._contrib = chat_contrib(self.hits, self.row)
+        return self._contrib
+
+
+def prefetch_text(db: Session, rows: Iterable["TextRow"]) -> None:
+    """Decrypt every row lacking lexical features in one batch per table.
+
+    Their ciphertext is deferred on load; fetching it row by row would cost a query
+    and a decrypt each.
+    """
+    by_model: Dict[Any, Dict[int, TextRow]] = {}
+    for r in rows:
+        if r._hits is None and not r._loaded:
+            by_model.setdefault(type(r.row), {})[r.row.id] = r
+    for model, pending in by_model.items():
+        ids = list(pending)
+        cipher = {
+            c.id: stored_ciphertext(c)
+            for c in db.query(model.id, model.ciphertext, model.iv, model.ciphertext_b64, model.iv_b64, model.key_id).filter(model.id.in_(ids))
+        }
+        ids = [i for i in ids if i in cipher]
+        count("decrypts", len(ids))
+        texts = decrypt_many(
+            [cipher[i] for i in ids],
+            on_error=lambda k, e: print(f"Error decrypting {model.__tablename__} {ids[k]}: {e}"),
+        )
+        for i, text in zip(ids, texts):
+            r = pending[i]
+            r._loaded = True
+            r._text = text.lower() if text is not None else None
+
+
+class EventRow:
+    """A chat_events row with its counter contributions, computed once."""
+    __slots__ = ("kind", "row", "created_at", "contrib")
+
+    def __init__(self, row):
+        self.kind = CHAT_EVENT
+        self.row = row
+        self.created_at = naive_utc(row.created_at)
+        self.contrib = event_contrib(row)
+
+    @property
+    def key(self) -> tuple:
+        return (CHAT_EVENT, self.row.event_id)
+
+
+class EvaluationContext:
+    """Everything one risk evaluation reads, loaded once per user.
+
+    The 90-day journals, user chat messages and chat_events are fetched with one query
+    each. Ciphertext columns are deferred: features read the lexical columns stored at
+    write time, and only legacy rows without them are decrypted (lazily, once per row).
+    `stats(days)` sums the per-row counters of a window. With an explicit `now` the
+    context is point-in-time: rows created after it are not loaded. With `upto` (a
+    risk_watermark) rows are capped at its journal, chat message and chat_event ids
+    instead, so a row whose created_at is ahead of the app clock is loaded with the
+    watermark that counts it. With `after` (another watermark) only rows with larger ids
+    are loaded.
+    """
+
+    HORIZON_DAYS = 90
+
+    def __init__(
+        self, db: Session, user_id: str, now: Optional[datetime] = None, horizon_days: Optional[int] = None,
+        after: Optional[tuple] = None, upto: Optional[tuple] = None,
+    ):
+        self.db = db
+        self.user_id = user_id
+        self.now = now or datetime.utcnow()
+        since = self.now - timedelta(days=horizon_days or self.HORIZON_DAYS)
+        after_journal, after_chat, after_event = (after or (None, None, None))[:3]
+        journal_filters = [models.Journal.user_id == user_id, models.Journal.created_at >= since]
+        chat_filters = [models.ChatMessage.user_id == user_id, models.ChatMessage.created_at >= since, models.ChatMessage.role == "user"]
+        event_filters = "user_id = :uid AND created_at >= :since"
+        if upto is None:
+            journal_filters.append(models.Journal.created_at <= self.now)
+            chat_filters.append(models.ChatMessage.created_at <= self.now)
+            event_filters += " AND created_at <= :until"
+            upto_event = None
+        else:
+            # A None id means no rows of that kind at the watermark
+            upto_journal, upto_chat, upto_event = (i or 0 for i in upto[:3])
+            journal_filters.append(models.Journal.id <= upto_journal)
+            chat_filters.append(models.ChatMessage.id <= upto_chat)
+            event_filters += " AND id <= :upto"
+        if after_journal is not None:
+            journal_filters.append(models.Journal.id > after_journal)
+        self._journals = [TextRow(JOURNAL, r) for r in db.query(models.Journal).options(
+            defer(models.Journal.ciphertext), defer(models.Journal.iv),
+            defer(models.Journal.ciphertext_b64), defer(models.Journal.iv_b64)
+        ).filter(and_(*journal_filters)).order_by(models.Journal.created_at.desc()).all()]
+        if after_chat is not None:
+            chat_filters.append(models.ChatMessage.id > after_chat)
+        self._chat = [TextRow(CHAT, r) for r in db.query(models.ChatMessage).options(
+            defer(models.ChatMessage.ciphertext), defer(models.ChatMessage.iv),
+            defer(models.ChatMessage.ciphertext_b64), defer(models.ChatMessage.iv_b64)
+        ).filter(and_(*chat_filters)).order_by(models.ChatMessage.created_at.desc()).all()]
+        self._events = [EventRow(r) for r in db.execute(sql_text(
+            f"""
+            SELECT event_id, created_at, sentiment_score, threats_to_kill, strangulation, weapon_involved
+            FROM chat_events
+            WHERE {event_filters}
+            {"AND id > :after" if after_event is not None else ""}
+            ORDER BY created_at DESC
+            """
+        ), {"uid": user_id, "since": since, "until": self.now, "upto": upto_event, "after": after_event}).fetchall()]
+        prefetch_text(db, self._journals + self._chat)
+        count("rows", len(self._journals) + len(self._chat) + len(self._events))
+        self._stats: Dict[int, Stats] = {}
+
+    def since(self, days: int) -> datetime:
+        return self.now - timedelta(days=days)
+
+    def rows(self) -> List[Any]:
+        """All loaded rows (journals, chat, events) across the horizon."""
+        return self._journals + self._chat + self._events
+
+    def stats(self, days: int) -> Stats:
+        """Summed counters of every row created in the last `days` days."""
+        if days not in self._stats:
+            since = self.since(days)
+            total = Stats()
+            for r in self.rows():
+                if r.created_at >= since:
+                    total.add(r.contrib)
+            self._stats[days] = total
+        return self._stats[days]
+
+
+class _SlidingWindow:
+    """Running counter totals for one window length, aged out as `now` advances."""
+    __slots__ = ("days", "items", "head", "totals")
+
+    def __init__(self, days: int):
+        self.days = days
+        self.items: List[tuple] = []  # (created_at, seq, key, contrib), sorted
+        self.head = 0
+        self.totals = Stats()
+
+    def add(self, item: tuple, now: datetime) -> None:
+        if item[0] < now - timedelta(days=self.days):
+            return
+        if self.items and item[:2] < self.items[-1][:2]:
+            bisect.insort(self.items, item, lo=self.head, key=lambda i: i[:2])
+        else:
+            self.items.append(item)
+        self.totals.add(item[3])
+
+    def expire(self, now: datetime) -> List[tuple]:
+        cutoff = now - timedelta(days=self.days)
+        expired = []
+        while self.head < len(self.items) and self.items[self.head][0] < cutoff:
+            item = self.items[self.head]
+            self.totals.sub(item[3])
+            expired.append(item)
+            self.head += 1
+        if self.head > 64 and self.head * 2 > len(self.items):
+            self.items = self.items[self.head:]
+            self.head = 0
+        return expired
+
+
+class _UserState:
+    __slots__ = ("lock", "loaded", "windows", "seen", "results", "dirty", "seq", "watermark")
+
+    def __init__(self, window_days: Iterable[int]):
+        self.lock = threading.Lock()
+        self.reset(window_days)
+
+    def reset(self, window_days: Iterable[int]) -> None:
+        self.loaded = False
+        self.windows = {d: _SlidingWindow(d) for d in sorted(window_days)}
+        self.seen: set = set()
+        self.results: Dict[str, tuple] = {}
+        self.dirty: set = set()
+        self.seq = 0
+        self.watermark: Optional[tuple] = None  # risk_watermark the DB rows were last read at
+
+    def stats(self, days: int) -> Stats:
+        return self.windows[days].totals
+
+
+class IncrementalRiskEngine:
+    """Per-user rolling-window aggregates kept in process memory.
+
+    The first read for a user loads its 90-day rows once (as EvaluationContext does);
+    after that, write paths push each new journal, chat message and chat_event through
+    `record_*`, which adds its counters to every window and marks only the features
+    whose inputs depend on that event kind as dirty. Reads age out expired rows, mark
+    the features of windows that changed, rescore just the dirty features and
+    recombine the weights, so a read costs O(features) no matter how long the history.
+
+    State is per process and bounded to `max_users` (least recently used dropped). Each
+    user's state remembers the risk_watermark its rows were read at, and every read
+    compares it with the current one, so writes made elsewhere (other workers, scripts)
+    are not missed: if ids only grew, the rows after the remembered ids are loaded (rows
+    already pushed through `record_*` are skipped); any other change, including a
+    revision bumped by a delete or in-place update, reloads the user.
+    """
+
+    def __init__(self, evaluator: Any, max_users: int = 10_000):
+        self.evaluator = evaluator
+        self.max_users = max_users
+        self._users: "OrderedDict[str, _UserState]" = OrderedDict()
+        self._lock = threading.Lock()
+        inputs = evaluator.FEATURE_INPUTS
+        self.window_days = sorted({d for _, windows in inputs.values() for d in windows} | {EvaluationContext.HORIZON_DAYS})
+        # Dependency map: which features to rescore when an event kind is written or a window slides
+        self.features_by_kind: Dict[str, set] = {}
+        self.features_by_window: Dict[int, set] = {}
+        for name, (kinds, windows) in inputs.items():
+            for k in kinds:
+                self.features_by_kind.setdefault(k, set()).add(name)
+            for d in windows:
+                self.features_by_window.setdefault(d, set()).add(name)
+
+    def _state(self, user_id: str, create: bool) -> Optional[_UserState]:
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is not None:
+                self._users.move_to_end(user_id)
+            elif create:
+                state = self._users[user_id] = _UserState(self.window_days)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            return state
+
+    def _affected(self, kind: str) -> set:
+        known = self.features_by_kind.get(kind, set())
+        # Features missing from FEATURE_INPUTS are rescored on every change
+        return known | {f for f in self.evaluator.features if f not in self.evaluator.FEATURE_INPUTS}
+
+    def _add(self, state: _UserState, kind: str, key: Any, created_at: datetime, contrib: Stats, now: datetime) -> None:
+        ts = naive_utc(created_at) or now
+        if key in state.seen or ts < now - timedelta(days=max(state.windows)):
+            return
+        state.seen.add(key)
+        state.seq += 1
+        item = (ts, state.seq, key, contrib)
+        for w in state.windows.values():
+            w.add(item, now)
+
+    def _record(self, user_id: str, kind: str, key: Any, created_at: datetime, contrib_fn: Callable[[], Stats]) -> None:
+        state = self._state(user_id, create=False)
+        if state is None:
+            return  # not loaded yet; the first read picks the row up from the DB
+        with state.lock:
+            if not state.loaded:
+                return
+            self._add(state, kind, key, created_at, contrib_fn(), datetime.utcnow())
+            state.dirty |= self._affected(kind)
+
+    def record_journal(self, user_id: str, row: models.Journal, hits: Optional[PhraseHits]) -> None:
+        self._record(user_id, JOURNAL, (JOURNAL, row.id), row.created_at,
+                     lambda: journal_contrib(hits, row.word_count or 0))
+
+    def record_chat_message(self, user_id: str, row: models.ChatMessage, hits: Optional[PhraseHits]) -> None:
+        if row.role != "user":
+            return
+        self._record(user_id, CHAT, (CHAT, row.id), row.created_at, lambda: chat_contrib(hits, row))
+
+    def record_chat_event(self, user_id: str, event: Dict[str, Any]) -> None:
+        self._record(user_id, CHAT_EVENT, (CHAT_EVENT, event.get("event_id")),
+                     event.get("created_at") or datetime.utcnow(), lambda: event_contrib(event))
+
+    def forget(self, user_id: str) -> None:
+        """Drop a user's state (e.g. after deletes); the next read reloads from the DB."""
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def _load(
+        self, state: _UserState, db: Session, user_id: str, now: datetime, upto: tuple, after: Optional[tuple] = None,
+    ) -> None:
+        with phase("load"):
+            # Capped at the watermark's ids, not at `now`: the DB clock may run ahead of ours
+            ctx = EvaluationContext(db, user_id, now, after=after, upto=upto)
+            rows = sorted(ctx.rows(), key=lambda r: r.created_at)
+            for r in rows:
+                self._add(state, r.kind, r.key, r.created_at, r.contrib, now)
+        if after is None:
+            state.loaded = True
+            state.dirty = set(self.evaluator.features)
+        else:
+            for kind in {r.kind for r in rows}:
+                state.dirty |= self._affected(kind)
+
+    def _sync(self, state: _UserState, db: Session, user_id: str, watermark: tuple, now: datetime) -> None:
+        """Bring the state up to `watermark`: load it, catch up on new rows, or reload."""
+        if state.loaded and state.watermark != watermark:
+            if _only_grew(state.watermark, watermark):
+                self._load(state, db, user_id, now, watermark, after=state.watermark)
+            else:
+                state.reset(self.window_days)
+        if not state.loaded:
+            self._load(state, db, user_id, now, watermark)
+        state.watermark = watermark
+
+    def evaluate(self, db: Session, user_id: str, watermark: Optional[tuple] = None) -> Dict[str, Any]:
+        """Risk result for a user, rescoring only the features invalidated since the last read.
+
+        `watermark` is the user's current risk_watermark (queried when not given).
+        """
+        if not self.evaluator.rules:
+            return self.evaluator.evaluate_user_risk(db, user_id)
+        if watermark is None:
+            watermark = risk_watermark(db, user_id)
+        state = self._state(user_id, create=True)
+        with state.lock:
+            now = datetime.utcnow()
+            self._sync(state, db, user_id, tuple(watermark), now)
+            for days, w in state.windows.items():
+                expired = w.expire(now)
+                if expired:
+                    state.dirty |= self.features_by_window.get(days, set())
+                    if days == max(state.windows):
+                        state.seen.difference_update(item[2] for item in expired)
+            if state.dirty:
+                state.results.update(self.evaluator.score_features(state, state.dirty))
+                state.dirty = set()
+            return self.evaluator.combine(state.results)
+
+
+def _only_grew(old: Optional[tuple], new: tuple) -> bool:
+    """True if rows were only added: same revision, and every id in `new` at least the one in `old`."""
+    if old is None or len(old) != len(new) or old[-1] != new[-1]:
+        return False
+    return all(o is None or (n is not None and n >= o) for o, n in zip(old[:-1], new[:-1]))
+
+
+def risk_watermark(db: Session, user_id: str) -> tuple:
+    """Latest journal, chat message and chat_event ids plus the revision for a user; changes on every write."""
+    row = db.execute(sql_text(
+        """
+        SELECT
+            (SELECT MAX(id) FROM journals WHERE user_id = :uid),
+            (SELECT MAX(id) FROM chat_messages WHERE user_id = :uid),
+            (SELECT MAX(id) FROM chat_events WHERE user_id = :uid),
+            (SELECT revision FROM user_risk_revisions WHERE user_id = :uid)
+        """
+    ), {"uid": user_id}).first()
+    return tuple(row) if row else (None, None, None, None)
+
+
+def bump_risk_revision(db: Session, user_id: str) -> None:
+    """Move a user's watermark after a write that adds no rows (a delete, an in-place update).
+
+    Every process then misses its cached result and snapshot for the user and reloads
+    its engine state. Runs in the caller's transaction; commit with the change itself.
+    """
+    db.execute(sql_text(
+        """
+        INSERT INTO user_risk_revisions (user_id, revision) VALUES (:uid, 1)
+        ON CONFLICT (user_id) DO UPDATE SET revision = user_risk_revisions.revision + 1
+        """
+    ), {"uid": user_id})
+
+
+class RiskResultCache:
+    """Bounded LRU/TTL cache of risk results, one entry per user.
+
+    Entries are keyed by (user_id, rules version, watermark). Write paths in this process
+    call `invalidate`; a write from another process changes the watermark (deletes and
+    in-place updates through `bump_risk_revision`), so the entry misses and `get`
+    reports it as stale. The TTL bounds memory for users who stop reading.
+    """
+
+    def __init__(self, max_entries: int = 10_000, ttl_seconds: float = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # user_id -> (key, value, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: tuple) -> tuple[Optional[Dict[str, Any]], bool]:
+        """Return (value, stale): value on a hit; stale if the user's entry was for an older key."""
+        user_id = key[0]
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            cached_key, value, expires_at = entry
+            if cached_key != key:
+                del self._entries[user_id]
+                self.misses += 1
+                return None, True
+            if time.monotonic() >= expires_at:
+                del self._entries[user_id]
+                self.expirations += 1
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return value, False
+
+    def put(self, key: tuple, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key[0]] = (key, value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key[0])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+SNAPSHOT_FLAGS = ("threats_to_kill", "strangulation", "weapon_involved", "children_present", "stalking", "digital_surveillance")
+
+
+def latest_snapshot(db: Session, user_id: str) -> Optional[models.RiskSnapshot]:
+    return (
+        db.query(models.RiskSnapshot)
+        .filter(models.RiskSnapshot.user_id == user_id)
+        .order_by(models.RiskSnapshot.created_at.desc(), models.RiskSnapshot.id.desc())
+        .first()
+    )
+
+
+def snapshot_is_fresh(snap: Optional[models.RiskSnapshot], rules_version: str, watermark: tuple, max_age_seconds: float) -> bool:
+    """True if the snapshot was evaluated under these rules, after the user's last write, recently."""
+    if snap is None or snap.rules_version != rules_version or not snap.watermark or snap.evaluated_at is None:
+        return False
+    if tuple(json.loads(snap.watermark)) != tuple(watermark):
+        return False
+    # Windows age even without writes, so a snapshot is only trusted for a bounded time
+    age = datetime.utcnow() - naive_utc(snap.evaluated_at)
+    return age.total_seconds() < max_age_seconds
+
+
+def snapshot_result(snap: models.RiskSnapshot, weights: Dict[str, Any], thresholds: Dict[str, Any]) -> Dict[str, Any]:
+    """Rebuild an evaluation result (same shape as RiskEvaluator.combine) from a snapshot row."""
+    return {
+        "score": snap.risk_score,
+        "level": snap.risk_level,
+        "reasons": json.loads(snap.reasons) if snap.reasons else [],
+        "feature_scores": json.loads(snap.feature_scores),
+        "weights": weights,
+        "thresholds": thresholds,
+    }
+
+
+# Any-true per flag column over chat_events; callers add WHERE/GROUP BY
+FLAGS_SELECT = ", ".join(f"MAX(CASE WHEN {f} THEN 1 ELSE 0 END)" for f in SNAPSHOT_FLAGS)
+
+
+def _risk_flags(db: Session, user_id: str, since: datetime) -> Dict[str, bool]:
+    row = db.execute(sql_text(
+        f"SELECT {FLAGS_SELECT} FROM chat_events WHERE user_id = :uid AND created_at >= :since"
+    ), {"uid": user_id, "since": since}).first()
+    return {name: bool(v) for name, v in zip(SNAPSHOT_FLAGS, row or ())}
+
+
+def snapshot_fields(
+    result: Dict[str, Any], flags: Dict[str, bool], rules_version: str, watermark: tuple, now: datetime
+) -> Dict[str, Any]:
+    """RiskSnapshot column values (minus user_id) for an evaluation result."""
+    return {
+        "risk_score": result["score"],
+        "risk_level": result["level"],
+        "feature_scores": json.dumps(result.get("feature_scores", {})),
+        "reasons": json.dumps(result.get("reasons", [])),
+        "rules_version": rules_version,
+        "watermark": json.dumps(list(watermark)),
+        "evaluated_at": now,
+        **{k: bool(flags.get(k, False)) for k in SNAPSHOT_FLAGS},
+    }
+
+
+def snapshot_unchanged(prev: Optional[models.RiskSnapshot], fields: Dict[str, Any]) -> bool:
+    """True if `prev` already records this result (ignoring watermark and evaluated_at)."""
+    if prev is None:
+        return False
+    return all(
+        getattr(prev, k) == fields[k]
+        for k in ("rules_version", "risk_score", "risk_level", "feature_scores", "reasons") + SNAPSHOT_FLAGS
+    )
+
+
+def materialize_snapshot(
+    db: Session, user_id: str, result: Dict[str, Any], rules_version: str, watermark: tuple
+) -> Optional[models.RiskSnapshot]:
+    """Persist `result` as a new RiskSnapshot if it differs from the newest one.
+
+    An unchanged result only refreshes the newest row's watermark and evaluated_at, so
+    risk_snapshots keeps one row per change rather than one per read.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        flags = _risk_flags(db, user_id, now.replace(tzinfo=None) - timedelta(days=EvaluationContext.HORIZON_DAYS))
+    except Exception:
+        db.rollback()  # chat_events is created lazily; snapshot without flags
+        flags = {}
+    fields = snapshot_fields(result, flags, rules_version, watermark, now)
+    prev = latest_snapshot(db, user_id)
+    try:
+        if snapshot_unchanged(prev, fields):
+            prev.watermark = fields["watermark"]
+            prev.evaluated_at = now
+            db.commit()
+            return prev
+        snap = models.RiskSnapshot(user_id=user_id, **fields)
+        db.add(snap)
+        db.commit()
+        return snap
+    except Exception as e:
+        db.rollback()
+        print(f"Risk snapshot write failed for user {user_id}: {e}")
+        return None
@@ -0,0 +1,443 @@
+"""Risk rules (risk_rules.yaml) and the evaluator that scores a user against them.
+
+Feature scores come from an EvaluationContext or, when the rules compile, one aggregate
+query (risk_dsl); IncrementalRiskEngine reuses the same feature functions over its
+rolling aggregates.
+"""
+
+import contextvars
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import yaml
+from sqlalchemy.orm import Session
+
+from . import risk_profile
+from .config import settings
+from .db import SessionLocal
+from .risk_dsl import AggregateContext, compiled_plan
+from .risk_engine import EvaluationContext, SCALE, JOURNAL, CHAT, CHAT_EVENT
+
+RULES_PATH = Path(__file__).resolve().parents[1] / "risk_rules.yaml"
+
+class RiskEvaluator:
+    def __init__(self, rules_path: Path):
+        self.rules = self._load_rules(rules_path)
+        self.weights = self.rules.get('weights', {})
+        self.thresholds = self.rules.get('thresholds', {})
+        self.features = self.rules.get('features', {})
+        # Content hash of the loaded rules; part of every risk cache key
+        self.rules_version = hashlib.sha256(json.dumps(self.rules, sort_keys=True, default=str).encode()).hexdigest()[:12]
+    
+    def _load_rules(self, rules_path: Path) -> Dict[str, Any]:
+        """Load and parse risk rules from YAML file (try multiple locations)."""
+        candidates = [
+            rules_path,
+            Path("/app/risk_rules.yaml"),
+            Path(__file__).resolve().parent / "risk_rules.yaml",
+            Path.cwd() / "risk_rules.yaml",
+        ]
+        for p in candidates:
+            try:
+                if p.exists():
+                    data = yaml.safe_load(p.read_text(encoding="utf-8")) or {}
+                    if data:
+                        print(f"Loaded risk rules from {p}")
+                        return data
+            except Exception as e:
+                print(f"Error loading risk rules from {p}: {e}")
+        print(f"No risk rules found. Tried: {[str(c) for c in candidates]}")
+        return {}
+    
+    # Inputs of each feature: the event kinds it reads and the windows (days) it sums.
+    # IncrementalRiskEngine uses this as its dependency map.
+    FEATURE_INPUTS: Dict[str, tuple] = {
+        "mood_drop_7d": ({JOURNAL}, (7,)),
+        "safety_low": (set(), ()),
+        "negative_language": ({JOURNAL}, (7,)),
+        "positive_affect_7d": ({JOURNAL}, (7,)),
+        "missed_checkins": (set(), ()),
+        "game_telemetry_stress": (set(), ()),
+        "chat_negative_language": ({CHAT, CHAT_EVENT}, (7,)),
+        "chat_positive_affect": ({CHAT, CHAT_EVENT}, (7,)),
+        "suicidality": ({JOURNAL, CHAT}, (30,)),
+        "safety_planning_intent": ({CHAT}, (30,)),
+        "journal_neg_30d": ({JOURNAL}, (30,)),
+        "chat_neg_30d": ({CHAT}, (30,)),
+        "worsening_vs_baseline": ({JOURNAL, CHAT}, (7, 90)),
+        "suicidality_sticky": ({JOURNAL, CHAT}, (14,)),
+        "weapon_indicator": ({JOURNAL, CHAT}, (30,)),
+        "stalking_indicator": ({JOURNAL, CHAT}, (30,)),
+        "digital_surveillance_indicator": ({JOURNAL, CHAT}, (30,)),
+    }
+
+    def evaluate_user_risk(self, db: Session, user_id: str, as_of: Optional[datetime] = None) -> Dict[str, Any]:
+        """Evaluate risk for a specific user, now or as of a past point in time"""
+        if not self.rules:
+            return {"score": 0.0, "reasons": ["No risk rules loaded"], "level": "unknown"}
+        
+        # One aggregate query from the compiled rules when possible; row-by-row otherwise
+        with risk_profile.phase("load"):
+            ctx = AggregateContext.load(db, user_id, self.query_plan(db), as_of)
+            if ctx is None:
+                ctx = EvaluationContext(db, user_id, as_of)
+        return self.combine(self.score_features(ctx, self.features))
+
+    def evaluate_user_risk_concurrent(self, user_id: str, pool: ThreadPoolExecutor, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Score every feature as its own task on `pool`, each with its own session and query.
+
+        Each feature has a deadline (feature_timeouts_ms in the rules, else
+        RISK_FEATURE_TIMEOUT_MS) counted from submission; features that miss it or fail
+        are left out of the weighted score and listed under `degraded`.
+        """
+        if not self.rules:
+            return {"score": 0.0, "reasons": ["No risk rules loaded"], "level": "unknown"}
+        now = now or datetime.utcnow()
+        started = time.monotonic()
+        # Each task runs in a copy of this context so its phase lands in the caller's profile
+        futures = {
+            name: pool.submit(contextvars.copy_context().run, self._score_feature_isolated, user_id, name, now)
+            for name in self.features
+        }
+        results: Dict[str, tuple[float, Optional[str]]] = {}
+        degraded = []
+        for name, fut in futures.items():
+            remaining = self._feature_timeout(name) - (time.monotonic() - started)
+            try:
+                results[name] = fut.result(timeout=max(0.0, remaining))
+            except FuturesTimeout:
+                fut.cancel()  # no-op if already running; the result is just dropped
+                degraded.append(name)
+            except Exception as e:
+                print(f"Risk feature {name} failed for user {user_id}: {e}")
+                degraded.append(name)
+        result = self.combine(results)
+        if degraded:
+            result["degraded"] = degraded
+        return result
+
+    def _feature_timeout(self, name: str) -> float:
+        overrides = self.rules.get("feature_timeouts_ms") or {}
+        return float(overrides.get(name, settings.RISK_FEATURE_TIMEOUT_MS)) / 1000.0
+
+    def _score_feature_isolated(self, user_id: str, name: str, now: datetime) -> tuple[float, Optional[str]]:
+        db = SessionLocal()
+        try:
+            # Load and score both count towards the feature: it owns its query here
+            with risk_profile.phase(name):
+                plan = compiled_plan(self, db.get_bind().dialect.name, feature=name)
+                ctx = AggregateContext.load(db, user_id, plan, now)
+                if ctx is None:
+                    ctx = EvaluationContext(db, user_id, now, horizon_days=max(plan.windows, default=None))
+                return self._evaluate_feature(ctx, name, self.features[name])
+        finally:
+            db.close()
+
+    def query_plan(self, db: Session):
+        """The feature rules compiled to SQL aggregates (cached per rules version)."""
+        return compiled_plan(self, db.get_bind().dialect.name)
+
+    def score_features(self, ctx: Any, feature_names: Any) -> Dict[str, tuple[float, Optional[str]]]:
+        """Score the named features against anything exposing `stats(days)`."""
+        results = {}
+        for name in feature_names:
+            if name in self.features:
+                with risk_profile.phase(name):
+                    results[name] = self._evaluate_feature(ctx, name, self.features[name])
+        return results
+
+    def combine(self, results: Dict[str, tuple[float, Optional[str]]]) -> Dict[str, Any]:
+        """Weighted, normalized score and level from per-feature (score, reason) results."""
+        feature_scores = {}
+        reasons = []
+        
+        for feature_name in self.features:
+            score, reason = results.get(feature_name, (0.0, None))
+            feature_scores[feature_name] = score
+            if reason:
+                reasons.append(reason)
+        
+        # Calculate weighted score; allow protective (negative weight) features
+        # Normalize ONLY by the weights of features that actually produced a signal (score > 0),
+        # so a single strong indicator (e.g., suicidality) is not diluted by unrelated features.
+        risk_sum = 0.0
+        weight_sum = 0.0
+        for feature_name, score in feature_scores.items():
+            weight = float(self.weights.get(feature_name, 0.0))
+            if score and score > 0:
+                risk_sum += score * weight
+                weight_sum += abs(weight)
+
+        # Normalize by active weights and clamp 0..1
+        final_score = (risk_sum / weight_sum) if weight_sum > 0 else 0.0
+        final_score = max(0.0, min(1.0, final_score))
+        
+        # Determine risk level
+        risk_level = self._determine_risk_level(final_score)
+        
+        return {
+            "score": round(final_score, 3),
+            "level": risk_level,
+            "reasons": reasons,
+            "feature_scores": feature_scores,
+            "weights": self.weights,
+            "thresholds": self.thresholds
+        }
+    
+    def _evaluate_feature(self, ctx: Any, feature_name: str, feature_rule: str) -> tuple[float, Optional[str]]:
+        """Evaluate a single feature based on the rule"""
+        try:
+            if feature_name == "mood_drop_7d":
+                return self._evaluate_mood_drop(ctx)
+            elif feature_name == "safety_low":
+                return self._evaluate_safety_low(ctx)
+            elif feature_name == "negative_language":
+                return self._evaluate_negative_language(ctx)
+            elif feature_name == "positive_affect_7d":
+                return self._evaluate_positive_affect_7d(ctx)
+            elif feature_name == "missed_checkins":
+                return self._evaluate_missed_checkins(ctx)
+            elif feature_name == "game_telemetry_stress":
+                return self._evaluate_game_stress(ctx)
+            elif feature_name == "chat_negative_language":
+                return self._evaluate_chat_negative_language(ctx)
+            elif feature_name == "chat_positive_affect":
+                return self._evaluate_chat_positive_affect(ctx)
+            elif feature_name == "suicidality":
+                return self._evaluate_suicidality(ctx)
+            elif feature_name == "safety_planning_intent":
+                return self._evaluate_safety_planning_intent(ctx)
+            elif feature_name == "journal_neg_30d":
+                return self._evaluate_journal_neg_30d(ctx)
+            elif feature_name == "chat_neg_30d":
+                return self._evaluate_chat_neg_30d(ctx)
+            elif feature_name == "worsening_vs_baseline":
+                return self._evaluate_worsening_vs_baseline(ctx)
+            elif feature_name == "suicidality_sticky":
+                return self._evaluate_suicidality_sticky(ctx)
+            elif feature_name == "weapon_indicator":
+                return self._evaluate_weapon_indicator(ctx)
+            elif feature_name == "stalking_indicator":
+                return self._evaluate_simple_phrase_indicator(ctx, "stalking_rows", label="stalking indicators")
+            elif feature_name == "digital_surveillance_indicator":
+                return self._evaluate_simple_phrase_indicator(ctx, "surveillance_rows", label="digital surveillance indicators")
+            else:
+                return 0.0, f"Unknown feature: {feature_name}"
+        except Exception as e:
+            return 0.0, f"Error evaluating {feature_name}: {str(e)}"
+    
+    # Features read summed per-row counters (risk_engine.*_contrib) for their window.
+    # Fractional sums are fixed point: divide by SCALE.
+    def _evaluate_mood_drop(self, ctx: Any) -> tuple[float, Optional[str]]:
+        """Evaluate mood drop over 7 days"""
+        s = ctx.stats(7)
+        
+        if s["j_rows"] < 2:
+            return 0.0, None  # Not enough data
+        
+        # Per-journal (positive - negative) lexicon hits over word count, averaged
+        if s["j_mood_n"] == 0:
+            return 0.0, None
+        
+        avg_sentiment = s["j_mood_sum"] / SCALE / s["j_mood_n"]
+        
+        # If average sentiment is negative, consider it a mood drop
+        if avg_sentiment < -0.05:
+            return 0.8, f"Mood appears low based on recent journal entries"
+        elif avg_sentiment < 0:
+            return 0.4, f"Slightly negative mood in recent entries"
+        
+        return 0.0, None
+
+    def _evaluate_positive_affect_7d(self, ctx: Any) -> tuple[float, Optional[str]]:
+        """Positive affect feature from journals that can reduce risk via negative weight."""
+        s = ctx.stats(7)
+        if s["j_rows"] == 0:
+            return 0.0, None
+        ratio = s["j_pos_hits"] / max(1, s["j_chunks"])
+        if ratio >= 0.15:
+            return 0.8, "positive affect present in journals"
+        if ratio >= 0.05:
+            return 0.5, "some positive affect in journals"
+        return 0.0, None
+
+    def _evaluate_suicidality(self, ctx: Any) -> tuple[float, Optional[str]]:
+        """Hard-raise score if explicit self-harm phrases appear in journals or chat in last 30 days.
+        Returns a strong feature score and reason if detected.
+        """
+        # Journals and chat messages (user only) containing a self_harm phrase
+        total = ctx.stats(30)["self_harm_rows"]
+
+        if total == 0:
+            return 0.0, None
+
+        # Strong signal; map counts to near-1 quickly
+        score = min(1.0, 0.8 + 0.1 * (total - 1))
+        reason = "explicit self-harm language detected"
+        return score, reason
+
+    def _evaluate_weapon_indicator(self, ctx: Any) -> tuple[float, Optional[str]]:
+        """Detect weapon presence in journals or chat within 30 days (e.g., 'gun', 'knife', 'weapon')."""
+        hits = ctx.stats(30)["weapon_rows"]
+        if hits == 0:
+            return 0.0, None
+        score = min(1.0, 0.6 + 0.1*(hits-1))
+        return score, "weapon indicators mentioned"
+
+    def _evaluate_simple_phrase_indicator(self, ctx: Any, counter: str, label: str) -> tuple[float, Optional[str]]:
+        """Generic indicator for journals+chat with modest weight; returns moderate score when
+        rows matching the lexicon category behind `counter` are found."""
+        hits = ctx.stats(30)[counter]
+        if hits == 0:
+            return 0.0, None
+        score = min(1.0, 0.4 + 0.1*(hits-1))
+        return score, label
+    
+    def _evaluate_safety_low(self, ctx: Any) -> tuple[float, Optional[str]]:
+        """Evaluate if safety level is low"""
+        # Until we wire real safety check-ins, do not assume risk.
+        # New users should not start with elevated safety risk.
+        return 0.0, None
+    
+    def _evaluate_negative_language(self, ctx: Any) -> tuple[float, Optional[str]]:
+        """Evaluate negative language in recent journals"""
+        s = ctx.stats(7)
+        
+        if s["j_rows"] == 0 or s["j_valid"] == 0:
+            return 0.0, None
+        
+        # Per journal: 0.1 per negative word + 0.5 per concerning phrase, averaged
+        avg_negative_score = s["j_neg_lang_sum"] / SCALE / s["j_valid"]
+        
+        if avg_negative_score > 0.3:
+            return 0.9, f"Concerning language detected in recent journals"
+        elif avg_negative_score > 0.1:
+            return 0.6, f"Some negative language in recent journals"
+        
+        return 0.0, None
+
+    def _evaluate_chat_negative_language(self, ctx: Any) -> tuple[float, Optional[str]]:
+        """Evaluate negative indicators from recent chat messages (last 7 days).
+        Prefer chat_events (denormalized) and fall back to chat_messages if none.
+        """
+        s = ctx.stats(7)
+        prefix = "e" if s["e_rows"] else "c"
+        rows = s[f"{prefix}_rows"]
+        if not rows:
+            return 0.0, None
+
+        neg_n = s[f"{prefix}_sent_n"]
+        flag_hits = s[f"{prefix}_flag_rows"]
+        if neg_n == 0 and flag_hits == 0:
+            return 0.0, None
+        avg_neg = s[f"{prefix}_neg_sum"] / SCALE / max(1, neg_n)
+        flag_ratio = flag_hits / max(1, rows)
+        score = min(1.0, (flag_ratio * 0.9) + (avg_neg * 0.6))
+        reasons = []
+        if flag_hits:
+            reasons.append(f"{flag_hits} high-risk indicators in chat")
+        if avg_neg > 0.15:
+            reasons.append("negative chat sentiment")
+        return score, ", ".join(reasons) if reasons else None
+
+    def _evaluate_chat_positive_affect(self, ctx: Any) -> tuple[float, Optional[str]]:
+        """Positive affect in chat messages; reduces risk via negative weight.
+        Prefer chat_events and fall back to chat_messages. Be more sensitive so
+        small but consistent positives show up.
+        """
+        s = ctx.stats(7)
+        prefix = "e" if s["e_rows"] else "c"
+        pos_n = s[f"{prefix}_pos_n"]
+
+        if not pos_n:
+            return 0.0, None
+
+        avg_pos = s[f"{prefix}_pos_sum"] / SCALE / pos_n
+        # Map average positive sentiment (0..1) into a score; allow small signals
+        score = min(1.0, max(0.0, avg_pos))
+        if score >= 0.1:
+            return score, "positive affect in chat"
+        return 0.0, None
+
+    def _evaluate_safety_planning_intent(self, ctx: Any) -> tuple[float, Optional[str]]:
+        """Protective feature: frequency of 'safety_planning' intent in last 30 days of user chat."""
+        s = ctx.stats(30)
+        total = s["c_rows"]
+        if not total:
+            return 0.0, None
+        ratio = s["c_safety"] / max(1, total)
+        if ratio >= 0.5:
+            return 0.9, "engaging in safety planning"
+        if ratio >= 0.25:
+            return 0.6, "safety planning signals present"
+        if ratio >= 0.1:
+            return 0.3, "some safety planning intent"
+        return 0.0, None
+    
+    def _evaluate_missed_checkins(self, ctx: Any) -> tuple[float, Optional[str]]:
+        """Evaluate missed check-ins"""
+        # Placeholder disabled until real check-in data is implemented
+        return 0.0, None
+    
+    def _evaluate_game_stress(self, ctx: Any) -> tuple[float, Optional[str]]:
+        """Evaluate stress indicators from game telemetry"""
+        # For MVP, we'll use a placeholder
+        # In production, this would analyze breath garden telemetry
+        return 0.0, None  # No game telemetry data available yet
+
+    # --- Long-horizon and trend features ---
+    def _evaluate_journal_neg_30d(self, ctx: Any) -> tuple[float, Optional[str]]:
+        s = ctx.stats(30)
+        if not s["j_rows"]:
+            return 0.0, None
+        ratio = s["j_neg30_hits"]/max(1,s["j_chunks"])
+        if ratio>=0.1:
+            return 0.7, "sustained negative language in journals (30d)"
+        if ratio>=0.05:
+            return 0.4, "some negative language in journals (30d)"
+        return 0.0, None
+
+    def _evaluate_chat_neg_30d(self, ctx: Any) -> tuple[float, Optional[str]]:
+        s = ctx.stats(30)
+        if not s["c_rows"] or not s["c_sent_n"]:
+            return 0.0, None
+        avg = s["c_neg_sum"]/SCALE/s["c_sent_n"]
+        if avg>=0.3:
+            return 0.6, "sustained negative chat sentiment (30d)"
+        if avg>=0.15:
+            return 0.3, "negative chat sentiment (30d)"
+        return 0.0, None
+
+    def _evaluate_worsening_vs_baseline(self, ctx: Any) -> tuple[float, Optional[str]]:
+        """Compare current 7d negative signals vs a 90d baseline (journals+chat).
+        Each journal counts 1.0 if it has a baseline_negative marker, each chat message its negative sentiment."""
+        def neg_avg(days: int) -> float:
+            s = ctx.stats(days)
+            return (s["j_baseline_neg"] * SCALE + s["c_neg_sum"]) / SCALE / max(1, s["j_valid"] + s["c_sent_n"])
+
+        delta = neg_avg(7) - neg_avg(90)
+        if delta >= 0.2:
+            return 0.8, "worsening vs 90d baseline"
+        if delta >= 0.1:
+            return 0.5, "slightly worse vs 90d baseline"
+        return 0.0, None
+
+    def _evaluate_suicidality_sticky(self, ctx: Any) -> tuple[float, Optional[str]]:
+        """Keep elevated risk for 14 days after any suicidality detection."""
+        if ctx.stats(14)["self_harm_sticky_rows"]:
+            return 0.9, "recent suicidality (sticky)"
+        return 0.0, None
+    
+    def _determine_risk_level(self, score: float) -> str:
+        """Determine risk level based on score and thresholds"""
+        if score >= self.thresholds.get('high', 0.65):
+            return 'high'
+        elif score >= self.thresholds.get('warn', 0.45):
+            return 'warn'
+        else:
+            return 'low'
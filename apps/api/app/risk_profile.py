@@ -0,0 +1,144 @@
+"""Per-phase cost accounting for risk evaluation.
+
+An evaluation is split into phases: "lookup" (watermark, cache, snapshot),
+"load" (row or aggregate fetch), one phase per feature scored, and "persist". Each
+phase records wall time, rows fetched, decrypt calls and SQL statements issued. Code
+inside a phase reports through `count()`; SQL statements are counted by an engine
+event listener. The current phase lives in a ContextVar, so worker threads that run
+under `contextvars.copy_context()` report into the phase that submitted them.
+
+Every phase also feeds the process-wide `metrics` histograms
+(GET /insights/risk/metrics). `evaluation()` additionally collects the phases of one
+request for `?profile=1`.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+COUNTERS = ("rows", "decrypts", "sql")
+
+# Upper bounds (ms) of the wall-time histogram buckets; the last bucket is unbounded
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_phase: ContextVar[Optional[Dict[str, float]]] = ContextVar("risk_phase", default=None)
+_profile: ContextVar[Optional["EvaluationProfile"]] = ContextVar("risk_profile", default=None)
+
+
+def count(counter: str, n: int = 1) -> None:
+    """Add to a counter of the current phase (no-op outside a phase)."""
+    current = _phase.get()
+    if current is not None:
+        current[counter] += n
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_sql(conn, cursor, statement, parameters, context, executemany):
+    count("sql")
+
+
+class RiskMetrics:
+    """Process-wide histograms of phase wall time plus counter totals."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._phases: Dict[str, Dict[str, Any]] = {}
+
+    def observe(self, name: str, sample: Dict[str, float]) -> None:
+        wall = sample["wall_ms"]
+        with self._lock:
+            p = self._phases.get(name)
+            if p is None:
+                p = self._phases[name] = {
+                    "count": 0, "wall_ms_sum": 0.0, "wall_ms_max": 0.0,
+                    "buckets": [0] * (len(BUCKETS_MS) + 1), **{c: 0 for c in COUNTERS},
+                }
+            p["count"] += 1
+            p["wall_ms_sum"] += wall
+            p["wall_ms_max"] = max(p["wall_ms_max"], wall)
+            i = 0
+            while i < len(BUCKETS_MS) and wall > BUCKETS_MS[i]:
+                i += 1
+            p["buckets"][i] += 1
+            for c in COUNTERS:
+                p[c] += int(sample[c])
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            phases = {}
+            for name, p in sorted(self._phases.items()):
+                n = p["count"]
+                phases[name] = {
+                    "count": n,
+                    "wall_ms_avg": round(p["wall_ms_sum"] / n, 3),
+                    "wall_ms_max": round(p["wall_ms_max"], 3),
+                    "wall_ms_histogram": dict(zip([f"le_{b}" for b in BUCKETS_MS] + ["le_inf"], p["buckets"])),
+                    **{f"{c}_total": p[c] for c in COUNTERS},
+                    **{f"{c}_avg": round(p[c] / n, 3) for c in COUNTERS},
+                }
+        return {"buckets_ms": list(BUCKETS_MS), "phases": phases}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._phases.clear()
+
+
+metrics = RiskMetrics()
+
+
+class EvaluationProfile:
+    """Phases recorded during one evaluation, for the `?profile=1` response section."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.phases: Dict[str, Dict[str, float]] = {}
+
+    def add(self, name: str, sample: Dict[str, float]) -> None:
+        with self._lock:
+            p = self.phases.setdefault(name, {"wall_ms": 0.0, **{c: 0 for c in COUNTERS}})
+            for k in p:
+                p[k] += sample[k]
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+                "phases": {
+                    name: {k: (round(v, 3) if k == "wall_ms" else int(v)) for k, v in p.items()}
+                    for name, p in self.phases.items()
+                },
+            }
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Account everything done inside the block to phase `name` (innermost phase wins)."""
+    sample: Dict[str, float] = {c: 0 for c in COUNTERS}
+    token = _phase.set(sample)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        sample["wall_ms"] = (time.perf_counter() - started) * 1000
+        _phase.reset(token)
+        metrics.observe(name, sample)
+        profile = _profile.get()
+        if profile is not None:
+            profile.add(name, sample)
+
+
+@contextmanager
+def evaluation() -> Iterator[EvaluationProfile]:
+    """Collect the phases of the enclosed evaluation into an EvaluationProfile."""
+    profile = EvaluationProfile()
+    token = _profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _profile.reset(token)
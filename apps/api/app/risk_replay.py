@@ -0,0 +1,214 @@
+"""Historical risk backtesting: daily point-in-time scores under two rule sets.
+
+Every user of a chunk is scored as of the end of each day in a date range, once with
+the baseline rules and once with a candidate rules file. Rows are loaded once per
+chunk (the range plus the 90-day horizon) into a risk_batch.RowMatrix, and each day
+is a window over it, so a year of replay costs one load per chunk. Chunks run in
+worker processes; their summaries are plain dicts of sums that `merge` combines.
+
+Summary:
+- level_changes: "baseline->candidate" level pairs over all user-days
+- transitions: day-over-day level changes of a user, per rule set
+- daily: per-day level counts and mean score, per rule set
+- diff: candidate minus baseline score (mean, mean abs, max abs, changed, histogram)
+- top_movers: users with the largest absolute score difference on any day
+"""
+
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from .db import SessionLocal, engine
+from .risk_batch import CohortRiskScorer
+from .risk_engine import EvaluationContext
+from .risk_evaluator import RiskEvaluator
+
+LEVELS = ("low", "warn", "high")
+# Upper bounds of the score difference histogram buckets; the last bucket is unbounded
+DIFF_BUCKETS = (-0.5, -0.25, -0.1, -0.05, -0.01, 0.01, 0.05, 0.1, 0.25, 0.5)
+TOP_MOVERS = 20
+
+
+def load_evaluator(path: Path) -> RiskEvaluator:
+    """RiskEvaluator for exactly `path` (RiskEvaluator itself falls back to other locations)."""
+    if not path.is_file():
+        raise FileNotFoundError(f"rules file not found: {path}")
+    evaluator = RiskEvaluator(path)
+    if not evaluator.rules:
+        raise ValueError(f"no risk rules in {path}")
+    return evaluator
+
+
+def replay_days(start: date, end: date, step_days: int = 1) -> Iterator[date]:
+    day = start
+    while day <= end:
+        yield day
+        day += timedelta(days=step_days)
+
+
+def _as_of(day: date) -> datetime:
+    # End of the day: everything written that day counts
+    return datetime.combine(day, time.max)
+
+
+def empty_summary() -> Dict[str, Any]:
+    return {
+        "users": 0,
+        "user_days": 0,
+        "level_changes": {},
+        "transitions": {"baseline": {}, "candidate": {}},
+        "daily": {},
+        "diff": {"sum": 0.0, "abs_sum": 0.0, "max_abs": 0.0, "changed": 0, "histogram": [0] * (len(DIFF_BUCKETS) + 1)},
+        "top_movers": [],
+    }
+
+
+def _add_counts(into: Dict[str, int], keys: np.ndarray) -> None:
+    values, counts = np.unique(keys, return_counts=True)
+    for k, n in zip(values, counts):
+        into[str(k)] = into.get(str(k), 0) + int(n)
+
+
+def replay_chunk(
+    db: Any, baseline: RiskEvaluator, candidate: RiskEvaluator, user_ids: List[str],
+    start: date, end: date, step_days: int = 1,
+) -> Dict[str, Any]:
+    """Replay one chunk of users over [start, end]; returns a summary (see module doc)."""
+    scorers = {"baseline": CohortRiskScorer(baseline), "candidate": CohortRiskScorer(candidate)}
+    n = len(user_ids)
+    out = empty_summary()
+    out["users"] = n
+    rows = scorers["baseline"].load(
+        db, user_ids, _as_of(start) - timedelta(days=EvaluationContext.HORIZON_DAYS), _as_of(end)
+    )
+    previous: Dict[str, Optional[np.ndarray]] = {"baseline": None, "candidate": None}
+    movers: Dict[int, tuple] = {}  # user index -> (max abs diff, day, baseline, candidate)
+    diff = out["diff"]
+    for day in replay_days(start, end, step_days):
+        window = rows.windows(_as_of(day))
+        scores = {}
+        levels = {}
+        daily = out["daily"].setdefault(day.isoformat(), {})
+        for name, scorer in scorers.items():
+            final, _, _ = scorer.score_window(window, n)
+            scores[name] = np.round(final, 3)
+            levels[name] = scorer.levels(final)
+            counts = daily.setdefault(name, {"score_sum": 0.0, **{lvl: 0 for lvl in LEVELS}})
+            counts["score_sum"] += float(scores[name].sum())
+            _add_counts(counts, levels[name])
+            prev = previous[name]
+            if prev is not None:
+                moved = prev != levels[name]
+                _add_counts(out["transitions"][name], prev[moved] + "->" + levels[name][moved])
+            previous[name] = levels[name]
+        _add_counts(out["level_changes"], levels["baseline"] + "->" + levels["candidate"])
+
+        d = scores["candidate"] - scores["baseline"]
+        diff["sum"] += float(d.sum())
+        diff["abs_sum"] += float(np.abs(d).sum())
+        diff["max_abs"] = max(diff["max_abs"], float(np.abs(d).max(initial=0.0)))
+        diff["changed"] += int((np.abs(d) >= 0.001).sum())
+        for i, c in enumerate(np.bincount(np.searchsorted(DIFF_BUCKETS, d, side="left"), minlength=len(DIFF_BUCKETS) + 1)):
+            diff["histogram"][i] += int(c)
+        for i in np.flatnonzero(np.abs(d) >= 0.001):
+            if abs(d[i]) > movers.get(i, (0.0,))[0]:
+                movers[i] = (abs(float(d[i])), day.isoformat(), float(scores["baseline"][i]), float(scores["candidate"][i]))
+        out["user_days"] += n
+
+    out["top_movers"] = [
+        {"user_id": user_ids[i], "max_abs_diff": round(m[0], 3), "day": m[1], "baseline": m[2], "candidate": m[3]}
+        for i, m in heapq.nlargest(TOP_MOVERS, movers.items(), key=lambda kv: kv[1][0])
+    ]
+    return out
+
+
+def merge(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    """Combine two chunk summaries (in place into `a`)."""
+    a["users"] += b["users"]
+    a["user_days"] += b["user_days"]
+    for k, v in b["level_changes"].items():
+        a["level_changes"][k] = a["level_changes"].get(k, 0) + v
+    for name, counts in b["transitions"].items():
+        for k, v in counts.items():
+            a["transitions"][name][k] = a["transitions"][name].get(k, 0) + v
+    for day, per_rules in b["daily"].items():
+        for name, counts in per_rules.items():
+            into = a["daily"].setdefault(day, {}).setdefault(name, {"score_sum": 0.0, **{lvl: 0 for lvl in LEVELS}})
+            for k, v in counts.items():
+                into[k] += v
+    da, db_ = a["diff"], b["diff"]
+    da["sum"] += db_["sum"]
+    da["abs_sum"] += db_["abs_sum"]
+    da["max_abs"] = max(da["max_abs"], db_["max_abs"])
+    da["changed"] += db_["changed"]
+    da["histogram"] = [x + y for x, y in zip(da["histogram"], db_["histogram"])]
+    a["top_movers"] = heapq.nlargest(TOP_MOVERS, a["top_movers"] + b["top_movers"], key=lambda m: m["max_abs_diff"])
+    return a
+
+
+def finalize(summary: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn the sums into means for reporting."""
+    out = dict(summary)
+    n = max(1, summary["user_days"])
+    diff = summary["diff"]
+    out["diff"] = {
+        "mean": round(diff["sum"] / n, 4),
+        "mean_abs": round(diff["abs_sum"] / n, 4),
+        "max_abs": round(diff["max_abs"], 3),
+        "changed_user_days": diff["changed"],
+        "histogram": dict(zip([f"le_{b}" for b in DIFF_BUCKETS] + ["le_inf"], diff["histogram"])),
+    }
+    out["daily"] = {
+        day: {
+            name: {**{lvl: c[lvl] for lvl in LEVELS}, "mean_score": round(c["score_sum"] / max(1, summary["users"]), 4)}
+            for name, c in per_rules.items()
+        }
+        for day, per_rules in sorted(summary["daily"].items())
+    }
+    return out
+
+
+# --- process pool ---
+_worker_rules: Dict[str, RiskEvaluator] = {}
+
+
+def _init_worker(baseline_path: str, candidate_path: str) -> None:
+    # Connections inherited through fork must not be shared with the parent
+    engine.dispose(close=False)
+    _worker_rules["baseline"] = load_evaluator(Path(baseline_path))
+    _worker_rules["candidate"] = load_evaluator(Path(candidate_path))
+
+
+def _replay_worker(user_ids: List[str], start: date, end: date, step_days: int) -> Dict[str, Any]:
+    db = SessionLocal()
+    try:
+        return replay_chunk(db, _worker_rules["baseline"], _worker_rules["candidate"], user_ids, start, end, step_days)
+    finally:
+        db.close()
+
+
+def run_replay(
+    baseline_path: Path, candidate_path: Path, user_ids: List[str], start: date, end: date,
+    step_days: int = 1, workers: int = 1, chunk_size: int = 500,
+) -> Dict[str, Any]:
+    """Replay all `user_ids` in chunks across `workers` processes; returns the finalized summary."""
+    chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+    summary = empty_summary()
+    if workers <= 1:
+        _init_worker(str(baseline_path), str(candidate_path))
+        for i, chunk in enumerate(chunks, 1):
+            merge(summary, _replay_worker(chunk, start, end, step_days))
+            print(f"Replayed {i}/{len(chunks)} chunks")
+        return finalize(summary)
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(str(baseline_path), str(candidate_path))
+    ) as pool:
+        futures = [pool.submit(_replay_worker, chunk, start, end, step_days) for chunk in chunks]
+        for i, fut in enumerate(futures, 1):
+            merge(summary, fut.result())
+            print(f"Replayed {i}/{len(chunks)} chunks")
+    return finalize(summary)
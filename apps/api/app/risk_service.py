@@ -0,0 +1,83 @@
+"""The process's risk evaluator, incremental engine and result cache, and the reads and
+invalidations built on them.
+
+Routes and background jobs (deep analysis, Data Cloud streaming) use these helpers
+rather than each other: writers call `invalidate_risk` after committing, deleters also
+`bump_risk_revision` in the deleting transaction, in-place updaters `recompute_risk`,
+and readers `evaluate_risk`.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+from sqlalchemy.orm import Session
+
+from . import risk_profile
+from .config import settings
+from .risk_engine import (
+    IncrementalRiskEngine, RiskResultCache, risk_watermark, bump_risk_revision,
+    latest_snapshot, snapshot_is_fresh, snapshot_result, materialize_snapshot,
+)
+from .risk_evaluator import RULES_PATH, RiskEvaluator
+
+# Initialize risk evaluator
+risk_evaluator = RiskEvaluator(RULES_PATH)
+# Rolling per-user aggregates; write paths push new rows into it
+incremental_engine = IncrementalRiskEngine(risk_evaluator)
+risk_cache = RiskResultCache(settings.RISK_CACHE_MAX_USERS, settings.RISK_CACHE_TTL_SECONDS)
+# Bounded pool for concurrent feature scoring (RISK_FEATURE_WORKERS > 0)
+feature_pool = (
+    ThreadPoolExecutor(max_workers=settings.RISK_FEATURE_WORKERS, thread_name_prefix="risk-feature")
+    if settings.RISK_FEATURE_WORKERS > 0 else None
+)
+
+def evaluate_risk(db: Session, user_id: str) -> Dict[str, Any]:
+    """Risk read shared by /insights/risk and Data Cloud streaming.
+
+    Order: in-process cache, then the newest RiskSnapshot if it is still fresh, then a
+    full evaluation, which is materialized as a snapshot for later reads and exports.
+    """
+    with risk_profile.phase("lookup"):
+        watermark = risk_watermark(db, user_id)
+        key = (user_id, risk_evaluator.rules_version, watermark)
+        result, _ = risk_cache.get(key)
+        if result is not None:
+            return result
+        snap = latest_snapshot(db, user_id)
+    if not snapshot_is_fresh(snap, risk_evaluator.rules_version, watermark, settings.RISK_SNAPSHOT_MAX_AGE_SECONDS):
+        return _evaluate_and_persist(db, user_id, key)
+    result = snapshot_result(snap, risk_evaluator.weights, risk_evaluator.thresholds)
+    risk_cache.put(key, result)
+    return result
+
+def _evaluate_and_persist(db: Session, user_id: str, key: tuple) -> Dict[str, Any]:
+    if feature_pool is not None:
+        result = risk_evaluator.evaluate_user_risk_concurrent(user_id, feature_pool)
+        if result.get("degraded"):
+            return result  # partial result: neither cached nor persisted
+    else:
+        # The engine checks its state against the same watermark and catches up on rows
+        # written elsewhere, however this read got here (eviction, invalidation, stale entry)
+        result = incremental_engine.evaluate(db, user_id, key[2])
+    with risk_profile.phase("persist"):
+        materialize_snapshot(db, user_id, result, risk_evaluator.rules_version, key[2])
+    risk_cache.put(key, result)
+    return result
+
+def invalidate_risk(user_id: str) -> None:
+    """Called by write paths after committing a journal, chat message or delete."""
+    risk_cache.invalidate(user_id)
+
+def recompute_risk(db: Session, user_id: str) -> Dict[str, Any]:
+    """Re-evaluate after rows were updated in place (e.g. by deep analysis).
+
+    Such updates add no ids, so the revision is bumped first: other processes then miss
+    their cached result and reload their engine state, and the new result and snapshot
+    here replace the old ones.
+    """
+    bump_risk_revision(db, user_id)
+    db.commit()
+    incremental_engine.forget(user_id)
+    risk_cache.invalidate(user_id)
+    key = (user_id, risk_evaluator.rules_version, risk_watermark(db, user_id))
+    return _evaluate_and_persist(db, user_id, key)
@@ -0,0 +1,142 @@
+"""Chart-sized risk score series from risk_snapshots (GET /insights/risk/trend).
+
+Snapshots are bucketed in SQL over the (user_id, created_at) index: one row per
+bucket with count, min, max and the last score/level (window functions, so the DB
+returns at most `points` rows however long the history is). Buckets are fixed-width
+epoch intervals, aligned so weeks start on Monday.
+
+- bucket="hour" | "day" | "week": the last `points` buckets of that width.
+- bucket="auto": the smallest of those covering the user's history in `points`
+  buckets, else a whole number of weeks.
+- bucket="lttb": the history in `points * LTTB_OVERSAMPLE` fine buckets, reduced to
+  `points` by Largest-Triangle-Three-Buckets on the last score of each.
+
+Snapshots are written only when a result changes, so an empty bucket means the
+score held; those buckets are omitted rather than filled.
+"""
+
+import math
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy import text as sql_text
+from sqlalchemy.orm import Session
+
+from .risk_engine import naive_utc
+
+BUCKETS = {"hour": 3600, "day": 86400, "week": 7 * 86400}
+LTTB_OVERSAMPLE = 10
+# 1970-01-05 was a Monday; offsetting by it aligns week buckets (and hours and days)
+_EPOCH_OFFSET = 4 * 86400
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _bucket_expr(dialect: str) -> str:
+    if dialect == "postgresql":
+        return "CAST(FLOOR((EXTRACT(EPOCH FROM created_at) - :offset) / :width) AS BIGINT)"
+    return "(CAST(strftime('%s', created_at) AS INTEGER) - :offset) / :width"
+
+
+def _buckets(db: Session, user_id: str, width: int, start: datetime, end: datetime, limit: int) -> List[Dict[str, Any]]:
+    """The newest `limit` non-empty buckets of `width` seconds in [start, end], oldest first."""
+    rows = db.execute(sql_text(
+        f"""
+        SELECT bucket, n, lo, hi, risk_score AS last, risk_level AS level FROM (
+            SELECT bucket, risk_score, risk_level,
+                   COUNT(*) OVER w AS n, MIN(risk_score) OVER w AS lo, MAX(risk_score) OVER w AS hi,
+                   ROW_NUMBER() OVER (PARTITION BY bucket ORDER BY created_at DESC, id DESC) AS rn
+            FROM (
+                SELECT id, created_at, risk_score, risk_level, {_bucket_expr(db.get_bind().dialect.name)} AS bucket
+                FROM risk_snapshots
+                WHERE user_id = :uid AND created_at >= :start AND created_at <= :end
+            ) s
+            WINDOW w AS (PARTITION BY bucket)
+        ) t
+        WHERE rn = 1
+        ORDER BY bucket DESC
+        LIMIT :limit
+        """
+    ), {"uid": user_id, "start": start, "end": end, "width": width, "offset": _EPOCH_OFFSET, "limit": limit}).fetchall()
+    return [
+        {
+            "t": (_EPOCH + timedelta(seconds=int(r.bucket) * width + _EPOCH_OFFSET)).isoformat(),
+            "n": int(r.n),
+            "min": round(float(r.lo), 3),
+            "max": round(float(r.hi), 3),
+            "last": round(float(r.last), 3),
+            "level": r.level,
+        }
+        for r in reversed(rows)
+    ]
+
+
+def lttb(ys: Sequence[float], threshold: int) -> List[int]:
+    """Indices of the points Largest-Triangle-Three-Buckets keeps (x is the index)."""
+    n = len(ys)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    every = (n - 2) / (threshold - 2)
+    keep = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        nxt_lo = int((i + 1) * every) + 1
+        nxt_hi = min(int((i + 2) * every) + 1, n)
+        avg_x = (nxt_lo + nxt_hi - 1) / 2
+        avg_y = sum(ys[nxt_lo:nxt_hi]) / (nxt_hi - nxt_lo)
+        best, best_area = -1, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((a - avg_x) * (ys[j] - ys[a]) - (a - j) * (avg_y - ys[a]))
+            if area > best_area:
+                best, best_area = j, area
+        keep.append(best)
+        a = best
+    keep.append(n - 1)
+    return keep
+
+
+def _first_snapshot_at(db: Session, user_id: str) -> Optional[datetime]:
+    ts = db.execute(
+        sql_text("SELECT MIN(created_at) FROM risk_snapshots WHERE user_id = :uid"), {"uid": user_id}
+    ).scalar()
+    return naive_utc(ts)
+
+
+def risk_trend(
+    db: Session, user_id: str, bucket: str = "auto", points: int = 200,
+    start: Optional[datetime] = None, end: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """At most `points` buckets of the user's risk score history (see module doc)."""
+    if bucket not in BUCKETS and bucket not in ("auto", "lttb"):
+        raise ValueError(f"unknown bucket {bucket!r}")
+    end = end or datetime.utcnow()
+    if start is None:
+        if bucket in BUCKETS:
+            start = end - timedelta(seconds=BUCKETS[bucket] * points)
+        else:
+            start = _first_snapshot_at(db, user_id) or end
+    span = max(1.0, (end - start).total_seconds())
+
+    if bucket == "lttb":
+        width = max(1, math.ceil(span / (points * LTTB_OVERSAMPLE)))
+        fine = _buckets(db, user_id, width, start, end, points * LTTB_OVERSAMPLE)
+        series = [fine[i] for i in lttb([p["last"] for p in fine], points)]
+    else:
+        if bucket == "auto":
+            fits = [name for name, w in BUCKETS.items() if span / w <= points]
+            if fits:
+                bucket = fits[0]
+                width = BUCKETS[bucket]
+            else:
+                weeks = math.ceil(span / (points * BUCKETS["week"]))
+                bucket, width = f"{weeks}w", weeks * BUCKETS["week"]
+        else:
+            width = BUCKETS[bucket]
+        series = _buckets(db, user_id, width, start, end, points)
+    return {
+        "bucket": bucket,
+        "bucket_seconds": width,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "points": series,
+    }
@@ -0,0 +1,192 @@
+"""user_daily_stats: per-user, per-UTC-day sums of the risk counters plus export metrics.
+
+Columns reuse the counter names of risk_engine.*_contrib, so any N-day window is a
+sum over at most N rows and reads like EvaluationContext.stats (at day granularity).
+Write paths call `record_*` after committing a row; `rebuild_user` recomputes a
+user's days from the raw tables (after deletes, and in the backfill script).
+"""
+
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, text as sql_text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, defer
+
+from . import models
+from .risk_engine import CHAT, JOURNAL, SCALE, Stats, TextRow, event_contrib, naive_utc
+
+COLUMNS = tuple(
+    c.name for c in models.UserDailyStats.__table__.columns if c.name not in ("user_id", "day")
+)
+_COLUMN_SET = frozenset(COLUMNS)
+
+_INTENT_COLUMNS = {
+    "seek_legal_info": "c_intent_legal",
+    "seek_emotional_support": "c_intent_support",
+    "report_incident": "c_intent_incident",
+}
+_EVENT_FLAGS = ("threats_to_kill", "strangulation", "weapon_involved", "children_present", "stalking", "digital_surveillance")
+
+
+def _day(ts: Any) -> date:
+    return naive_utc(ts).date() if ts is not None else datetime.utcnow().date()
+
+
+def journal_delta(row: models.Journal) -> Stats:
+    r = TextRow(JOURNAL, row)
+    out = Stats(r.contrib)
+    out["j_words"] = r.word_count
+    return out
+
+
+def chat_delta(row: models.ChatMessage) -> Stats:
+    r = TextRow(CHAT, row)
+    out = Stats(r.contrib)
+    out["c_words"] = r.word_count
+    intent_col = _INTENT_COLUMNS.get(row.intent or "")
+    if intent_col:
+        out[intent_col] = 1
+    return out
+
+
+def event_delta(evt: Any) -> Stats:
+    """Counters for a chat_events row or insert payload dict."""
+    get = evt.get if isinstance(evt, dict) else (lambda k: getattr(evt, k, None))
+    out = Stats(event_contrib(evt))
+    if get("risk_points") is not None:
+        out["e_risk_points_n"] = 1
+        out["e_risk_points_sum"] = int(get("risk_points"))
+    for flag in _EVENT_FLAGS:
+        if get(flag):
+            out[f"e_{flag}"] = 1
+    return out
+
+
+def apply_delta(db: Session, user_id: str, day: date, delta: Dict[str, int]) -> None:
+    """Add `delta` to the user's row for `day` (created on first write) and commit."""
+    cols = [k for k, v in delta.items() if v and k in _COLUMN_SET]
+    if not cols:
+        return
+    params = {"uid": user_id, "day": day, **{k: int(delta[k]) for k in cols}}
+    update = sql_text(
+        f"UPDATE user_daily_stats SET {', '.join(f'{k} = {k} + :{k}' for k in cols)} WHERE user_id = :uid AND day = :day"
+    )
+    if db.execute(update, params).rowcount == 0:
+        try:
+            db.execute(sql_text(
+                f"INSERT INTO user_daily_stats (user_id, day, {', '.join(cols)}) VALUES (:uid, :day, {', '.join(':' + k for k in cols)})"
+            ), params)
+        except IntegrityError:
+            # Another writer created the row first
+            db.rollback()
+            db.execute(update, params)
+    db.commit()
+
+
+def _record(db: Session, user_id: str, ts: Any, delta: Dict[str, int]) -> None:
+    # Best effort, like the analytics events: a miss is repaired by the backfill
+    try:
+        apply_delta(db, user_id, _day(ts), delta)
+    except Exception as e:
+        db.rollback()
+        print(f"user_daily_stats update failed for user {user_id}: {e}")
+
+
+def record_journal(db: Session, row: models.Journal) -> None:
+    _record(db, row.user_id, row.created_at, journal_delta(row))
+
+
+def record_chat_message(db: Session, row: models.ChatMessage) -> None:
+    if row.role == "user":
+        _record(db, row.user_id, row.created_at, chat_delta(row))
+
+
+def record_event(db: Session, user_id: str, evt: Dict[str, Any]) -> None:
+    _record(db, user_id, evt.get("created_at"), event_delta(evt))
+
+
+def record_change(db: Session, user_id: str, ts: Any, before: Stats, after: Stats) -> None:
+    """A row was updated in place (e.g. re-analyzed): apply the difference of its deltas."""
+    delta = Stats(after)
+    delta.sub(before)
+    _record(db, user_id, ts, delta)
+
+
+def rebuild_user(db: Session, user_id: str) -> int:
+    """Recompute all of a user's days from journals, chat_messages and chat_events."""
+    days: Dict[date, Stats] = defaultdict(Stats)
+    for r in db.query(models.Journal).options(
+        defer(models.Journal.ciphertext), defer(models.Journal.iv),
+        defer(models.Journal.ciphertext_b64), defer(models.Journal.iv_b64)
+    ).filter(models.Journal.user_id == user_id):
+        days[_day(r.created_at)].add(journal_delta(r))
+    for r in db.query(models.ChatMessage).options(
+        defer(models.ChatMessage.ciphertext), defer(models.ChatMessage.iv),
+        defer(models.ChatMessage.ciphertext_b64), defer(models.ChatMessage.iv_b64)
+    ).filter(models.ChatMessage.user_id == user_id, models.ChatMessage.role == "user"):
+        days[_day(r.created_at)].add(chat_delta(r))
+    try:
+        events = db.execute(sql_text(
+            f"""
+            SELECT event_id, created_at, sentiment_score, risk_points, {', '.join(_EVENT_FLAGS)}
+            FROM chat_events WHERE user_id = :uid
+            """
+        ), {"uid": user_id}).fetchall()
+    except Exception:
+        db.rollback()  # chat_events not created yet
+        events = []
+    for r in events:
+        days[_day(r.created_at)].add(event_delta(r))
+
+    db.execute(sql_text("DELETE FROM user_daily_stats WHERE user_id = :uid"), {"uid": user_id})
+    if days:
+        db.execute(models.UserDailyStats.__table__.insert(), [
+            {"user_id": user_id, "day": d, **{k: int(s[k]) for k in COLUMNS}} for d, s in days.items()
+        ])
+    db.commit()
+    return len(days)
+
+
+def _sum_select() -> str:
+    return ", ".join(f"COALESCE(SUM({k}), 0) AS {k}" for k in COLUMNS)
+
+
+def window_totals(db: Session, user_id: str, days: Optional[int] = None, today: Optional[date] = None) -> Stats:
+    """Summed columns over the last `days` UTC days including today (all history if None)."""
+    params: Dict[str, Any] = {"uid": user_id}
+    where = "user_id = :uid"
+    if days is not None:
+        params["start"] = (today or datetime.utcnow().date()) - timedelta(days=days - 1)
+        where += " AND day >= :start"
+    row = db.execute(sql_text(f"SELECT {_sum_select()} FROM user_daily_stats WHERE {where}"), params).mappings().first()
+    return Stats({k: int(v) for k, v in row.items()}) if row else Stats()
+
+
+def cohort_totals(db: Session, user_ids: Iterable[str], days: Optional[int] = None, today: Optional[date] = None) -> Dict[str, Stats]:
+    """window_totals for many users with one GROUP BY."""
+    user_ids: List[str] = list(user_ids)
+    if not user_ids:
+        return {}
+    params: Dict[str, Any] = {"uids": user_ids}
+    where = "user_id IN :uids"
+    if days is not None:
+        params["start"] = (today or datetime.utcnow().date()) - timedelta(days=days - 1)
+        where += " AND day >= :start"
+    rows = db.execute(sql_text(
+        f"SELECT user_id, {_sum_select()} FROM user_daily_stats WHERE {where} GROUP BY user_id"
+    ).bindparams(bindparam("uids", expanding=True)), params).mappings().all()
+    return {r["user_id"]: Stats({k: int(r[k]) for k in COLUMNS}) for r in rows}
+
+
+def last_active_day(db: Session, user_id: str) -> Optional[date]:
+    day = db.execute(sql_text("SELECT MAX(day) FROM user_daily_stats WHERE user_id = :uid"), {"uid": user_id}).scalar()
+    return date.fromisoformat(day) if isinstance(day, str) else day
+
+
+def avg_event_sentiment(s: Stats) -> Optional[float]:
+    """Mean chat_events sentiment (-1..1) from summed counters, None without events."""
+    if not s["e_sent_n"]:
+        return None
+    return (s["e_pos_sum"] - s["e_neg_sum"]) / SCALE / s["e_sent_n"]
@@ -1,24 +1,27 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any
 from pydantic import BaseModel
 import uuid
 import json
-import os
-from openai import OpenAI
 from datetime import datetime, timezone
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
 
-from ..db import get_db, engine, Base
+from ..db import get_db, engine, Base, SessionLocal
 from .. import models, schemas
-from ..crypto import encrypt_text, decrypt_text
+from ..crypto import encrypted_columns, decrypt_many, stored_ciphertext
 from ..auth import get_current_user_id
-from ..nlp_utils import analyze_message, is_high_risk, get_emergency_message
+from ..nlp_utils import ANALYSIS_VERSION, scan_and_analyze, lexical_features, is_high_risk, get_emergency_message
 from sqlalchemy import text as sql_text
 from ..config import settings
 from ..salesforce import data_cloud_client
+from ..risk_service import incremental_engine, invalidate_risk, bump_risk_revision
+from ..nlp_deep import DeepJob, deep_analysis
+from .. import rollup
+from ..llm import llm
 import threading
 
 # Ensure tables exist
@@ -26,22 +29,6 @@ Base.metadata.create_all(bind=engine)
 
 router = APIRouter()
 
-# OpenAI client (move to config later)
-def get_openai_client():
-    from ..config import settings
-    api_key = settings.OPENAI_API_KEY
-    print(f"OpenAI API Key present: {bool(api_key)}")
-    if not api_key:
-        print("No OpenAI API key found in environment")
-        return None
-    try:
-        client = OpenAI(api_key=api_key)
-        print("OpenAI client created successfully")
-        return client
-    except Exception as e:
-        print(f"Failed to create OpenAI client: {e}")
-        return None
-
 class ChatMessageCreate(BaseModel):
     message: str
     session_id: str | None = None
@@ -159,14 +146,17 @@ def get_chat_messages(
         models.ChatMessage.session_id == session_id
     ).order_by(models.ChatMessage.created_at.asc()).all()
     
+    contents = decrypt_many(
+        [stored_ciphertext(m) for m in messages],
+        on_error=lambda i, e: print(f"Error decrypting chat_messages {messages[i].id}: {e}"),
+    )
     result = []
-    for msg in messages:
-        content = decrypt_text(msg.ciphertext_b64, msg.iv_b64)
+    for msg, content in zip(messages, contents):
         result.append(ChatMessageResponse(
             id=msg.id,
             session_id=msg.session_id,
             role=msg.role,
-            content=content,
+            content=content or "",
             created_at=msg.created_at.isoformat(),
             intent=msg.intent,
             abuse_type=msg.abuse_type,
@@ -183,154 +173,204 @@ def get_chat_messages(
     
     return result
 
+def _with_session(fn, *args):
+    """Run fn(db, *args) in a session of its own, so no connection is held between steps."""
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+def _record_user_message(db: Session, user_id: str, payload: ChatMessageCreate):
+    """Analyze and store the user's message (plus its chat_events row); returns (session_id, analysis)."""
+    # Get or create session
+    session = get_or_create_session(db, user_id, payload.session_id)
+
+    # Analyze user message (one lexicon scan, memoized, feeds the analysis and the stored features)
+    hits, analysis = scan_and_analyze(payload.message)
+
+    # Store user message
+    user_msg = models.ChatMessage(
+        session_id=session.session_id,
+        user_id=user_id,
+        role="user",
+        **encrypted_columns(payload.message, user_id),
+        intent=analysis["intent"],
+        abuse_type=analysis["abuse_type"],
+        sentiment_score=analysis["sentiment_score"],
+        risk_points=analysis["risk_points"],
+        severity_score=analysis["severity_score"],
+        escalation_index=analysis["escalation_index"],
+        **analysis["risk_flags"],
+        **lexical_features(payload.message, hits),
+        analysis_version=ANALYSIS_VERSION,
+    )
+    # Attach metadata as JSON text if provided
+    meta: Dict[str, Any] = {}
+    for k in ["jurisdiction","children_present","confidentiality","share_with","location_type","recent_escalation","substance_use","threats_to_kill","weapon_involved"]:
+        v = getattr(payload, k, None)
+        if v is not None:
+            meta[k] = v
+    if meta:
+        user_msg.meta_json = json.dumps(meta)
+    db.add(user_msg)
+    db.commit()
+    db.refresh(user_msg)
+    incremental_engine.record_chat_message(user_id, user_msg, hits)
+    invalidate_risk(user_id)
+    rollup.record_chat_message(db, user_msg)
+
+    # Best-effort analytics/event record (created alongside the chat message)
+    event_id = None
+    try:
+        event_payload = {
+            "event_id": f"evt_{uuid.uuid4().hex[:12]}",
+            "chat_id": session.session_id,
+            "user_id": user_id,
+            "journal_entry": payload.message,
+            "entry_source": "web",
+            "jurisdiction": getattr(payload, "jurisdiction", None),
+            "location_type": getattr(payload, "location_type", None),
+            "children_present": getattr(payload, "children_present", None),
+            "event_type": analysis.get("intent"),
+            "type_of_abuse": analysis.get("abuse_type"),
+            "sentiment_score": analysis.get("sentiment_score"),
+            "risk_points": analysis.get("risk_points"),
+            "severity_score": analysis.get("severity_score"),
+            "escalation_index": analysis.get("escalation_index"),
+            "threats_to_kill": getattr(payload, "threats_to_kill", bool(analysis["risk_flags"].get("threats_to_kill"))),
+            "strangulation": bool(analysis["risk_flags"].get("strangulation")),
+            "weapon_involved": getattr(payload, "weapon_involved", bool(analysis["risk_flags"].get("weapon_involved"))),
+            "stalking": bool(analysis["risk_flags"].get("stalking", False)),
+            "digital_surveillance": bool(analysis["risk_flags"].get("digital_surveillance", False)),
+            "model_summary": "Short neutral summary (no PII).",
+            "confidentiality_level": getattr(payload, "confidentiality", None),
+            "share_with": getattr(payload, "share_with", None),
+            "extra_json": None,
+            "analysis_version": ANALYSIS_VERSION,
+        }
+        # Include recent_escalation and substance_use into extra_json
+        extra: Dict[str, Any] = {}
+        if getattr(payload, "recent_escalation", None) is not None:
+            extra["recent_escalation"] = payload.recent_escalation
+        if getattr(payload, "substance_use", None) is not None:
+            extra["substance_use"] = payload.substance_use
+        if extra:
+            event_payload["extra_json"] = json.dumps(extra)
+        # If meta_json exists, prefer including it entirely
+        if getattr(user_msg, "meta_json", None):
+            event_payload["extra_json"] = user_msg.meta_json
+
+        insert_sql = sql_text(
+            """
+            INSERT INTO chat_events (
+                event_id, chat_id, user_id, journal_entry, entry_source, jurisdiction, location_type,
+                children_present, event_type, type_of_abuse, sentiment_score, risk_points, severity_score,
+                escalation_index, threats_to_kill, strangulation, weapon_involved, stalking,
+                digital_surveillance, model_summary, confidentiality_level, share_with, extra_json, analysis_version
+            ) VALUES (
+                :event_id, :chat_id, :user_id, :journal_entry, :entry_source, :jurisdiction, :location_type,
+                :children_present, :event_type, :type_of_abuse, :sentiment_score, :risk_points, :severity_score,
+                :escalation_index, :threats_to_kill, :strangulation, :weapon_involved, :stalking,
+                :digital_surveillance, :model_summary, :confidentiality_level, :share_with, :extra_json, :analysis_version
+            )
+            """
+        )
+        db.execute(insert_sql, event_payload)
+        db.commit()
+        event_id = event_payload["event_id"]
+        incremental_engine.record_chat_event(user_id, event_payload)
+        invalidate_risk(user_id)
+        rollup.record_event(db, user_id, event_payload)
+
+        # Fire-and-forget streaming to Data Cloud
+        if user_id != "demo" and getattr(settings, "DATA_CLOUD_STREAMING_ENABLED", False):
+            threading.Thread(
+                target=data_cloud_client.stream_chat_event,
+                args=(dict(event_payload),),
+                daemon=True
+            ).start()
+    except Exception as _e:
+        # Avoid breaking chat flow if analytics write fails
+        db.rollback()
+
+    # Richer analysis runs later in worker processes (no-op unless NLP_DEEP_ANALYZER is set);
+    # the fast analysis above already decided the warning below
+    deep_analysis.submit(DeepJob(
+        user_id=user_id, message_id=user_msg.id, ciphertext=user_msg.ciphertext, iv=user_msg.iv,
+        key_id=user_msg.key_id, event_id=event_id,
+        declared={k: getattr(payload, k) for k in ("threats_to_kill", "weapon_involved") if getattr(payload, k, None) is not None},
+    ))
+    return session.session_id, analysis
+
+
+def _recent_history(db: Session, session_id: str) -> List[Dict[str, str]]:
+    """The session's last 10 messages, oldest first, as OpenAI chat messages."""
+    recent_messages = db.query(models.ChatMessage).filter(
+        models.ChatMessage.session_id == session_id
+    ).order_by(models.ChatMessage.created_at.desc()).limit(10).all()
+
+    # Build OpenAI message history (similar to chatdemoapp.py)
+    recent_messages.reverse()
+    contents = decrypt_many([stored_ciphertext(m) for m in recent_messages])
+    return [
+        {"role": "assistant" if msg.role == "assistant" else "user", "content": content}
+        for msg, content in zip(recent_messages, contents)
+        if content is not None  # an undecryptable row is left out of the context
+    ]
+
+
+def _store_assistant_message(db: Session, session_id: str, user_id: str, content: str) -> None:
+    db.add(models.ChatMessage(
+        session_id=session_id,
+        user_id=user_id,
+        role="assistant",
+        **encrypted_columns(content, user_id)
+    ))
+    db.commit()
+
+
 @router.post("/stream", response_class=StreamingResponse)
-def stream_chat_response(
+async def stream_chat_response(
     payload: ChatMessageCreate,
-    db: Session = Depends(get_db),
     user_id: str = Depends(get_current_user_id)
 ):
-    """Stream chat response with real-time NLP analysis"""
-    
-    def generate_response():
+    """Stream chat response with real-time NLP analysis
+
+    Runs on the event loop: the OpenAI stream is awaited, and the database/crypto steps
+    (short, synchronous) go to the threadpool, each with its own session, so a stream
+    holds neither a worker thread nor a pooled connection while it waits on the model.
+    """
+
+    async def generate_response():
         try:
-            # Get or create session
-            session = get_or_create_session(db, user_id, payload.session_id)
-            
-            # Analyze user message
-            analysis = analyze_message(payload.message)
-            
-            # Store user message
-            ct, iv, tag = encrypt_text(payload.message)
-            user_msg = models.ChatMessage(
-                session_id=session.session_id,
-                user_id=user_id,
-                role="user",
-                ciphertext_b64=ct,
-                iv_b64=iv,
-                tag_b64=tag,
-                intent=analysis["intent"],
-                abuse_type=analysis["abuse_type"],
-                sentiment_score=analysis["sentiment_score"],
-                risk_points=analysis["risk_points"],
-                severity_score=analysis["severity_score"],
-                escalation_index=analysis["escalation_index"],
-                **analysis["risk_flags"]
-            )
-            # Attach metadata as JSON text if provided
-            meta: Dict[str, Any] = {}
-            for k in ["jurisdiction","children_present","confidentiality","share_with","location_type","recent_escalation","substance_use","threats_to_kill","weapon_involved"]:
-                v = getattr(payload, k, None)
-                if v is not None:
-                    meta[k] = v
-            if meta:
-                user_msg.meta_json = json.dumps(meta)
-            db.add(user_msg)
-            db.commit()
-            db.refresh(user_msg)
-
-            # Best-effort analytics/event record (created alongside the chat message)
-            try:
-                event_payload = {
-                    "event_id": f"evt_{uuid.uuid4().hex[:12]}",
-                    "chat_id": session.session_id,
-                    "user_id": user_id,
-                    "journal_entry": payload.message,
-                    "entry_source": "web",
-                    "jurisdiction": getattr(payload, "jurisdiction", None),
-                    "location_type": getattr(payload, "location_type", None),
-                    "children_present": getattr(payload, "children_present", None),
-                    "event_type": analysis.get("intent"),
-                    "type_of_abuse": analysis.get("abuse_type"),
-                    "sentiment_score": analysis.get("sentiment_score"),
-                    "risk_points": analysis.get("risk_points"),
-                    "severity_score": analysis.get("severity_score"),
-                    "escalation_index": analysis.get("escalation_index"),
-                    "threats_to_kill": getattr(payload, "threats_to_kill", bool(analysis["risk_flags"].get("threats_to_kill"))),
-                    "strangulation": bool(analysis["risk_flags"].get("strangulation")),
-                    "weapon_involved": getattr(payload, "weapon_involved", bool(analysis["risk_flags"].get("weapon_involved"))),
-                    "stalking": bool(analysis["risk_flags"].get("stalking", False)),
-                    "digital_surveillance": bool(analysis["risk_flags"].get("digital_surveillance", False)),
-                    "model_summary": "Short neutral summary (no PII).",
-                    "confidentiality_level": getattr(payload, "confidentiality", None),
-                    "share_with": getattr(payload, "share_with", None),
-                    "extra_json": None,
-                }
-                # Include recent_escalation and substance_use into extra_json
-                extra: Dict[str, Any] = {}
-                if getattr(payload, "recent_escalation", None) is not None:
-                    extra["recent_escalation"] = payload.recent_escalation
-                if getattr(payload, "substance_use", None) is not None:
-                    extra["substance_use"] = payload.substance_use
-                if extra:
-                    event_payload["extra_json"] = json.dumps(extra)
-                # If meta_json exists, prefer including it entirely
-                if getattr(user_msg, "meta_json", None):
-                    event_payload["extra_json"] = user_msg.meta_json
-
-                insert_sql = sql_text(
-                    """
-                    INSERT INTO chat_events (
-                        event_id, chat_id, user_id, journal_entry, entry_source, jurisdiction, location_type,
-                        children_present, event_type, type_of_abuse, sentiment_score, risk_points, severity_score,
-                        escalation_index, threats_to_kill, strangulation, weapon_involved, stalking,
-                        digital_surveillance, model_summary, confidentiality_level, share_with, extra_json
-                    ) VALUES (
-                        :event_id, :chat_id, :user_id, :journal_entry, :entry_source, :jurisdiction, :location_type,
-                        :children_present, :event_type, :type_of_abuse, :sentiment_score, :risk_points, :severity_score,
-                        :escalation_index, :threats_to_kill, :strangulation, :weapon_involved, :stalking,
-                        :digital_surveillance, :model_summary, :confidentiality_level, :share_with, :extra_json
-                    )
-                    """
-                )
-                db.execute(insert_sql, event_payload)
-                db.commit()
-
-                # Fire-and-forget streaming to Data Cloud
-                if user_id != "demo" and getattr(settings, "DATA_CLOUD_STREAMING_ENABLED", False):
-                    threading.Thread(
-                        target=data_cloud_client.stream_chat_event,
-                        args=(dict(event_payload),),
-                        daemon=True
-                    ).start()
-            except Exception as _e:
-                # Avoid breaking chat flow if analytics write fails
-                db.rollback()
-            
+            session_id, analysis = await run_in_threadpool(_with_session, _record_user_message, user_id, payload)
+
             # Send analysis results immediately
             yield f"data: {json.dumps({'type': 'analysis', 'data': analysis})}\n\n"
-            
+
             # Check for high risk
             if is_high_risk(analysis["risk_flags"]):
                 yield f"data: {json.dumps({'type': 'warning', 'message': get_emergency_message()})}\n\n"
-            
+
             # Get recent message history for context
-            recent_messages = db.query(models.ChatMessage).filter(
-                models.ChatMessage.session_id == session.session_id
-            ).order_by(models.ChatMessage.created_at.desc()).limit(10).all()
-            
-            # Build OpenAI message history (similar to chatdemoapp.py)
-            messages = []
-            for msg in reversed(recent_messages):
-                content = decrypt_text(msg.ciphertext_b64, msg.iv_b64)
-                messages.append({
-                    "role": "assistant" if msg.role == "assistant" else "user",
-                    "content": content
-                })
-            
+            messages = await run_in_threadpool(_with_session, _recent_history, session_id)
+
             # Get AI response
-            oai = get_openai_client()
+            oai = llm.client
             assistant_content = ""
-            
+
             if oai:
                 try:
                     # Natural conversational context - let the AI respond naturally
                     risk_is_high = is_high_risk(analysis["risk_flags"])
-                    
+
                     if risk_is_high:
                         safety_context = " The user may be in a dangerous situation involving threats, weapons, or strangulation."
                     else:
                         safety_context = ""
-                    
+
                     system_prompt = (
                         "You are a compassionate and experienced support companion for people experiencing domestic violence. "
                         "Engage in natural conversation - respond authentically to what they share, ask thoughtful follow-up questions, "
@@ -339,40 +379,40 @@ def stream_chat_response(
                         "If someone is in immediate danger, gently suggest they consider calling emergency services. "
                         "Respond conversationally as you would to a friend who trusts you with something difficult."
                     )
-                    
+
                     # Build conversation history properly
                     conversation = [{"role": "system", "content": system_prompt}]
-                    
+
                     # Add recent conversation context (limit to last 6 messages for context)
                     for msg in messages[-6:]:
                         conversation.append(msg)
-                    
+
                     # Add current user message
                     conversation.append({"role": "user", "content": payload.message})
-                    
-                    print(f"Sending to OpenAI: {len(conversation)} messages, model: {os.getenv('OPENAI_MODEL', 'gpt-4o-mini')}")
-                    
-                    response = oai.chat.completions.create(
-                        model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+
+                    print(f"Sending to OpenAI: {len(conversation)} messages, model: {llm.model}")
+
+                    response = await oai.chat.completions.create(
+                        model=llm.model,
                         messages=conversation,
                         temperature=0.8,
                         max_tokens=300,
                         stream=True
                     )
-                    
-                    for chunk in response:
-                        if chunk.choices[0].delta.content:
+
+                    async for chunk in response:
+                        if chunk.choices and chunk.choices[0].delta.content:
                             content = chunk.choices[0].delta.content
                             assistant_content += content
                             yield f"data: {json.dumps({'type': 'content', 'content': content})}\n\n"
-                    
+
                     print(f"OpenAI response length: {len(assistant_content)}")
-                    
+
                     # Fallback if no content
                     if not assistant_content.strip():
                         assistant_content = "I'm here with you. What's on your mind today?"
                         yield f"data: {json.dumps({'type': 'content', 'content': assistant_content})}\n\n"
-                        
+
                 except Exception as e:
                     print(f"OpenAI API error: {e}")
                     assistant_content = "I'm here to listen and support you. What would you like to talk about?"
@@ -389,32 +429,26 @@ def stream_chat_response(
                 else:
                     assistant_content = "I'm here to listen and support you. Can you tell me more about what's on your mind?"
                 yield f"data: {json.dumps({'type': 'content', 'content': assistant_content})}\n\n"
-            
+
             # Store assistant response
-            ct, iv, tag = encrypt_text(assistant_content)
-            assistant_msg = models.ChatMessage(
-                session_id=session.session_id,
-                user_id=user_id,
-                role="assistant",
-                ciphertext_b64=ct,
-                iv_b64=iv,
-                tag_b64=tag
-            )
-            db.add(assistant_msg)
-            db.commit()
-            
+            await run_in_threadpool(_with_session, _store_assistant_message, session_id, user_id, assistant_content)
+
             # Send completion signal
-            yield f"data: {json.dumps({'type': 'complete', 'session_id': session.session_id})}\n\n"
-            
+            yield f"data: {json.dumps({'type': 'complete', 'session_id': session_id})}\n\n"
+
         except Exception as e:
             yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
-    
     return StreamingResponse(
         generate_response(),
         media_type="text/plain",
         headers={"Cache-Control": "no-cache", "Connection": "keep-alive"}
     )
 
+@router.get("/llm")
+def get_llm_stats():
+    """Shared OpenAI client state (configured, open, warmed up, pool limits)"""
+    return llm.stats()
+
 @router.delete("/sessions/{session_id}")
 def delete_chat_session(
     session_id: str,
@@ -441,6 +475,11 @@ def delete_chat_session(
     
     # Delete session
     db.delete(session)
+    # Max ids may not move (an older session); the revision tells other workers to reload
+    bump_risk_revision(db, user_id)
     db.commit()
+    incremental_engine.forget(user_id)
+    invalidate_risk(user_id)
+    rollup.rebuild_user(db, user_id)
     
     return {"ok": True, "message": "Session deleted"}
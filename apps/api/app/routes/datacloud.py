@@ -74,11 +74,11 @@ def stream_risk_to_datacloud(
     
     try:
         # Get current risk data (would call insights endpoint)
-        from ..routes.insights import risk_evaluator
+        from ..risk_service import evaluate_risk
         from ..db import get_db
         
         db = next(get_db())
-        risk_data = risk_evaluator.evaluate_user_risk(db, user_id)
+        risk_data = evaluate_risk(db, user_id)
         
         success = data_cloud_client.stream_risk_snapshot(user_id, risk_data)
         
@@ -1,17 +1,24 @@
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, text as sql_text
-from datetime import datetime, timedelta
+from sqlalchemy import text as sql_text
+from datetime import datetime
 from pathlib import Path
+import base64
 import csv
-import hashlib
-import os
+import json
 from typing import List, Dict, Any, Iterable
 from ..utils.ids import user_id_hash
 from ..db import get_db
-from .. import models
+from .. import models, rollup
+from ..risk_engine import latest_snapshot
 from ..auth import get_current_user_id
+from ..crypto import stored_ciphertext
+
+
+def _iso(ts: Any) -> str:
+    # Raw-SQL timestamps come back as datetimes on Postgres but as strings on SQLite
+    return ts if isinstance(ts, str) else ts.isoformat()
 
 router = APIRouter()
 
@@ -115,13 +122,16 @@ class DataExporter:
             
             # Export journals
             for journal in journals:
+                # The file keeps base64 text whichever column the row stores
+                ct, _, _ = stored_ciphertext(journal)
+                ciphertext_b64 = ct if isinstance(ct, str) else base64.b64encode(ct).decode()
                 w.writerow([
                     today,
                     user_hash,
                     "journal",
                     journal.created_at.isoformat() if journal.created_at else today,
-                    len(journal.ciphertext_b64),
-                    journal.ciphertext_b64  # Encrypted content
+                    len(ciphertext_b64),
+                    ciphertext_b64  # Encrypted content
                 ])
             
             # Export user info (anonymized)
@@ -159,7 +169,7 @@ class DataExporter:
         )
         for r in rows:
             vals = [
-                r.event_id, user_hash, r.chat_id, (r.created_at.isoformat() if r.created_at else ""),
+                r.event_id, user_hash, r.chat_id, (_iso(r.created_at) if r.created_at else ""),
                 (r.journal_entry or "").replace("\n"," ").replace("\r"," "), r.entry_source, r.jurisdiction,
                 r.location_type, str(bool(r.children_present)), r.event_type, r.type_of_abuse,
                 str(r.sentiment_score if r.sentiment_score is not None else ""),
@@ -184,7 +194,7 @@ class DataExporter:
                 "event_id": r.event_id,
                 "user_id_hash": user_hash,
                 "chat_id": r.chat_id,
-                "created_at": r.created_at.isoformat() if r.created_at else None,
+                "created_at": _iso(r.created_at) if r.created_at else None,
                 "journal_entry": r.journal_entry,
                 "entry_source": r.entry_source,
                 "jurisdiction": r.jurisdiction,
@@ -208,6 +218,14 @@ class DataExporter:
         return {"dataset": "chat_events", "records": out}
 
     # risk_snapshots dataset
+    @staticmethod
+    def _snapshot_reasons(r: models.RiskSnapshot) -> List[str]:
+        # Materialized snapshots store reasons as JSON; seeded ones have none
+        try:
+            return json.loads(r.reasons) if r.reasons else []
+        except ValueError:
+            return []
+
     def stream_risk_snapshots_csv(self, db: Session, user_id: str) -> Iterable[str]:
         user_hash = user_id_hash(user_id)
         yield ",".join(["user_id_hash","created_at","score","level","top_reasons"]) + "\n"
@@ -218,7 +236,7 @@ class DataExporter:
                 (r.created_at.isoformat() if r.created_at else ""),
                 str(r.risk_score),
                 r.risk_level,
-                "",
+                ";".join(self._snapshot_reasons(r)).replace(",", " "),
             ]) + "\n"
 
     def risk_snapshots_json(self, db: Session, user_id: str) -> Dict[str, Any]:
@@ -231,7 +249,7 @@ class DataExporter:
                 "created_at": r.created_at.isoformat() if r.created_at else None,
                 "score": r.risk_score,
                 "level": r.risk_level,
-                "top_reasons": None,
+                "top_reasons": self._snapshot_reasons(r) or None,
                 "feature_scores": r.feature_scores,
             })
         return {"dataset": "risk_snapshots", "records": out}
@@ -311,26 +329,23 @@ class DataExporter:
     # _hash_user_id deprecated: use utils.user_id_hash instead
     
     def _get_user_summary_data(self, db: Session, user_id: str) -> Dict[str, Any]:
-        """Get summary data for Tableau export"""
-        # Get recent journals count
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        recent_journals = db.query(models.Journal).filter(
-            and_(
-                models.Journal.user_id == user_id,
-                models.Journal.created_at >= week_ago
-            )
-        ).count()
-        
-        # For MVP, we'll use placeholder values
-        # In production, this would use actual check-in data
+        """Get summary data for Tableau export (from the user_daily_stats rollup)"""
+        last7 = rollup.window_totals(db, user_id, 7)
+        sentiment = rollup.avg_event_sentiment(last7)
+        snap = latest_snapshot(db, user_id)
+        last_day = rollup.last_active_day(db, user_id)
+        # Energy and safety need check-in data we do not collect yet: left blank, not faked
         return {
-            "mood_avg": 3.5,
-            "energy_avg": 4.0,
-            "safety_avg": 4.5,
-            "journals_last7": recent_journals,
-            "risk_score": 0.2,
-            "risk_level": "low",
-            "last_checkin": datetime.utcnow().date().isoformat()
+            # Mean 7d sentiment (-1..1) on the 1-5 check-in scale
+            "mood_avg": round(3 + 2 * sentiment, 2) if sentiment is not None else None,
+            "energy_avg": None,
+            "safety_avg": None,
+            "journals_last7": last7["j_rows"],
+            "chat_messages_last7": last7["c_rows"],
+            "high_risk_flags_last7": last7["e_flag_rows"],
+            "risk_score": snap.risk_score if snap else None,
+            "risk_level": snap.risk_level if snap else None,
+            "last_checkin": last_day.isoformat() if last_day else None,
         }
     
     def _get_user_journals(self, db: Session, user_id: str) -> List[models.Journal]:
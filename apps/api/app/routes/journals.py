@@ -3,12 +3,14 @@ from sqlalchemy.orm import Session
 from typing import List
 from ..db import get_db, engine, Base
 from .. import models, schemas
-from ..crypto import encrypt_text, decrypt_text
-from ..nlp_utils import simple_sentiment, extract_risk_flags, calculate_risk_scores
+from ..crypto import encrypted_columns, decrypt_many, stored_ciphertext
+from ..nlp_utils import ANALYSIS_VERSION, scan_text, simple_sentiment, extract_risk_flags, calculate_risk_scores, lexical_features
 from sqlalchemy import text as sql_text
 from ..auth import get_current_user_id
 from ..config import settings
 from ..salesforce import data_cloud_client
+from ..risk_service import incremental_engine, invalidate_risk
+from .. import rollup
 import threading
 
 # create tables on first run (simple for MVP; swap to Alembic later)
@@ -22,26 +24,30 @@ def list_journals(db: Session = Depends(get_db), user_id: str = Depends(get_curr
     if user_id == "demo":
         return []
     rows = db.query(models.Journal).filter(models.Journal.user_id == user_id).order_by(models.Journal.id.desc()).all()
-    out = []
-    for r in rows:
-        out.append(schemas.JournalOut(
-            id=r.id, user_id=r.user_id, created_at=r.created_at,
-            text=decrypt_text(r.ciphertext_b64, r.iv_b64)
-        ))
-    return out
+    texts = decrypt_many(
+        [stored_ciphertext(r) for r in rows],
+        on_error=lambda i, e: print(f"Error decrypting journals {rows[i].id}: {e}"),
+    )
+    return [
+        schemas.JournalOut(id=r.id, user_id=r.user_id, created_at=r.created_at, text=text or "")
+        for r, text in zip(rows, texts)
+    ]
 
 @router.post("/", response_model=schemas.JournalOut, status_code=201)
 def create_journal(payload: schemas.JournalCreate, db: Session = Depends(get_db), user_id: str = Depends(get_current_user_id)):
     if user_id == "demo":
         raise HTTPException(status_code=401, detail="Login required")
-    ct, iv, tag = encrypt_text(payload.text)
-    row = models.Journal(user_id=user_id, ciphertext_b64=ct, iv_b64=iv, tag_b64=tag)
+    hits = scan_text(payload.text)
+    row = models.Journal(user_id=user_id, **encrypted_columns(payload.text, user_id), **lexical_features(payload.text, hits))
     db.add(row); db.commit(); db.refresh(row)
+    incremental_engine.record_journal(user_id, row, hits)
+    invalidate_risk(user_id)
+    rollup.record_journal(db, row)
     # Best-effort analytics event for journals
     try:
         text_plain = payload.text or ""
-        sentiment = simple_sentiment(text_plain)
-        flags = extract_risk_flags(text_plain)
+        sentiment = simple_sentiment(text_plain, hits)
+        flags = extract_risk_flags(text_plain, hits)
         risks = calculate_risk_scores(flags)
         evt = {
             "event_id": f"evt_{row.id}",
@@ -67,6 +73,7 @@ def create_journal(payload: schemas.JournalCreate, db: Session = Depends(get_db)
             "confidentiality_level": None,
             "share_with": None,
             "extra_json": None,
+            "analysis_version": ANALYSIS_VERSION,
         }
         insert_sql = sql_text(
             """
@@ -74,17 +81,20 @@ def create_journal(payload: schemas.JournalCreate, db: Session = Depends(get_db)
                 event_id, chat_id, user_id, journal_entry, entry_source, jurisdiction, location_type,
                 children_present, event_type, type_of_abuse, sentiment_score, risk_points, severity_score,
                 escalation_index, threats_to_kill, strangulation, weapon_involved, stalking,
-                digital_surveillance, model_summary, confidentiality_level, share_with, extra_json
+                digital_surveillance, model_summary, confidentiality_level, share_with, extra_json, analysis_version
             ) VALUES (
                 :event_id, :chat_id, :user_id, :journal_entry, :entry_source, :jurisdiction, :location_type,
                 :children_present, :event_type, :type_of_abuse, :sentiment_score, :risk_points, :severity_score,
                 :escalation_index, :threats_to_kill, :strangulation, :weapon_involved, :stalking,
-                :digital_surveillance, :model_summary, :confidentiality_level, :share_with, :extra_json
+                :digital_surveillance, :model_summary, :confidentiality_level, :share_with, :extra_json, :analysis_version
             )
             """
         )
         db.execute(insert_sql, evt)
         db.commit()
+        incremental_engine.record_chat_event(user_id, evt)
+        invalidate_risk(user_id)
+        rollup.record_event(db, user_id, evt)
 
         # Fire-and-forget streaming to Data Cloud
         if user_id != "demo" and getattr(settings, "DATA_CLOUD_STREAMING_ENABLED", False):
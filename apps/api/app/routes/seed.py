@@ -4,9 +4,9 @@ from datetime import datetime, timezone, timedelta
 from typing import List, Dict, Any
 
 from ..db import get_db, engine, Base
-from .. import models
+from .. import models, rollup
 from ..auth import hash_password
-from ..nlp_utils import simple_sentiment, extract_risk_flags, calculate_risk_scores
+from ..nlp_utils import ANALYSIS_VERSION, analyze_message, lexical_features, scan_and_analyze
 from sqlalchemy import text as sql_text
 
 # Ensure tables exist
@@ -223,10 +223,9 @@ def _seed_profiles() -> List[Dict[str, Any]]:
     return base
 
 
-def _insert_chat_event(db: Session, user_id: str, chat_id: str, created_at, text_plain: str, context: Dict[str, Any], event_id: str, default_conf: str | None, default_share: str | None):
-    sentiment = simple_sentiment(text_plain)
-    flags = extract_risk_flags(text_plain)
-    risks = calculate_risk_scores(flags)
+def _insert_chat_event(db: Session, user_id: str, chat_id: str, created_at, text_plain: str, context: Dict[str, Any], event_id: str, default_conf: str | None, default_share: str | None, analysis: Dict[str, Any] | None = None):
+    analysis = analysis or analyze_message(text_plain)
+    flags = analysis["risk_flags"]
     evt = {
         "event_id": event_id,
         "chat_id": chat_id,
@@ -238,10 +237,10 @@ def _insert_chat_event(db: Session, user_id: str, chat_id: str, created_at, text
         "children_present": context.get("children_present"),
         "event_type": context.get("event_type", "seek_emotional_support"),
         "type_of_abuse": context.get("type_of_abuse", "unknown"),
-        "sentiment_score": sentiment,
-        "risk_points": risks.get("risk_points"),
-        "severity_score": risks.get("severity_score"),
-        "escalation_index": risks.get("escalation_index"),
+        "sentiment_score": analysis["sentiment_score"],
+        "risk_points": analysis["risk_points"],
+        "severity_score": analysis["severity_score"],
+        "escalation_index": analysis["escalation_index"],
         "threats_to_kill": bool(flags.get("threats_to_kill")),
         "strangulation": bool(flags.get("strangulation")),
         "weapon_involved": bool(flags.get("weapon_involved")),
@@ -251,6 +250,7 @@ def _insert_chat_event(db: Session, user_id: str, chat_id: str, created_at, text
         "confidentiality_level": context.get("confidentiality_level") or default_conf,
         "share_with": context.get("share_with") or default_share,
         "extra_json": None,
+        "analysis_version": ANALYSIS_VERSION,
     }
     insert_sql = sql_text(
         """
@@ -258,12 +258,12 @@ def _insert_chat_event(db: Session, user_id: str, chat_id: str, created_at, text
             event_id, chat_id, user_id, journal_entry, entry_source, jurisdiction, location_type,
             children_present, event_type, type_of_abuse, sentiment_score, risk_points, severity_score,
             escalation_index, threats_to_kill, strangulation, weapon_involved, stalking,
-            digital_surveillance, model_summary, confidentiality_level, share_with, extra_json, created_at
+            digital_surveillance, model_summary, confidentiality_level, share_with, extra_json, analysis_version, created_at
         ) VALUES (
             :event_id, :chat_id, :user_id, :journal_entry, :entry_source, :jurisdiction, :location_type,
             :children_present, :event_type, :type_of_abuse, :sentiment_score, :risk_points, :severity_score,
             :escalation_index, :threats_to_kill, :strangulation, :weapon_involved, :stalking,
-            :digital_surveillance, :model_summary, :confidentiality_level, :share_with, :extra_json, :created_at
+            :digital_surveillance, :model_summary, :confidentiality_level, :share_with, :extra_json, :analysis_version, :created_at
         )
         """
     )
@@ -310,16 +310,17 @@ def seed_run(db: Session = Depends(get_db)):
             "Small step today toward safety; documenting incidents and planning next moves.",
         ]
         for i, txt in enumerate(texts):
+            # Seed texts repeat across users and runs; these are analysis cache hits
+            hits, analysis = scan_and_analyze(txt)
             ts = now - timedelta(days=(len(texts) - i) * 3)
-            ct, iv, tag = (None, None, None)
-            # Use crypto layer if available; journals route uses encrypt_text
+            # Use crypto layer if available; journals route uses encrypted_columns
             try:
-                from ..crypto import encrypt_text
-                ct, iv, tag = encrypt_text(txt)
+                from ..crypto import encrypted_columns
+                cols = encrypted_columns(txt, str(user.id))
             except Exception:
                 # Fallback plain markers (not expected in normal flow)
-                ct, iv, tag = txt, "iv", "tag"
-            j = models.Journal(user_id=str(user.id), ciphertext_b64=ct, iv_b64=iv, tag_b64=tag)
+                cols = {"ciphertext_b64": txt, "iv_b64": "iv"}
+            j = models.Journal(user_id=str(user.id), **cols, **lexical_features(txt, hits))
             db.add(j); db.commit(); db.refresh(j)
             # Adjust created_at to synthetic timestamp
             db.execute(sql_text("UPDATE journals SET created_at=:ts WHERE id=:jid"), {"ts": ts, "jid": j.id})
@@ -337,9 +338,13 @@ def seed_run(db: Session = Depends(get_db)):
                 event_id=f"evt_{j.id}",
                 default_conf=default_conf,
                 default_share=default_share,
+                analysis=analysis,
             )
             db.commit()
 
+        # Seeded rows bypass the write paths; rebuild the user's daily rollup from them
+        rollup.rebuild_user(db, str(user.id))
+
         # Create one RiskSnapshot based on recent events
         try:
             # Aggregate risk from chat_events
@@ -0,0 +1,56 @@
+"""Fill the write-time lexical feature columns on legacy journals and user chat messages.
+
+Rows written before those columns existed are decrypted once here so RiskEvaluator never
+has to decrypt them again. Safe to re-run: only rows with word_count IS NULL are touched.
+"""
+import sys
+from pathlib import Path as _Path
+ROOT = _Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.db import SessionLocal, engine, Base
+from app import models
+from app.crypto import decrypt_many, stored_ciphertext
+from app.nlp_utils import lexical_features
+
+BATCH_SIZE = 500
+
+
+def backfill(session, model, *criteria) -> int:
+    updated = 0
+    last_id = 0
+    while True:
+        rows = session.query(model).filter(
+            model.id > last_id, model.word_count.is_(None), *criteria
+        ).order_by(model.id.asc()).limit(BATCH_SIZE).all()
+        if not rows:
+            return updated
+        texts = decrypt_many(
+            [stored_ciphertext(r) for r in rows],
+            on_error=lambda i, e: print(f"Skipping {model.__tablename__} {rows[i].id}: {e}"),
+        )
+        for r, plain in zip(rows, texts):
+            if plain is None:
+                continue
+            for k, v in lexical_features(plain).items():
+                setattr(r, k, v)
+            updated += 1
+        last_id = rows[-1].id
+        session.commit()
+        print(f"{model.__tablename__}: {updated} rows updated (through id {last_id})")
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        j = backfill(session, models.Journal)
+        c = backfill(session, models.ChatMessage, models.ChatMessage.role == "user")
+    finally:
+        session.close()
+    print(f"Backfilled {j} journals and {c} chat messages")
+
+
+if __name__ == "__main__":
+    main()
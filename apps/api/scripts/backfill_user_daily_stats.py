@@ -0,0 +1,47 @@
+"""Rebuild the user_daily_stats rollup from journals, chat_messages and chat_events.
+
+Run once after the migration, and whenever the write-time updates may have been missed
+(they are best effort). Each user is recomputed from scratch, so re-running is safe.
+Pass user ids to rebuild only those users.
+"""
+import sys
+from pathlib import Path as _Path
+ROOT = _Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from sqlalchemy import text as sql_text
+
+from app.db import SessionLocal, engine, Base
+from app import models, rollup
+
+
+def _all_user_ids(session) -> list[str]:
+    ids = {str(u.id) for u in session.query(models.User.id)}
+    for model in (models.Journal, models.ChatMessage):
+        ids.update(uid for (uid,) in session.query(model.user_id).distinct())
+    try:
+        ids.update(uid for (uid,) in session.execute(sql_text("SELECT DISTINCT user_id FROM chat_events")))
+    except Exception:
+        session.rollback()  # chat_events not created yet
+    ids.discard(None)
+    return sorted(ids)
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    days = 0
+    try:
+        user_ids = sys.argv[1:] or _all_user_ids(session)
+        for i, uid in enumerate(user_ids, 1):
+            days += rollup.rebuild_user(session, uid)
+            if i % 100 == 0 or i == len(user_ids):
+                print(f"Rebuilt {i}/{len(user_ids)} users")
+    finally:
+        session.close()
+    print(f"Backfilled {days} user-days for {len(user_ids)} users")
+
+
+if __name__ == "__main__":
+    main()
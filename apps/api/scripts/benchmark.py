@@ -0,0 +1,331 @@
+"""Benchmarks for the NLP, crypto, risk and export hot paths on synthetic data.
+
+Generates --users synthetic users with --journals journals and --messages user chat
+messages each (plus one chat_event per message), written the way the API writes them,
+then times:
+
+    nlp.analyze_message                 per message (uncached)
+    nlp.scan_and_analyze_cached         per message (warm analysis cache)
+    nlp.analyze_messages                per message (one batch call)
+    crypto.encrypt_text                 per message
+    crypto.decrypt_text                 per message (base64 columns)
+    crypto.decrypt_bytes                per message (binary columns)
+    crypto.encrypt_many                 per message (one batch call)
+    crypto.decrypt_many                 per message (one batch call, stored columns)
+    risk.evaluate_user_risk             per user
+    exports.stream_chat_events_csv      per event row
+    datacloud.transform_chat_event      per event
+
+Each benchmark runs one warm-up pass and --repeat timed passes; the median per-op
+time is what comparisons use. By default the data lives in a throwaway SQLite file;
+--db-url points it at a local Postgres instead (benchmark rows are removed afterwards).
+
+    python scripts/benchmark.py --save bench_baseline.json
+    python scripts/benchmark.py --compare bench_baseline.json --threshold 0.15
+
+--compare exits 1 if any benchmark's median is more than --threshold slower.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path as _Path
+ROOT = _Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+USER_PREFIX = "bench-"
+FILLER = (
+    "today went to work came home the house was quiet talked with my sister about the week "
+    "cooked dinner watched something tried to sleep early it rained all afternoon the bus was late"
+).split()
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", help="database to benchmark against (default: a temporary SQLite file)")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--journals", type=int, default=200, help="journals per user")
+    parser.add_argument("--messages", type=int, default=200, help="user chat messages (and chat_events) per user")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=5, help="timed passes per benchmark")
+    parser.add_argument("--only", nargs="*", help="run only benchmarks whose name starts with one of these")
+    parser.add_argument("--save", type=_Path, help="write results as a baseline JSON file")
+    parser.add_argument("--compare", type=_Path, help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown vs the baseline (0.15 = 15%%)")
+    return parser.parse_args()
+
+
+def _texts(rnd: random.Random, lexicons, n: int, words: tuple[int, int]) -> list[str]:
+    """Filler sentences salted with lexicon phrases, so every NLP branch gets exercised."""
+    phrases = [p for values in lexicons.values() for p in values]
+    out = []
+    for _ in range(n):
+        parts = [rnd.choice(FILLER) for _ in range(rnd.randint(*words))]
+        for _ in range(rnd.randint(0, 3)):
+            parts.insert(rnd.randrange(len(parts) + 1), rnd.choice(phrases))
+        out.append(" ".join(parts))
+    return out
+
+
+def _chat_events_table():
+    import sqlalchemy as sa
+    # Same columns as migration 2ead8977ecc9 (chat_events is not an ORM model)
+    return sa.Table(
+        "chat_events", sa.MetaData(),
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("event_id", sa.String(32), nullable=False, index=True),
+        sa.Column("chat_id", sa.String(64), nullable=False, index=True),
+        sa.Column("user_id", sa.String(64), nullable=False, index=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column("journal_entry", sa.Text),
+        sa.Column("entry_source", sa.String(32)),
+        sa.Column("jurisdiction", sa.String(128)),
+        sa.Column("location_type", sa.String(32)),
+        sa.Column("children_present", sa.Boolean),
+        sa.Column("event_type", sa.String(64)),
+        sa.Column("type_of_abuse", sa.String(64)),
+        sa.Column("sentiment_score", sa.Float),
+        sa.Column("risk_points", sa.Integer),
+        sa.Column("severity_score", sa.Integer),
+        sa.Column("escalation_index", sa.Float),
+        sa.Column("threats_to_kill", sa.Boolean),
+        sa.Column("strangulation", sa.Boolean),
+        sa.Column("weapon_involved", sa.Boolean),
+        sa.Column("stalking", sa.Boolean),
+        sa.Column("digital_surveillance", sa.Boolean),
+        sa.Column("model_summary", sa.Text),
+        sa.Column("confidentiality_level", sa.String(32)),
+        sa.Column("share_with", sa.String(64)),
+        sa.Column("extra_json", sa.Text),
+    )
+
+
+def _generate(session, args, chat_events):
+    """Insert the synthetic users' journals, chat messages and chat_events; returns (user_ids, messages)."""
+    from app import models
+    from app.crypto import encrypted_columns
+    from app.nlp_utils import LEXICONS, analyze_message, lexical_features, scan_text
+
+    rnd = random.Random(args.seed)
+    now = datetime.utcnow()
+    user_ids = [f"{USER_PREFIX}{i}" for i in range(args.users)]
+    sample = []
+    for uid in user_ids:
+        for text in _texts(rnd, LEXICONS, args.journals, (40, 120)):
+            session.add(models.Journal(
+                user_id=uid, **encrypted_columns(text, uid),
+                created_at=now - timedelta(days=rnd.uniform(0, 90)), **lexical_features(text, scan_text(text)),
+            ))
+        events = []
+        for i, text in enumerate(_texts(rnd, LEXICONS, args.messages, (8, 30))):
+            hits = scan_text(text)
+            a = analyze_message(text, hits)
+            ts = now - timedelta(days=rnd.uniform(0, 90))
+            session.add(models.ChatMessage(
+                session_id=f"{uid}-s", user_id=uid, role="user", **encrypted_columns(text, uid),
+                intent=a["intent"], abuse_type=a["abuse_type"], sentiment_score=a["sentiment_score"],
+                risk_points=a["risk_points"], severity_score=a["severity_score"], escalation_index=a["escalation_index"],
+                created_at=ts, **a["risk_flags"], **lexical_features(text, hits),
+            ))
+            events.append({
+                "event_id": f"b{uid[len(USER_PREFIX):]}_{i}", "chat_id": f"{uid}-s", "user_id": uid, "created_at": ts,
+                "journal_entry": text, "entry_source": "web", "event_type": a["intent"], "type_of_abuse": a["abuse_type"],
+                "sentiment_score": a["sentiment_score"], "risk_points": a["risk_points"],
+                "severity_score": a["severity_score"], "escalation_index": a["escalation_index"],
+                "model_summary": "Short neutral summary (no PII).", "extra_json": json.dumps({"recent_escalation": rnd.random() < 0.2}),
+                **a["risk_flags"],
+            })
+            sample.append(text)
+        session.execute(chat_events.insert(), events)
+        session.commit()
+    return user_ids, sample
+
+
+def _cleanup(session, chat_events, user_ids):
+    from app import models
+    for model in (models.Journal, models.ChatMessage, models.RiskSnapshot, models.UserDailyStats):
+        session.query(model).filter(model.user_id.in_(user_ids)).delete(synchronize_session=False)
+    session.execute(chat_events.delete().where(chat_events.c.user_id.in_(user_ids)))
+    session.commit()
+
+
+def _time(fn, ops: int, repeat: int) -> dict:
+    fn()  # warm-up: imports, caches, connection pool
+    per_op = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        per_op.append((time.perf_counter() - started) / ops)
+    per_op.sort()
+    median = statistics.median(per_op)
+    return {
+        "ops": ops,
+        "median_us": round(median * 1e6, 3),
+        "min_us": round(per_op[0] * 1e6, 3),
+        "max_us": round(per_op[-1] * 1e6, 3),
+        "ops_per_sec": round(1 / median, 1) if median else None,
+    }
+
+
+def _benchmarks(session, user_ids, messages, chat_events):
+    from sqlalchemy import select
+    from app.crypto import (
+        decrypt_bytes, decrypt_many, decrypt_text, encrypt_bytes, encrypt_many, encrypt_text, encrypted_columns,
+    )
+    from app.nlp_utils import analyze_message, analyze_messages, scan_and_analyze, scan_text
+    from app.routes.exports import exporter
+    from app.risk_service import risk_evaluator
+    from app.salesforce import data_cloud_client
+
+    encrypted = [encrypt_text(m) for m in messages]
+    encrypted_bytes = [encrypt_bytes(m) for m in messages]
+    stored = [(c["ciphertext"], c["iv"], c["key_id"]) for c in (encrypted_columns(m, user_ids[0]) for m in messages)]
+    event_rows = [dict(r) for r in session.execute(
+        select(chat_events).where(chat_events.c.user_id.in_(user_ids))
+    ).mappings()]
+
+    def analyze():
+        for m in messages:
+            analyze_message(m, scan_text(m))
+
+    def analyze_cached():
+        for m in messages:
+            scan_and_analyze(m)
+
+    def analyze_batch():
+        analyze_messages(messages)
+
+    def encrypt():
+        for m in messages:
+            encrypt_text(m)
+
+    def decrypt():
+        for ct, iv, _ in encrypted:
+            decrypt_text(ct, iv)
+
+    def decrypt_binary():
+        for ct, iv in encrypted_bytes:
+            decrypt_bytes(ct, iv)
+
+    def encrypt_batch():
+        encrypt_many(messages)
+
+    def decrypt_batch():
+        decrypt_many(stored)
+
+    def evaluate():
+        for uid in user_ids:
+            risk_evaluator.evaluate_user_risk(session, uid)
+
+    def export_csv():
+        for uid in user_ids:
+            for _ in exporter.stream_chat_events_csv(session, uid):
+                pass
+
+    def transform():
+        for e in event_rows:
+            data_cloud_client._transform_chat_event(e)
+
+    return {
+        "nlp.analyze_message": (analyze, len(messages)),
+        "nlp.scan_and_analyze_cached": (analyze_cached, len(messages)),
+        "nlp.analyze_messages": (analyze_batch, len(messages)),
+        "crypto.encrypt_text": (encrypt, len(messages)),
+        "crypto.decrypt_text": (decrypt, len(encrypted)),
+        "crypto.decrypt_bytes": (decrypt_binary, len(encrypted_bytes)),
+        "crypto.encrypt_many": (encrypt_batch, len(messages)),
+        "crypto.decrypt_many": (decrypt_batch, len(stored)),
+        "risk.evaluate_user_risk": (evaluate, len(user_ids)),
+        "exports.stream_chat_events_csv": (export_csv, len(event_rows)),
+        "datacloud.transform_chat_event": (transform, len(event_rows)),
+    }
+
+
+def _compare(results: dict, baseline: dict, threshold: float) -> int:
+    if baseline.get("params") != results["params"]:
+        print(f"WARNING: baseline was recorded with different parameters: {baseline.get('params')}")
+    regressions = 0
+    print(f"\n{'benchmark':<34}{'baseline us':>14}{'current us':>14}{'change':>10}")
+    for name, cur in results["benchmarks"].items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if not base:
+            print(f"{name:<34}{'-':>14}{cur['median_us']:>14.3f}{'new':>10}")
+            continue
+        change = cur["median_us"] / base["median_us"] - 1 if base["median_us"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{name:<34}{base['median_us']:>14.3f}{cur['median_us']:>14.3f}{change:>+10.1%}{flag}")
+    print(f"\n{regressions} regression(s) beyond {threshold:.0%}")
+    return regressions
+
+
+def main():
+    args = _parse_args()
+    tmp_db = None
+    if args.db_url:
+        os.environ["DB_URL"] = args.db_url
+    else:
+        tmp_db = _Path(tempfile.mkdtemp()) / "bench.db"
+        os.environ["DB_URL"] = f"sqlite:///{tmp_db}"
+    # app.* reads DB_URL at import time, so import only after it is set
+    from app.db import SessionLocal, engine, Base
+    from app.risk_service import risk_evaluator
+
+    Base.metadata.create_all(bind=engine)
+    chat_events = _chat_events_table()
+    chat_events.create(bind=engine, checkfirst=True)
+    session = SessionLocal()
+    user_ids = []
+    try:
+        if tmp_db is None:
+            # Leftovers of an interrupted run against the same database
+            _cleanup(session, chat_events, [f"{USER_PREFIX}{i}" for i in range(args.users)])
+        started = time.perf_counter()
+        user_ids, messages = _generate(session, args, chat_events)
+        print(f"Generated {len(user_ids)} users in {time.perf_counter() - started:.1f}s")
+
+        results = {
+            "created_at": datetime.utcnow().isoformat(),
+            "machine": {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor()},
+            "params": {
+                "dialect": engine.dialect.name, "users": args.users, "journals": args.journals,
+                "messages": args.messages, "seed": args.seed, "rules_version": risk_evaluator.rules_version,
+            },
+            "benchmarks": {},
+        }
+        for name, (fn, ops) in _benchmarks(session, user_ids, messages, chat_events).items():
+            if args.only and not any(name.startswith(p) for p in args.only):
+                continue
+            r = _time(fn, ops, args.repeat)
+            results["benchmarks"][name] = r
+            print(f"{name:<34}{r['median_us']:>12.3f} us/op  (min {r['min_us']:.3f}, {r['ops']} ops x {args.repeat})")
+    finally:
+        if tmp_db is None and user_ids:
+            _cleanup(session, chat_events, user_ids)
+        session.close()
+        engine.dispose()
+        if tmp_db is not None:
+            tmp_db.unlink(missing_ok=True)
+
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"Wrote {args.save}")
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        return 1 if _compare(results, baseline, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,7 +9,7 @@ if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
 from app.db import SessionLocal, engine, Base
-from app import models
+from app import models, rollup
 from sqlalchemy import text as sql_text
 
 
@@ -36,6 +36,10 @@ def main():
         ])
 
         users = session.query(models.User).all()
+        # Aggregates come from the user_daily_stats rollup: two GROUP BYs for the whole export
+        uids = [str(u.id) for u in users]
+        totals_all = rollup.cohort_totals(session, uids)
+        totals_7 = rollup.cohort_totals(session, uids, 7)
         for u in users:
             # latest risk snapshot
             snap = session.execute(sql_text(
@@ -43,21 +47,10 @@ def main():
             ), {"uid": str(u.id)}).first()
 
             # aggregates
-            agg = session.execute(sql_text(
-                "SELECT COUNT(*) AS journals_count FROM journals WHERE user_id=:uid"
-            ), {"uid": str(u.id)}).first()
-            evt_total = session.execute(sql_text(
-                "SELECT COUNT(*) AS c FROM chat_events WHERE user_id=:uid"
-            ), {"uid": str(u.id)}).scalar() or 0
-            evt_7 = session.execute(sql_text(
-                "SELECT COUNT(*) AS c FROM chat_events WHERE user_id=:uid AND created_at >= now() - interval '7 days'"
-            ), {"uid": str(u.id)}).scalar() or 0
-            sent_avg = session.execute(sql_text(
-                "SELECT AVG(sentiment_score) FROM chat_events WHERE user_id=:uid"
-            ), {"uid": str(u.id)}).scalar()
-            risk_avg = session.execute(sql_text(
-                "SELECT AVG(risk_points) FROM chat_events WHERE user_id=:uid"
-            ), {"uid": str(u.id)}).scalar()
+            agg = totals_all.get(str(u.id), rollup.Stats())
+            agg_7 = totals_7.get(str(u.id), rollup.Stats())
+            sent_avg = rollup.avg_event_sentiment(agg)
+            risk_avg = agg["e_risk_points_sum"] / agg["e_risk_points_n"] if agg["e_risk_points_n"] else None
 
             # recent context fields
             ctx = session.execute(sql_text(
@@ -106,9 +99,9 @@ def main():
                 snap.risk_score if snap else "",
                 snap.risk_level if snap else "",
                 snap.created_at.isoformat() if snap and snap.created_at else "",
-                agg.journals_count if agg else 0,
-                evt_total,
-                evt_7,
+                agg["j_rows"],
+                agg["e_rows"],
+                agg_7["e_rows"],
                 f"{sent_avg:.3f}" if sent_avg is not None else "",
                 f"{risk_avg:.3f}" if risk_avg is not None else "",
                 recent_escalation,
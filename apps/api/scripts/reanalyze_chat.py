@@ -0,0 +1,48 @@
+"""Re-run NLP analysis over stored chat messages and chat events after a lexicon change.
+
+Only rows not yet stamped with the current analysis version are touched. Progress is
+checkpointed after every chunk: Ctrl-C (or SIGTERM) stops cleanly and re-running the
+same command resumes. Create `<checkpoint>.pause` to pause a running job in place.
+
+    python scripts/reanalyze_chat.py --workers 4 --max-rows-per-sec 2000
+"""
+import argparse
+import os
+import sys
+from pathlib import Path as _Path
+ROOT = _Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.config import settings
+from app.nlp_reanalysis import TABLES, ReanalysisJob
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--chunk-size", type=int, default=500, help="rows per worker task and per UPDATE")
+    parser.add_argument("--max-rows-per-sec", type=float, help="throttle (average over the run)")
+    parser.add_argument("--tables", nargs="+", choices=list(TABLES), default=list(TABLES))
+    parser.add_argument("--checkpoint", type=_Path, default=ROOT / "reanalysis_checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--analyzer", default=settings.NLP_DEEP_ANALYZER,
+                        help="deep analyzer spec as in NLP_DEEP_ANALYZER (default: its value; empty = fast rules only)")
+    args = parser.parse_args()
+
+    if args.restart and args.checkpoint.exists():
+        args.checkpoint.unlink()
+    job = ReanalysisJob(
+        args.checkpoint, workers=args.workers, chunk_size=args.chunk_size,
+        max_rows_per_sec=args.max_rows_per_sec, tables=tuple(args.tables), analyzer_spec=args.analyzer,
+    )
+    print(f"Re-analyzing {', '.join(args.tables)} to analysis version {job.version}")
+    if job.run():
+        print("Done")
+        return 0
+    print(f"Stopped; progress saved to {args.checkpoint}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
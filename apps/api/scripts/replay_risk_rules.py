@@ -0,0 +1,101 @@
+"""Backtest a candidate risk rules file against the current one over past days.
+
+Scores every user as of the end of each day in --start..--end under both rule sets
+(point-in-time: only rows that existed then) and reports level transitions and score
+differences. Chunks of users run in parallel worker processes.
+
+    python scripts/replay_risk_rules.py --rules /tmp/risk_rules_tuned.yaml --start 2025-01-01 --end 2025-12-31
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path as _Path
+ROOT = _Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.db import SessionLocal, engine, Base
+from app import models
+from app.risk_replay import LEVELS, load_evaluator, run_replay
+from app.risk_evaluator import RULES_PATH
+
+
+def _all_user_ids(session) -> list[str]:
+    ids = {str(u.id) for u in session.query(models.User.id)}
+    for model in (models.Journal, models.ChatMessage):
+        ids.update(uid for (uid,) in session.query(model.user_id).distinct())
+    ids.discard("demo")
+    return sorted(ids)
+
+
+def _print_report(summary, baseline_version, candidate_version) -> None:
+    print(f"\nRules {baseline_version} (baseline) vs {candidate_version} (candidate): "
+          f"{summary['users']} users, {summary['user_days']} user-days")
+    print("\nLevel on the same day (rows: baseline, columns: candidate)")
+    print("          " + "".join(f"{c:>10}" for c in LEVELS))
+    for b in LEVELS:
+        print(f"{b:>10}" + "".join(f"{summary['level_changes'].get(f'{b}->{c}', 0):>10}" for c in LEVELS))
+    for name in ("baseline", "candidate"):
+        moves = summary["transitions"][name]
+        print(f"\nDay-over-day level changes ({name}): {sum(moves.values())}")
+        for k, v in sorted(moves.items(), key=lambda kv: -kv[1]):
+            print(f"  {k:<12}{v:>8}")
+    d = summary["diff"]
+    print(f"\nScore diff (candidate - baseline): mean {d['mean']:+.4f}, mean abs {d['mean_abs']:.4f}, "
+          f"max abs {d['max_abs']:.3f}, changed on {d['changed_user_days']} user-days")
+    print("  " + "  ".join(f"{k}:{v}" for k, v in d["histogram"].items()))
+    if summary["top_movers"]:
+        print("\nLargest movers")
+        for m in summary["top_movers"][:10]:
+            print(f"  user {m['user_id']} on {m['day']}: {m['baseline']:.3f} -> {m['candidate']:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=_Path, required=True, help="candidate rules YAML")
+    parser.add_argument("--baseline", type=_Path, default=RULES_PATH, help="baseline rules YAML (default: the deployed rules)")
+    parser.add_argument("--start", type=date.fromisoformat, help="first day (default: --end minus 365 days)")
+    parser.add_argument("--end", type=date.fromisoformat, help="last day (default: today)")
+    parser.add_argument("--step-days", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--chunk-size", type=int, default=500, help="users per worker task")
+    parser.add_argument("--users", nargs="*", help="only these user ids")
+    parser.add_argument("--out", type=_Path, help="also write the full summary (with daily series) as JSON")
+    args = parser.parse_args()
+
+    end = args.end or datetime.utcnow().date()
+    start = args.start or end - timedelta(days=365)
+    if start > end:
+        parser.error("--start is after --end")
+    try:
+        baseline = load_evaluator(args.baseline)
+        candidate = load_evaluator(args.rules)
+    except (FileNotFoundError, ValueError) as e:
+        print(e)
+        return 1
+
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        user_ids = args.users or _all_user_ids(session)
+    finally:
+        session.close()
+
+    started = time.perf_counter()
+    summary = run_replay(
+        args.baseline, args.rules, user_ids, start, end,
+        step_days=args.step_days, workers=args.workers, chunk_size=args.chunk_size,
+    )
+    print(f"Replayed {start} .. {end} in {time.perf_counter() - started:.1f}s")
+    _print_report(summary, baseline.rules_version, candidate.rules_version)
+    if args.out:
+        args.out.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+        print(f"\nWrote {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
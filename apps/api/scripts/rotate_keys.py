@@ -0,0 +1,101 @@
+"""Rotate encryption keys without downtime (see app/key_rotation.py).
+
+    python scripts/rotate_keys.py master-keys         # print a new master key document (--add: plus the current keys)
+    python scripts/rotate_keys.py master              # new master key in KMS_KEY_FILE, re-wrap data keys
+    python scripts/rotate_keys.py rewrap              # re-wrap data keys under the current master key
+    python scripts/rotate_keys.py data 42 57          # new data keys for these users (--all: every user)
+    python scripts/rotate_keys.py reencrypt --max-rows-per-sec 2000
+    python scripts/rotate_keys.py prune               # drop data keys no row uses any more
+    python scripts/rotate_keys.py status
+
+Master keys are never generated implicitly (see app/kms.py). `master-keys` prints the
+JSON to store as KMS_MASTER_KEYS or in KMS_KEY_FILE; with KMS_MASTER_KEYS, rotating the
+master key is `master-keys --add`, updating the secret on every instance, then `rewrap`.
+
+`reencrypt` moves rows onto their user's current data key, including rows still under
+APP_ENC_KEY. Progress is checkpointed after every chunk: Ctrl-C (or SIGTERM) stops
+cleanly and re-running resumes; create `<checkpoint>.pause` to pause in place. Other
+API processes switch to a user's new data key within DATA_KEY_CACHE_TTL_SECONDS, so run
+`reencrypt` once more after that to catch rows they wrote meanwhile.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path as _Path
+ROOT = _Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.data_keys import data_keys
+from app.db import SessionLocal
+from app.key_rotation import TABLES, ReencryptionJob
+from app.kms import kms, with_new_key
+from app import models
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    master_keys = sub.add_parser("master-keys", help="print a master key document with a new current key")
+    master_keys.add_argument("--add", action="store_true", help="add the new key to the configured ones")
+    sub.add_parser("master", help="add a master key version to KMS_KEY_FILE and re-wrap every data key with it")
+    sub.add_parser("rewrap", help="re-wrap data keys held under older master keys with the current one")
+    data = sub.add_parser("data", help="give users a new current data key")
+    data.add_argument("user_ids", nargs="*")
+    data.add_argument("--all", action="store_true", help="every user that has a data key")
+    reencrypt = sub.add_parser("reencrypt", help="move rows onto their user's current data key")
+    reencrypt.add_argument("--chunk-size", type=int, default=500, help="rows per chunk (one transaction each)")
+    reencrypt.add_argument("--max-rows-per-sec", type=float, help="throttle (average over the run)")
+    reencrypt.add_argument("--tables", nargs="+", choices=list(TABLES), default=list(TABLES))
+    reencrypt.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    sub.add_parser("prune", help="delete data keys that are not current and not used by any row")
+    sub.add_parser("status", help="print the re-encryption checkpoint")
+    parser.add_argument("--checkpoint", type=_Path, default=ROOT / "reencryption_checkpoint.json")
+    args = parser.parse_args()
+
+    if args.command == "master-keys":
+        print(json.dumps(with_new_key(kms.document() if args.add else None)))
+        return 0
+    if args.command in ("data", "reencrypt") and not data_keys.enabled:
+        parser.error("per-user data keys are off; set DATA_KEYS_ENABLED")
+    if args.command == "status":
+        print(args.checkpoint.read_text(encoding="utf-8") if args.checkpoint.exists() else "No checkpoint")
+        return 0
+    if args.command == "reencrypt":
+        if args.restart and args.checkpoint.exists():
+            args.checkpoint.unlink()
+        job = ReencryptionJob(
+            args.checkpoint, chunk_size=args.chunk_size, max_rows_per_sec=args.max_rows_per_sec, tables=tuple(args.tables)
+        )
+        if job.run():
+            print(f"Done: {json.dumps(job.progress()['tables'])}")
+            args.checkpoint.unlink()  # the next rotation starts from the first row
+            return 0
+        print(f"Stopped; progress saved to {args.checkpoint}")
+        return 1
+
+    session = SessionLocal()
+    try:
+        if args.command == "master":
+            key_id = kms.rotate()
+            print(f"Master key {key_id} is current; re-wrapped {data_keys.rewrap(session)} data keys")
+        elif args.command == "rewrap":
+            print(f"Re-wrapped {data_keys.rewrap(session)} data keys under master key {kms.current_key_id}")
+        elif args.command == "data":
+            user_ids = args.user_ids
+            if args.all:
+                user_ids = [u for (u,) in session.query(models.UserDataKey.user_id).distinct()]
+            if not user_ids:
+                parser.error("pass user ids or --all")
+            for uid in user_ids:
+                data_keys.rotate_user(uid)
+            print(f"New data keys for {len(user_ids)} users; run `reencrypt` to move their rows")
+        elif args.command == "prune":
+            print(f"Deleted {data_keys.prune(session)} unused data keys")
+    finally:
+        session.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
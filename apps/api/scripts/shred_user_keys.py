@@ -0,0 +1,50 @@
+"""Crypto-shred users: destroy their data keys so their journals and chat messages can
+no longer be decrypted.
+
+Only the user_data_keys rows are deleted; the encrypted rows stay in place and read as
+undecryptable. Rows from before per-user keys (key_id NULL, under APP_ENC_KEY) and the
+plaintext in chat_events.journal_entry are not covered, so they are counted and reported.
+Irreversible: pass --yes to confirm.
+
+    python scripts/shred_user_keys.py --yes 42 57
+"""
+import argparse
+import sys
+from pathlib import Path as _Path
+ROOT = _Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from sqlalchemy import text as sql_text
+
+from app.db import SessionLocal
+from app import models
+from app.data_keys import data_keys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("user_ids", nargs="+")
+    parser.add_argument("--yes", action="store_true", help="confirm; key destruction cannot be undone")
+    args = parser.parse_args()
+    if not args.yes:
+        parser.error("refusing to destroy keys without --yes")
+
+    session = SessionLocal()
+    try:
+        for uid in args.user_ids:
+            destroyed = data_keys.destroy_user(session, uid)
+            legacy = sum(
+                session.query(model).filter(model.user_id == uid, model.key_id.is_(None)).count()
+                for model in (models.Journal, models.ChatMessage)
+            )
+            events = session.execute(
+                sql_text("SELECT COUNT(*) FROM chat_events WHERE user_id = :u AND journal_entry IS NOT NULL"), {"u": uid}
+            ).scalar()
+            print(f"User {uid}: {destroyed} key(s) destroyed; not covered: {legacy} APP_ENC_KEY rows, {events} chat_events")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Shared test setup.
+
+Settings are read when `app.config` is imported, so the environment is set here, before
+any test module imports the app: a throwaway SQLite database, per-user data keys on,
+and a master key file in a temporary directory.
+"""
+
+import base64
+import json
+import os
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+import sqlalchemy as sa
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+_TMP = Path(tempfile.mkdtemp(prefix="api-tests-"))
+_KEY_FILE = _TMP / "kms.json"
+_KEY_FILE.write_text(json.dumps({"current": "1", "keys": {"1": base64.b64encode(os.urandom(32)).decode()}}))
+os.environ.update({
+    "DB_URL": f"sqlite:///{_TMP / 'test.db'}",
+    "DATA_KEYS_ENABLED": "true",
+    "KMS_MASTER_KEYS": "",
+    "KMS_KEY_FILE": str(_KEY_FILE),
+    "OPENAI_API_KEY": "",
+})
+
+
+def _chat_events_table() -> sa.Table:
+    # chat_events is not an ORM model; same columns as its migrations (2ead8977ecc9, c3e9f4a7b821)
+    return sa.Table(
+        "chat_events", sa.MetaData(),
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("event_id", sa.String(32), nullable=False, index=True),
+        sa.Column("chat_id", sa.String(64), nullable=False, index=True),
+        sa.Column("user_id", sa.String(64), nullable=False, index=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column("journal_entry", sa.Text),
+        sa.Column("entry_source", sa.String(32)),
+        sa.Column("jurisdiction", sa.String(128)),
+        sa.Column("location_type", sa.String(32)),
+        sa.Column("children_present", sa.Boolean),
+        sa.Column("event_type", sa.String(64)),
+        sa.Column("type_of_abuse", sa.String(64)),
+        sa.Column("sentiment_score", sa.Float),
+        sa.Column("risk_points", sa.Integer),
+        sa.Column("severity_score", sa.Integer),
+        sa.Column("escalation_index", sa.Float),
+        sa.Column("threats_to_kill", sa.Boolean),
+        sa.Column("strangulation", sa.Boolean),
+        sa.Column("weapon_involved", sa.Boolean),
+        sa.Column("stalking", sa.Boolean),
+        sa.Column("digital_surveillance", sa.Boolean),
+        sa.Column("model_summary", sa.Text),
+        sa.Column("confidentiality_level", sa.String(32)),
+        sa.Column("share_with", sa.String(64)),
+        sa.Column("extra_json", sa.Text),
+        sa.Column("analysis_version", sa.String(16)),
+    )
+
+
+@pytest.fixture(scope="session")
+def schema():
+    from app.db import Base, engine
+    from app import models  # noqa: F401  (registers the tables)
+
+    Base.metadata.create_all(bind=engine)
+    _chat_events_table().create(bind=engine, checkfirst=True)
+
+
+@pytest.fixture
+def db(schema):
+    from app.db import SessionLocal
+
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def user_id(schema):
+    """A fresh user per test, so tests share the database without seeing each other's rows."""
+    return uuid.uuid4().hex[:12]
+
+
+class Rows:
+    """Writes journals, user chat messages and chat_events the way the routes do."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def journal(self, user_id, text, days_ago=0.0, legacy=False):
+        from app import models
+        from app.crypto import encrypt_text, encrypted_columns
+        from app.nlp_utils import lexical_features
+
+        if legacy:
+            # Written before the binary and lexical feature columns
+            ct, iv, _ = encrypt_text(text)
+            cols = {"ciphertext_b64": ct, "iv_b64": iv}
+        else:
+            cols = {**encrypted_columns(text, user_id), **lexical_features(text)}
+        row = models.Journal(user_id=user_id, created_at=datetime.utcnow() - timedelta(days=days_ago), **cols)
+        self.db.add(row)
+        self.db.commit()
+        return row
+
+    def message(self, user_id, text, session_id="s1", days_ago=0.0):
+        from app import models
+        from app.crypto import encrypted_columns
+        from app.nlp_utils import ANALYSIS_VERSION, analyze_message, lexical_features
+
+        a = analyze_message(text)
+        row = models.ChatMessage(
+            session_id=session_id, user_id=user_id, role="user", created_at=datetime.utcnow() - timedelta(days=days_ago),
+            intent=a["intent"], abuse_type=a["abuse_type"], sentiment_score=a["sentiment_score"],
+            risk_points=a["risk_points"], severity_score=a["severity_score"], escalation_index=a["escalation_index"],
+            analysis_version=ANALYSIS_VERSION, **a["risk_flags"], **encrypted_columns(text, user_id), **lexical_features(text),
+        )
+        self.db.add(row)
+        self.db.commit()
+        return row
+
+    def event(self, user_id, text, chat_id="s1", days_ago=0.0):
+        from app.nlp_utils import ANALYSIS_VERSION, analyze_message
+
+        a = analyze_message(text)
+        self.db.execute(_chat_events_table().insert().values(
+            event_id=uuid.uuid4().hex, chat_id=chat_id, user_id=user_id,
+            created_at=datetime.utcnow() - timedelta(days=days_ago), journal_entry=text,
+            event_type=a["intent"], type_of_abuse=a["abuse_type"], sentiment_score=a["sentiment_score"],
+            risk_points=a["risk_points"], severity_score=a["severity_score"], escalation_index=a["escalation_index"],
+            analysis_version=ANALYSIS_VERSION, **a["risk_flags"],
+        ))
+        self.db.commit()
+
+
+@pytest.fixture
+def rows(db):
+    return Rows(db)
@@ -0,0 +1,129 @@
+import base64
+
+import pytest
+
+from app import crypto, models
+from app.config import settings
+from app.crypto import decrypt_many, decrypt_stored, encrypt_bytes, encrypt_many, encrypt_text, encrypted_columns
+
+
+def _stored(cols):
+    return cols["ciphertext"], cols["iv"], cols["key_id"]
+
+
+def test_encrypt_many_round_trips_in_order():
+    texts = [f"entry {i}" for i in range(50)]
+    stored = [(ct, iv, None) for ct, iv, _ in encrypt_many(texts)]
+    assert decrypt_many(stored) == texts
+
+
+def test_decrypt_many_mixes_keys_and_reports_failures(user_id):
+    user_cols = encrypted_columns("under the user's key", user_id)
+    ct, iv = encrypt_bytes("under APP_ENC_KEY")
+    tampered = bytes([ct[0] ^ 1]) + ct[1:]
+    errors = []
+    out = decrypt_many(
+        [_stored(user_cols), (ct, iv, None), (tampered, iv, None), (ct, iv, "no-such-key")],
+        on_error=lambda i, e: errors.append(i),
+    )
+    assert out == ["under the user's key", "under APP_ENC_KEY", None, None]
+    assert errors == [2, 3]
+
+
+def test_decrypt_many_in_parallel_keeps_order(monkeypatch):
+    monkeypatch.setattr(crypto, "PARALLEL_MIN_ROWS", 4)
+    monkeypatch.setattr(crypto, "_workers", 3)
+    texts = [f"row {i}" for i in range(37)]
+    stored = [(*encrypt_bytes(t), None) for t in texts]
+    stored[5] = (b"\x00" * 32, stored[5][1], None)
+    errors = []
+    out = decrypt_many(stored, on_error=lambda i, e: errors.append(i))
+    assert out == texts[:5] + [None] + texts[6:]
+    assert errors == [5]
+
+
+def test_binary_columns_round_trip_through_the_database(db, rows, user_id):
+    row = rows.journal(user_id, "stored as bytes")
+    db.expire_all()
+    stored = crypto.stored_ciphertext(db.get(models.Journal, row.id))
+    assert isinstance(stored[0], bytes) and stored[2] is not None
+    assert decrypt_stored(*stored) == "stored as bytes"
+
+
+def test_legacy_base64_rows_still_decrypt(db, rows, user_id):
+    row = rows.journal(user_id, "written before the binary columns", legacy=True)
+    db.expire_all()
+    stored = crypto.stored_ciphertext(db.get(models.Journal, row.id))
+    assert stored == (row.ciphertext_b64, row.iv_b64, None)
+    assert decrypt_stored(*stored) == "written before the binary columns"
+    assert decrypt_many([stored]) == ["written before the binary columns"]
+
+
+def test_legacy_tag_is_the_ciphertext_suffix():
+    # tag_b64 rows stored the GCM tag twice; ciphertext_b64 alone decrypts them
+    ct_b64, iv_b64, tag_b64 = encrypt_text("legacy row")
+    assert base64.b64decode(ct_b64)[-16:] == base64.b64decode(tag_b64)
+    assert crypto.decrypt_text(ct_b64, iv_b64) == "legacy row"
+
+
+def test_base64_copies_follow_the_setting(monkeypatch, user_id):
+    monkeypatch.setattr(settings, "CIPHERTEXT_WRITE_BASE64", True)
+    cols = encrypted_columns("both", user_id)
+    assert base64.b64decode(cols["ciphertext_b64"]) == cols["ciphertext"]
+    assert decrypt_stored(cols["ciphertext_b64"], cols["iv_b64"], cols["key_id"]) == "both"
+    monkeypatch.setattr(settings, "CIPHERTEXT_WRITE_BASE64", False)
+    assert "ciphertext_b64" not in encrypted_columns("binary only", user_id)
+
+
+def _plaintext(ct, iv):
+    """The bytes actually encrypted under APP_ENC_KEY."""
+    return crypto._aes.decrypt(iv, ct, None)
+
+
+LONG = "I wrote about the week again and how the house felt quiet. " * 40
+
+
+def test_long_text_is_compressed_with_a_flag():
+    ct, iv = encrypt_bytes(LONG)
+    packed = _plaintext(ct, iv)
+    assert packed[:2] == b"\xff\x01"
+    assert len(ct) < len(LONG) // 4
+    assert crypto.decrypt_bytes(ct, iv) == LONG
+
+
+def test_short_text_is_stored_as_is():
+    ct, iv = encrypt_bytes("short entry")
+    assert _plaintext(ct, iv) == b"short entry"
+
+
+def test_text_that_does_not_shrink_is_stored_as_is(monkeypatch):
+    monkeypatch.setattr(crypto, "COMPRESS_MIN_BYTES", 1)
+    ct, iv = encrypt_bytes("ab")  # zlib output is longer than two bytes
+    assert _plaintext(ct, iv) == b"ab"
+    assert crypto.decrypt_bytes(ct, iv) == "ab"
+
+
+def test_rows_written_before_compression_still_decrypt():
+    iv = b"\x01" * 12
+    ct = crypto._aes.encrypt(iv, ("élan — " * 200).encode("utf-8"), None)
+    assert crypto.decrypt_bytes(ct, iv) == "élan — " * 200
+    assert decrypt_many([(ct, iv, None)]) == ["élan — " * 200]
+
+
+def test_codec_is_recorded_per_row(monkeypatch):
+    zlib_row = encrypt_bytes(LONG)
+    monkeypatch.setattr(crypto, "_codec_id", 2)
+    lzma_row = encrypt_bytes(LONG)
+    assert _plaintext(*lzma_row)[:2] == b"\xff\x02"
+    monkeypatch.setattr(crypto, "_codec_id", None)
+    plain_row = encrypt_bytes(LONG)
+    assert _plaintext(*plain_row) == LONG.encode("utf-8")
+    # Reading never depends on the current setting
+    assert decrypt_many([(*zlib_row, None), (*lzma_row, None), (*plain_row, None)]) == [LONG] * 3
+
+
+def test_unknown_codec_fails_to_decrypt():
+    iv = b"\x02" * 12
+    ct = crypto._aes.encrypt(iv, b"\xff\x09whatever", None)
+    with pytest.raises(ValueError, match="Unknown compression codec 9"):
+        crypto.decrypt_bytes(ct, iv)
@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from cryptography.exceptions import InvalidTag
+
+from app import models
+from app.crypto import decrypt_many, decrypt_stored, encrypted_columns
+from app.data_keys import DataKeyStore, data_keys
+from app.kms import KMSNotConfigured, LocalKMS, kms
+
+
+def _stored(cols):
+    return cols["ciphertext"], cols["iv"], cols["key_id"]
+
+
+def _versions(db, user_id):
+    db.expire_all()
+    return sorted(v for (v,) in db.query(models.UserDataKey.version).filter(models.UserDataKey.user_id == user_id))
+
+
+def test_each_user_gets_a_key_of_their_own(user_id):
+    other = user_id + "-other"
+    mine, theirs = encrypted_columns("mine", user_id), encrypted_columns("theirs", other)
+    assert mine["key_id"] and theirs["key_id"] and mine["key_id"] != theirs["key_id"]
+    assert encrypted_columns("again", user_id)["key_id"] == mine["key_id"]
+    with pytest.raises(InvalidTag):
+        decrypt_stored(mine["ciphertext"], mine["iv"], theirs["key_id"])
+
+
+def test_keys_are_stored_wrapped_and_reload(db, user_id):
+    cols = encrypted_columns("persisted", user_id)
+    row = db.get(models.UserDataKey, cols["key_id"])
+    assert row.master_key_id == kms.current_key_id and row.version == 1
+    # A new process: nothing cached, the key is unwrapped from the database
+    fresh = DataKeyStore(kms, enabled=True)
+    assert fresh.for_user(user_id)[0] == cols["key_id"]
+    assert fresh.get(cols["key_id"]).decrypt(bytes(cols["iv"]), bytes(cols["ciphertext"]), None) == b"persisted"
+    assert fresh.unwraps == 1 and fresh.created == 0
+
+
+def test_rotation_keeps_old_rows_readable(db, user_id):
+    old = encrypted_columns("before", user_id)
+    new_key = data_keys.rotate_user(user_id)
+    new = encrypted_columns("after", user_id)
+    assert new["key_id"] == new_key != old["key_id"]
+    assert _versions(db, user_id) == [1, 2]
+    assert decrypt_many([_stored(old), _stored(new)]) == ["before", "after"]
+
+
+def test_concurrent_first_use_creates_one_key(db, user_id):
+    # One store per thread stands in for separate processes with empty caches
+    stores = [DataKeyStore(kms, enabled=True) for _ in range(6)]
+    with ThreadPoolExecutor(len(stores)) as pool:
+        key_ids = set(pool.map(lambda s: s.for_user(user_id)[0], stores))
+    assert len(key_ids) == 1
+    assert _versions(db, user_id) == [1]
+
+
+def test_destroying_keys_shreds_rows(db, user_id):
+    cols = encrypted_columns("shredded", user_id)
+    assert data_keys.destroy_user(db, user_id) == 1
+    with pytest.raises(KeyError):
+        data_keys.get(cols["key_id"])
+    assert decrypt_many([_stored(cols)]) == [None]
+
+
+def test_disabled_store_writes_under_app_key(monkeypatch, user_id):
+    monkeypatch.setattr(data_keys, "enabled", False)
+    cols = encrypted_columns("shared key", user_id)
+    assert cols["key_id"] is None
+    assert decrypt_stored(*_stored(cols)) == "shared key"
+    with pytest.raises(KMSNotConfigured):
+        data_keys.for_user(user_id)
+    with pytest.raises(KMSNotConfigured):
+        data_keys.rotate_user(user_id)
+
+
+def test_startup_check_requires_a_master_key_source(tmp_path):
+    DataKeyStore(LocalKMS(), enabled=False).check()
+    with pytest.raises(KMSNotConfigured):
+        DataKeyStore(LocalKMS(), enabled=True).check()
+    with pytest.raises(KMSNotConfigured, match="not found"):
+        DataKeyStore(LocalKMS(path=tmp_path / "missing.json"), enabled=True).check()
+    DataKeyStore(kms, enabled=True).check()
@@ -0,0 +1,65 @@
+import base64
+import json
+
+from app import models
+from app.crypto import decrypt_many, stored_ciphertext
+from app.data_keys import data_keys
+from app.key_rotation import ReencryptionJob
+
+
+def _run_to_end(path):
+    job = ReencryptionJob(path, tables=("journals",))
+    assert job.run()
+    return job
+
+
+def _stop_after_first_chunk(job):
+    save = job._save_checkpoint
+
+    def save_and_stop():
+        save()
+        job.request_stop()
+
+    job._save_checkpoint = save_and_stop
+
+
+def _journals(db, user_id):
+    db.expire_all()
+    return db.query(models.Journal).filter(models.Journal.user_id == user_id).order_by(models.Journal.id).all()
+
+
+def test_reencryption_resumes_from_checkpoint(db, rows, user_id, tmp_path):
+    # Rows other tests left on old keys are moved first, so every stale row below is this user's
+    _run_to_end(tmp_path / "before.json")
+    texts = [f"entry {i}" for i in range(12)]
+    for i, text in enumerate(texts):
+        rows.journal(user_id, text, legacy=i % 3 == 0)
+    data_keys.rotate_user(user_id)
+    current = data_keys.for_user(user_id)[0]
+
+    checkpoint = tmp_path / "rotation.json"
+    job = ReencryptionJob(checkpoint, chunk_size=5, tables=("journals",))
+    _stop_after_first_chunk(job)
+    assert job.run() is False
+    saved = json.loads(checkpoint.read_text())["tables"]["journals"]
+    assert saved["reencrypted"] == 5 and not saved["done"]
+    first_chunk = [r for r in _journals(db, user_id) if r.id <= saved["last_id"]]
+    assert len(first_chunk) == 5 and all(r.key_id == current for r in first_chunk)
+
+    # Rows before the checkpoint are not revisited: a key rotated now leaves them alone
+    current = data_keys.rotate_user(user_id)
+    resumed = ReencryptionJob(checkpoint, chunk_size=5, tables=("journals",))
+    assert resumed.run()
+    progress = resumed.progress()["tables"]["journals"]
+    assert progress["reencrypted"] == len(texts) and progress["done"] and progress["failed"] == 0
+    after = _journals(db, user_id)
+    assert [r.key_id == current for r in after] == [r.id > saved["last_id"] for r in after]
+    # No base64 copy is left holding the old key's ciphertext
+    assert all(r.ciphertext_b64 is None or base64.b64decode(r.ciphertext_b64) == r.ciphertext for r in after)
+    assert decrypt_many([stored_ciphertext(r) for r in after]) == texts
+
+    # A fresh run picks up what the resumed one skipped
+    assert _run_to_end(tmp_path / "again.json").progress()["tables"]["journals"]["reencrypted"] == 5
+    after = _journals(db, user_id)
+    assert all(r.key_id == current for r in after)
+    assert decrypt_many([stored_ciphertext(r) for r in after]) == texts
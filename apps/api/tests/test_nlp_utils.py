@@ -0,0 +1,114 @@
+import random
+
+import pytest
+
+from app.nlp_utils import (
+    LEXICONS, RISK_POINTS, MATCHER, PhraseMatcher, analyze_message, analyze_messages, scan_and_analyze, scan_text,
+)
+
+
+# The per-message scans PhraseMatcher replaced: one substring test per phrase, per call
+def _any(text, phrases):
+    t = text.lower()
+    return any(k in t for k in phrases)
+
+
+def reference_analysis(text):
+    labels = [
+        label for label in ["physical", "emotional", "financial", "digital_surveillance", "stalking", "sexual"]
+        if _any(text, LEXICONS[f"abuse_{label}"])
+    ]
+    if _any(text, LEXICONS["intent_legal"]):
+        intent = "seek_legal_info"
+    elif _any(text, LEXICONS["intent_safety_planning"]):
+        intent = "safety_planning"
+    elif _any(text, LEXICONS["intent_emotional_support"]):
+        intent = "seek_emotional_support"
+    else:
+        intent = "report_incident"
+    flags = {flag: _any(text, LEXICONS[f"flag_{flag}"]) for flag in RISK_POINTS}
+    neg, pos = _any(text, LEXICONS["sentiment_negative"]), _any(text, LEXICONS["sentiment_positive"])
+    sentiment = -0.6 if neg and not pos else 0.4 if pos and not neg else -0.1 if neg else 0.1
+    pts = sum(v for k, v in RISK_POINTS.items() if flags[k])
+    return {
+        "intent": intent,
+        "abuse_type": ",".join(sorted(set(labels))) or "unknown",
+        "sentiment_score": sentiment,
+        "risk_flags": flags,
+        "risk_points": pts,
+        "severity_score": min(100, pts * 10),
+        "escalation_index": min(1.0, pts / 10.0),
+    }
+
+
+def reference_counts(text):
+    t = text.lower()
+    counts = {c: sum(1 for p in {p.lower() for p in phrases} if p in t) for c, phrases in LEXICONS.items()}
+    return {c: n for c, n in counts.items() if n}
+
+
+def _texts(n, seed=7):
+    rnd = random.Random(seed)
+    phrases = [p for ps in LEXICONS.values() for p in ps]
+    filler = "today went to work came home the house was quiet talked with my sister about the week".split()
+    out = [
+        "", "   ", "I want to die", "I WANT TO DIE", "he has a gun in the house", "Kill myself?!",
+        "diesel", "the gun\x00knife", "café — he followed me", "i can't go on", "i can’t go on",
+    ]
+    for _ in range(n):
+        words = [rnd.choice(filler) for _ in range(rnd.randint(0, 40))]
+        for _ in range(rnd.randint(0, 5)):
+            phrase = rnd.choice(phrases)
+            words.insert(rnd.randint(0, len(words)), phrase.upper() if rnd.random() < 0.2 else phrase)
+        # Phrases glued to their neighbours still match as substrings
+        out.append(("" if rnd.random() < 0.1 else " ").join(words))
+    return out
+
+
+TEXTS = _texts(400)
+
+
+@pytest.mark.parametrize("text", TEXTS[:11])
+def test_scan_counts_match_per_phrase_search(text):
+    assert scan_text(text).counts == reference_counts(text)
+
+
+def test_scan_matches_per_phrase_search_on_mixed_texts():
+    for text in TEXTS:
+        hits = scan_text(text)
+        assert hits.counts == reference_counts(text), text
+        t = text.lower()
+        assert hits.phrases == frozenset(p for p in MATCHER.categories if p in t), text
+
+
+def test_analyze_message_matches_per_message_scan():
+    for text in TEXTS:
+        expected = reference_analysis(text)
+        assert analyze_message(text, scan_text(text)) == expected, text
+        assert analyze_message(text) == expected, text
+
+
+def test_cached_analysis_is_a_copy():
+    _, first = scan_and_analyze("he has a gun")
+    first["risk_flags"]["weapon_involved"] = False
+    _, again = scan_and_analyze("he has a gun")
+    assert again["risk_flags"]["weapon_involved"] is True
+
+
+def test_matcher_merges_duplicate_phrases_across_categories():
+    matcher = PhraseMatcher({"a": ["Gun", "knife"], "b": ["gun", "gun"]})
+    hits = matcher.scan("A GUN and a knife")
+    assert hits.phrases == frozenset({"gun", "knife"})
+    assert hits.counts == {"a": 2, "b": 1}
+    assert matcher.scan("nothing here").counts == {}
+
+
+def test_analyze_messages_matches_per_message_analysis():
+    batch = analyze_messages(TEXTS)
+    assert len(batch) == len(TEXTS)
+    for i, text in enumerate(TEXTS):
+        assert batch.row(i) == reference_analysis(text), text
+
+
+def test_analyze_messages_empty_batch():
+    assert len(analyze_messages([])) == 0
@@ -0,0 +1,95 @@
+import re
+from datetime import datetime
+
+import pytest
+
+from app.risk_dsl import AggregateContext, QueryPlan, RuleSyntaxError, parse_rule
+from app.risk_engine import EvaluationContext
+from app.risk_service import risk_evaluator
+
+
+def test_parse_comparison_with_call():
+    assert parse_rule("delta(mood, 7d) < -1.5") == (
+        "cmp", "<", ("call", "delta", [("ref", "mood"), ("dur", 7)]), ("num", -1.5),
+    )
+
+
+def test_parse_precedence_and_grouping():
+    assert parse_rule("any(weapon_phrases, 30d) or not x > 1 and y") == (
+        "or", [
+            ("call", "any", [("ref", "weapon_phrases"), ("dur", 30)]),
+            ("and", [("cmp", ">", ("not", ("ref", "x")), ("num", 1.0)), ("ref", "y")]),
+        ],
+    )
+    assert parse_rule("(a or b) and c") == ("and", [("or", [("ref", "a"), ("ref", "b")]), ("ref", "c")])
+
+
+@pytest.mark.parametrize("rule, message", [
+    ("avg(mood, 7d) >= 0.5 $", "unexpected character"),
+    ("avg(mood, 7d", "expected )"),
+    ("avg(mood, 7d) 1", "unexpected '1'"),
+    ("", "end of rule"),
+    ("avg(mood,, 7d)", "unexpected ','"),
+])
+def test_parse_errors(rule, message):
+    with pytest.raises(RuleSyntaxError, match=re.escape(message)):
+        parse_rule(rule)
+
+
+def test_plan_records_errors_per_feature():
+    plan = QueryPlan("v", {
+        "ok": "avg(chat.negative, 30d) >= 0.05",
+        "bad_fn": "median(mood, 7d) > 1",
+        "bad_source": "avg(heart_rate, 7d) > 1",
+        "bad_syntax": "avg(mood 7d)",
+    }, {}, "sqlite")
+    assert set(plan.errors) == {"bad_fn", "bad_source", "bad_syntax"}
+    assert "unknown function 'median'" in plan.errors["bad_fn"]
+    assert "unknown data source 'heart_rate'" in plan.errors["bad_source"]
+    assert not plan.usable
+    assert plan.columns_by_feature["ok"] == ["c_neg_sum@30d", "c_rows@30d", "c_sent_n@30d"]
+
+
+def test_plan_windows_include_feature_inputs():
+    plan = QueryPlan("v", {"neg": "avg(chat.negative, 7d) > 0"}, {"neg": (set(), (30,))}, "sqlite")
+    assert plan.usable
+    assert plan.windows == [7, 30]
+
+
+def test_placeholder_sources_compile_to_no_query(db, user_id):
+    plan = QueryPlan("v", {"safety_low": "avg(safety, 7d) < 2"}, {}, "sqlite")
+    assert plan.sql is None
+    assert AggregateContext.load(db, user_id, plan) is not None
+
+
+def test_compiled_rules_match_row_by_row_evaluation(db, rows, user_id):
+    texts = [
+        "I feel sad and scared, he has a gun", "I want to die, no reason to live",
+        "feeling calm and grateful today, safe now thank you", "he followed me and installed app spyware",
+        "need a safety plan and a shelter", "tired, exhausted, numb. I can't go on",
+    ]
+    for i, text in enumerate(texts * 3):
+        days = i * 4.5
+        rows.journal(user_id, text, days_ago=days)
+        rows.message(user_id, text, days_ago=days + 1)
+        rows.event(user_id, text, days_ago=days + 2)
+    now = datetime.utcnow()
+    plan = risk_evaluator.query_plan(db)
+    assert plan.usable, plan.errors
+
+    aggregate = AggregateContext.load(db, user_id, plan, now)
+    rowwise = EvaluationContext(db, user_id, now)
+    assert aggregate is not None
+    for _, days, counter in plan.column_map:
+        assert aggregate.stats(days)[counter] == rowwise.stats(days)[counter], (days, counter)
+    features = risk_evaluator.features
+    result = risk_evaluator.combine(risk_evaluator.score_features(aggregate, features))
+    assert result == risk_evaluator.combine(risk_evaluator.score_features(rowwise, features))
+    assert result["score"] > 0
+
+
+def test_legacy_rows_fall_back_to_row_by_row(db, rows, user_id):
+    rows.journal(user_id, "he has a gun", legacy=True)
+    assert AggregateContext.load(db, user_id, risk_evaluator.query_plan(db)) is None
+    # The evaluator still scores the user, decrypting the legacy row
+    assert risk_evaluator.evaluate_user_risk(db, user_id)["feature_scores"]["weapon_indicator"] > 0
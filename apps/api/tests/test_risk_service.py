@@ -0,0 +1,169 @@
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import text as sql_text
+
+from app import models
+from app.nlp_utils import scan_text
+from app.risk_batch import CohortRiskScorer
+from app.risk_engine import latest_snapshot, risk_watermark, snapshot_is_fresh
+from app.risk_service import (
+    bump_risk_revision, evaluate_risk, incremental_engine, invalidate_risk, recompute_risk, risk_cache, risk_evaluator,
+)
+from app.routes.chat import delete_chat_session
+
+
+def _full(db, user_id):
+    """A from-scratch evaluation, bypassing every cache."""
+    result = risk_evaluator.evaluate_user_risk(db, user_id)
+    return result["score"], result["feature_scores"]
+
+
+def _read(db, user_id):
+    result = evaluate_risk(db, user_id)
+    return result["score"], result["feature_scores"]
+
+
+def _seed(rows, user_id):
+    for i in range(4):
+        rows.journal(user_id, "good day, calm and grateful", days_ago=10 + i)
+        rows.message(user_id, "feeling calm today, thank you", days_ago=5 + i)
+
+
+def test_repeat_reads_hit_the_cache(db, rows, user_id):
+    _seed(rows, user_id)
+    first = evaluate_risk(db, user_id)
+    hits = risk_cache.hits
+    assert evaluate_risk(db, user_id) == first
+    assert risk_cache.hits == hits + 1
+
+
+def test_write_in_this_process_invalidates(db, rows, user_id):
+    _seed(rows, user_id)
+    before = _read(db, user_id)
+    text = "I want to die, he has a gun"
+    row = rows.journal(user_id, text)
+    incremental_engine.record_journal(user_id, row, scan_text(text))
+    invalidate_risk(user_id)
+    after = _read(db, user_id)
+    assert after == _full(db, user_id)
+    assert after != before
+
+
+def test_write_from_another_process_misses_the_cache(db, rows, user_id):
+    _seed(rows, user_id)
+    before = _read(db, user_id)
+    # Nothing here is told about these rows; the watermark moves
+    for _ in range(3):
+        rows.message(user_id, "he has a gun and I am scared, I want to die")
+    after = _read(db, user_id)
+    assert after == _full(db, user_id)
+    assert after != before
+
+
+def test_row_dated_ahead_of_the_app_clock_is_caught_up(db, rows, user_id):
+    _seed(rows, user_id)
+    before = incremental_engine.evaluate(db, user_id)
+    # The DB clock runs a few minutes ahead of this process's
+    for _ in range(3):
+        rows.message(user_id, "he has a gun and I am scared, I want to die", days_ago=-5 / 1440)
+    after = incremental_engine.evaluate(db, user_id)
+    ahead = risk_evaluator.evaluate_user_risk(db, user_id, as_of=datetime.utcnow() + timedelta(minutes=10))
+    assert (after["score"], after["feature_scores"]) == (ahead["score"], ahead["feature_scores"])
+    assert after["score"] != before["score"]
+
+
+def _rewrite_messages(db, user_id):
+    db.execute(sql_text(
+        "UPDATE chat_messages SET sentiment_score = -0.6, weapon_involved = :t, threats_to_kill = :t WHERE user_id = :uid"
+    ), {"uid": user_id, "t": True})
+
+
+def test_in_place_update_is_recomputed(db, rows, user_id):
+    _seed(rows, user_id)
+    before = _read(db, user_id)
+    _rewrite_messages(db, user_id)
+    db.commit()
+    recomputed = recompute_risk(db, user_id)
+    assert (recomputed["score"], recomputed["feature_scores"]) == _full(db, user_id) != before
+    assert _read(db, user_id) == _full(db, user_id)
+
+
+def test_in_place_update_elsewhere_misses_the_cache(db, rows, user_id):
+    _seed(rows, user_id)
+    before = _read(db, user_id)
+    # Another worker (deep analysis, re-analysis) rewrites rows and bumps the revision
+    _rewrite_messages(db, user_id)
+    bump_risk_revision(db, user_id)
+    db.commit()
+    after = _read(db, user_id)
+    assert after == _full(db, user_id)
+    assert after != before
+
+
+def _snapshots(db, user_id):
+    db.expire_all()
+    return db.query(models.RiskSnapshot).filter(models.RiskSnapshot.user_id == user_id).count()
+
+
+def _two_sessions(db, rows, user_id):
+    """An older session with high-risk messages and a newer benign one holding the newest ids."""
+    old, new = f"{user_id}-old", f"{user_id}-new"
+    db.add_all([models.ChatSession(user_id=user_id, session_id=s) for s in (old, new)])
+    db.commit()
+    for i in range(3):
+        rows.message(user_id, "he tried to choke me, he has a gun, I want to die", session_id=old, days_ago=3 + i)
+    rows.message(user_id, "feeling calm today, thank you", session_id=new)
+    return old
+
+
+def test_reads_are_served_from_a_fresh_snapshot(db, rows, user_id):
+    _seed(rows, user_id)
+    first = _read(db, user_id)
+    assert _snapshots(db, user_id) == 1
+    snap = latest_snapshot(db, user_id)
+    assert json.loads(snap.watermark) == list(risk_watermark(db, user_id))
+    # Another worker's first read: no cache entry, the snapshot answers
+    risk_cache.invalidate(user_id)
+    assert _read(db, user_id) == first
+    assert _snapshots(db, user_id) == 1
+
+
+def test_deleting_an_older_session_refreshes_risk(db, rows, user_id):
+    old = _two_sessions(db, rows, user_id)
+    before = _read(db, user_id)
+    watermark = risk_watermark(db, user_id)
+    delete_chat_session(old, db=db, user_id=user_id)
+    # The newest ids are untouched; only the revision moved
+    assert risk_watermark(db, user_id)[:3] == watermark[:3]
+    after = _read(db, user_id)
+    assert after == _full(db, user_id)
+    assert after != before
+
+
+def test_delete_elsewhere_expires_cache_and_snapshot(db, rows, user_id):
+    old = _two_sessions(db, rows, user_id)
+    before = _read(db, user_id)
+    snap = latest_snapshot(db, user_id)
+    # Another worker deletes the session; this process's cache and engine are not told
+    db.execute(sql_text("DELETE FROM chat_messages WHERE session_id = :s"), {"s": old})
+    bump_risk_revision(db, user_id)
+    db.commit()
+    assert not snapshot_is_fresh(snap, risk_evaluator.rules_version, risk_watermark(db, user_id), 3600)
+    after = _read(db, user_id)
+    assert after == _full(db, user_id)
+    assert after != before
+
+
+def test_row_written_during_a_batch_run_is_not_served_stale(db, rows, user_id):
+    _seed(rows, user_id)
+    scorer = CohortRiskScorer(risk_evaluator)
+    results, watermarks, now = scorer.score_chunk(db, [user_id])
+    # Written after the chunk was scored, before its snapshots are
+    rows.message(user_id, "he has a gun and I am scared, I want to die")
+    scorer.write_snapshots(db, results, watermarks, now)
+    db.commit()
+    risk_cache.invalidate(user_id)
+    after = _read(db, user_id)
+    assert after == _full(db, user_id)
+    assert after != (results[user_id]["score"], results[user_id]["feature_scores"])